@@ -1,23 +1,55 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from injector import Injector
+from injector import Injector, InstanceProvider, SingletonScope
 from api.server.ragchat.ragchat_router import ragchat_router
+from api.server.health.health_router import health_router
+from api.server.health.health_service import HealthService
+from api.components.llm.llmodel_component import LLModelComponent
+from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
 from api.settings.settings import Settings
 
 logger = logging.getLogger(__name__)
 
+def built(injector: Injector, interface: type):
+    """The singleton of ``interface`` if the injector already built it, else None.
+
+    Shutdown only closes what was used, resolving a component there would
+    load its models and open its connections just to close them again.
+    """
+    binding, _ = injector.binder.get_binding(interface)
+    if not isinstance(binding.provider, InstanceProvider) and interface not in injector.get(SingletonScope)._context:
+        return None
+    return injector.get(interface)
+
 def create_app(injector: Injector) -> FastAPI:
 
     async def bind_injector_to_request(request: Request) -> None:
         request.state.injector = injector
     
-    app = FastAPI( title="ARAH Chat API", description="API for the ARAH Chat",dependencies=[Depends(bind_injector_to_request)])
-    app.include_router(ragchat_router)
-
     ragsettings = injector.get(Settings)
 
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # load the models and open the connections before the first request
+        if ragsettings.server.warmup:
+            injector.get(HealthService).start()
+        yield
+        # write the queued history turns before the process exits
+        history = built(injector, MongoChatHistoryComponent)
+        if history is not None:
+            await asyncio.to_thread(history.close)
+        llm = built(injector, LLModelComponent)
+        if llm is not None:
+            await llm.aclose()
+
+    app = FastAPI( title="ARAH Chat API", description="API for the ARAH Chat",dependencies=[Depends(bind_injector_to_request)], lifespan=lifespan)
+    app.include_router(ragchat_router)
+    app.include_router(health_router)
+
     if ragsettings.server.cors.enabled:
         app.add_middleware(
             CORSMiddleware,
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from injector import inject, singleton
+from langchain_core.documents import Document
+
+from api.settings.settings import Settings
+from api.components.embedding.embedmodel_component import EmbedModelComponent
+from api.components.metrics.metrics_component import MetricsComponent
+from api.components.qdrant.collection import read_revision
+from api.components.qdrant.qdrant_component import QdrantComponent
+
+logger = logging.getLogger(__name__)
+
+@singleton
+class AnswerCacheComponent:
+    """Semantic cache of answers keyed by the embedding of the standalone question.
+
+    Entries are grouped per Qdrant collection and dropped when the collection
+    fingerprint (point/vector counts and the content revision recorded by
+    embeddocs.py) changes, so re-ingested documents are never answered from
+    stale context.
+    """
+
+    @inject
+    def __init__(self, settings: Settings, qdrant: QdrantComponent, embedding: EmbedModelComponent, metrics: MetricsComponent) -> None:
+        self.settings = settings.rag.answer_cache
+        self.enabled = self.settings.enabled
+        self.collection_name = settings.qdrant.vector_collectionname
+        self.client = qdrant.client
+        self.embed_model = embedding.embed_model
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._entries: dict[str, OrderedDict[int, dict[str, Any]]] = {}
+        self._matrices: dict[str, Optional[tuple[list[int], np.ndarray]]] = {}
+        self._fingerprints: dict[str, Any] = {}
+        self._last_check = 0.0
+        self._check_lock = threading.Lock()
+        self._next_id = 0
+        if self.enabled:
+            logger.info("Initializing AnswerCacheComponent")
+
+    def _collection_fingerprint(self, collection_name: str) -> Any:
+        info = self.client.get_collection(collection_name)
+        # the revision changes with an ingestion that keeps the number of chunks
+        return (info.points_count, info.vectors_count, read_revision(self.client, collection_name))
+
+    def _check_collection(self, collection_name: str) -> None:
+        # a single request checks at a time, the others use the cache as is
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now - self._last_check < self.settings.collection_check_interval_seconds:
+                return
+            self._last_check = now
+            try:
+                fingerprint = self._collection_fingerprint(collection_name)
+            except Exception as e:
+                logger.warning(f"Could not read collection {collection_name}, answer cache left as is: {e}")
+                return
+            if self._fingerprints.get(collection_name) != fingerprint:
+                if collection_name in self._fingerprints:
+                    logger.info(f"Collection {collection_name} changed, invalidating cached answers")
+                self.invalidate(collection_name)
+                self._fingerprints[collection_name] = fingerprint
+        finally:
+            self._check_lock.release()
+
+    def invalidate(self, collection_name: Optional[str] = None) -> None:
+        with self._lock:
+            names = [collection_name] if collection_name else list(self._entries)
+            for name in names:
+                dropped = len(self._entries.pop(name, {}))
+                self._matrices.pop(name, None)
+                if dropped:
+                    self.metrics.incr("answer_cache.invalidated", dropped)
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_model.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, collection_name: str) -> Optional[tuple[list[int], np.ndarray]]:
+        if self._matrices.get(collection_name) is None:
+            entries = self._entries.get(collection_name)
+            if not entries:
+                return None
+            self._matrices[collection_name] = (list(entries), np.vstack([entry["vector"] for entry in entries.values()]))
+        return self._matrices[collection_name]
+
+    def lookup(self, question: str) -> Optional[dict[str, Any]]:
+        """Return the cached ``answer`` and ``context`` of the closest question above the threshold"""
+        if not self.enabled:
+            return None
+        self._check_collection(self.collection_name)
+        vector = self._embed(question)
+        with self._lock:
+            matrix = self._matrix(self.collection_name)
+            if matrix is not None:
+                ids, vectors = matrix
+                scores = vectors @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.settings.similarity_threshold:
+                    entries = self._entries[self.collection_name]
+                    entries.move_to_end(ids[best])
+                    self.metrics.incr("answer_cache.hit")
+                    entry = entries[ids[best]]
+                    return {"answer": entry["answer"], "context": entry["context"]}
+        self.metrics.incr("answer_cache.miss")
+        return None
+
+    def store(self, question: str, answer: str, context: list[Document]) -> None:
+        if not self.enabled:
+            return
+        vector = self._embed(question)
+        with self._lock:
+            entries = self._entries.setdefault(self.collection_name, OrderedDict())
+            entries[self._next_id] = {"vector": vector, "answer": answer, "context": context}
+            self._next_id += 1
+            while len(entries) > self.settings.max_size:
+                entries.popitem(last=False)
+                self.metrics.incr("answer_cache.evicted")
+            self._matrices[self.collection_name] = None
@@ -0,0 +1,186 @@
+import logging
+import os
+import re
+from typing import List, Optional
+
+from injector import inject, singleton
+from langchain_core.documents import Document
+
+from api.settings.settings import Settings
+from api.components.metrics.metrics_component import MetricsComponent
+
+logger = logging.getLogger(__name__)
+
+# shortest text shared by the end of a chunk and the start of another taken as their overlap
+MIN_OVERLAP_CHARS = 20
+# chunks of a page at most this many characters apart are adjacent, the splitter separator
+ADJACENT_GAP_CHARS = 2
+# words per shingle of the near-duplicate detection
+SHINGLE_WORDS = 3
+_WORD_PATTERN = re.compile(r"\w+")
+
+def text_overlap(a: str, b: str, min_chars: int = MIN_OVERLAP_CHARS) -> int:
+    """Length of the longest end of ``a`` that ``b`` starts with, 0 below ``min_chars``"""
+    head = b[:min_chars]
+    if len(head) < min_chars:
+        return 0
+    position = a.find(head)
+    while position != -1:
+        if b.startswith(a[position:]):
+            return len(a) - position
+        position = a.find(head, position + 1)
+    return 0
+
+def shingles(text: str) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+class _Passage:
+    """Text of one chunk or of several merged chunks of a page"""
+
+    def __init__(self, doc: Document, rank: int) -> None:
+        self.text = doc.page_content
+        self.metadata = doc.metadata
+        self.start: Optional[int] = doc.metadata.get("start_index")
+        self.rank = rank
+        self.chunks = 1
+
+    def absorb(self, other: "_Passage") -> bool:
+        """Merge a passage of the same page into this one if they overlap or touch"""
+        if self.start is not None and other.start is not None:
+            first, second = (self, other) if self.start <= other.start else (other, self)
+            end = first.start + len(first.text)
+            if second.start > end + ADJACENT_GAP_CHARS:
+                return False
+            if second.start + len(second.text) <= end:
+                text = first.text
+            elif second.start <= end:
+                text = first.text + second.text[end - second.start:]
+            else:
+                text = first.text + "\n\n" + second.text
+            self.start = first.start
+        elif other.text in self.text:
+            text = self.text
+        elif self.text in other.text:
+            text = other.text
+        else:
+            after, before = text_overlap(self.text, other.text), text_overlap(other.text, self.text)
+            if after:
+                text = self.text + other.text[after:]
+            elif before:
+                text = other.text + self.text[before:]
+            else:
+                return False
+        self.text = text
+        if other.rank < self.rank:
+            self.rank = other.rank
+            self.metadata = other.metadata
+        self.chunks += other.chunks
+        return True
+
+@singleton
+class ContextPackingComponent:
+    """Packing of the retrieved chunks into the context of the answer prompt.
+
+    Chunks of the same source page that overlap (the ``chunk_overlap`` of
+    the ingestion) or follow each other are merged into one passage, using
+    their ``start_index`` when the ingestion stored it and the overlapping
+    text otherwise. Passages whose word shingles are mostly found in a
+    better ranked passage are dropped. The passages are then kept by rank
+    while they fit in ``token_budget`` tokens, counted with the
+    ``tokenizer`` of the model or estimated at four characters per token,
+    and numbered ``[n]`` with a short ``file p.page`` citation.
+    """
+
+    @inject
+    def __init__(self, settings: Settings, metrics: MetricsComponent) -> None:
+        self.settings = settings.rag.context_packing
+        self.enabled = self.settings.enabled
+        self.metrics = metrics
+        self.tokenizer = None
+        if self.enabled and self.settings.tokenizer:
+            logger.info("Initializing ContextPackingComponent")
+            from transformers import AutoTokenizer
+
+            self.tokenizer = AutoTokenizer.from_pretrained(self.settings.tokenizer)
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text) // 4 + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """First ``tokens`` tokens of the text"""
+        if self.tokenizer is None:
+            return text[:max(tokens - 1, 0) * 4]
+        return self.tokenizer.decode(self.tokenizer.encode(text, add_special_tokens=False)[:tokens])
+
+    @staticmethod
+    def citation(number: int, metadata: dict) -> str:
+        source = os.path.basename(str(metadata.get("source", "")))
+        page = metadata.get("page")
+        return f"[{number}] {source}" + ("" if page is None else f" p.{page}")
+
+    def _merge(self, docs: List[Document]) -> List[_Passage]:
+        pages: dict = {}
+        for rank, doc in enumerate(docs):
+            passage = _Passage(doc, rank)
+            passages = pages.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), [])
+            # an absorbed passage may now touch another one of the page
+            while True:
+                merged = next((index for index, kept in enumerate(passages) if passage.absorb(kept)), None)
+                if merged is None:
+                    break
+                passages.pop(merged)
+            passages.append(passage)
+        return sorted((passage for passages in pages.values() for passage in passages), key=lambda passage: passage.rank)
+
+    def _deduplicate(self, passages: List[_Passage]) -> List[_Passage]:
+        kept, kept_shingles = [], []
+        for passage in passages:
+            words = shingles(passage.text)
+            if any(len(words & other) >= self.settings.duplicate_threshold * min(len(words), len(other)) for other in kept_shingles):
+                continue
+            kept.append(passage)
+            kept_shingles.append(words)
+        return kept
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """Merged, deduplicated passages fitting the token budget, best ranked first"""
+        if not docs:
+            return docs
+        merged = self._merge(docs)
+        passages = self._deduplicate(merged)
+        packed, used = [], 0
+        for passage in passages:
+            header = self.citation(len(packed) + 1, passage.metadata) + "\n" if self.settings.citations else ""
+            tokens = self.count_tokens(header + passage.text)
+            text = passage.text
+            if used + tokens > self.settings.token_budget:
+                if packed:
+                    continue
+                # the best passage alone is over the budget, keep its start
+                text = self.truncate(text, self.settings.token_budget - self.count_tokens(header))
+                tokens = self.count_tokens(header + text)
+            used += tokens
+            metadata = {**passage.metadata, "citation": len(packed) + 1, "merged_chunks": passage.chunks}
+            if passage.start is not None:
+                metadata["start_index"] = passage.start
+            packed.append(Document(page_content=text, metadata=metadata))
+        self.metrics.incr("context.chunks", len(docs))
+        self.metrics.incr("context.merged", len(docs) - len(merged))
+        self.metrics.incr("context.duplicates", len(merged) - len(passages))
+        self.metrics.incr("context.over_budget", len(passages) - len(packed))
+        self.metrics.record("context.tokens", used)
+        return packed
+
+    def format(self, docs: List[Document]) -> str:
+        """Context of the answer prompt, the passages with their citations"""
+        if not self.settings.citations:
+            return "\n\n".join(doc.page_content for doc in docs)
+        return "\n\n".join(
+            self.citation(doc.metadata.get("citation", number), doc.metadata) + "\n" + doc.page_content
+            for number, doc in enumerate(docs, start=1)
+        )
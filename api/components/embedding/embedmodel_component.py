@@ -2,19 +2,40 @@ import logging
 
 from injector import inject, singleton
 from api.settings.settings import Settings
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+from api.components.embedding.query_cache import CachedQueryEmbeddings
+from api.components.metrics.metrics_component import MetricsComponent
+from api.components.embedding.engines import build_embeddings
+from langchain_core.embeddings import Embeddings
 
 
 logger = logging.getLogger(__name__)
 
 @singleton
 class EmbedModelComponent:
-    embed_model: HuggingFaceEmbeddings
+    embed_model: Embeddings
 
     @inject
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, metrics: MetricsComponent) -> None:
         logger.info("Initializing EmbedModelComponent")
-        self.embed_model = HuggingFaceEmbeddings(
-            model_name=settings.embeddings.embed_name
+        self.embed_model = build_embeddings(
+            settings.embeddings.embed_name,
+            engine=settings.embeddings.engine,
+            batch_size=settings.embeddings.batch_size,
+            num_threads=settings.embeddings.num_threads,
+            device=settings.embeddings.device,
+            onnx_cache_dir=settings.embeddings.onnx_cache_dir,
+            inference_server_url=settings.embeddings.inference_server_url,
+            api_key=settings.embeddings.api_key,
+            timeout_seconds=settings.embeddings.request_timeout_seconds,
+            max_connections=settings.embeddings.max_connections,
+            coalesce_window_ms=settings.embeddings.coalesce_window_ms,
         )
-        
\ No newline at end of file
+        if settings.embeddings.query_cache_size > 0:
+            self.embed_model = CachedQueryEmbeddings(
+                self.embed_model,
+                settings.embeddings.embed_name,
+                max_size=settings.embeddings.query_cache_size,
+                ttl_seconds=settings.embeddings.query_cache_ttl_seconds,
+                persist_path=settings.embeddings.query_cache_path,
+                metrics=metrics,
+            )
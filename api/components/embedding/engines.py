@@ -0,0 +1,146 @@
+import logging
+import os
+from typing import List, Literal, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EmbeddingEngine = Literal["sentence_transformers", "onnx", "onnx_int8", "remote"]
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled, normalized sentence embeddings computed with ONNX Runtime.
+
+    The model is exported from the Hugging Face checkpoint on first use and
+    kept under ``cache_dir``. With ``quantize`` the exported graph is also
+    dynamically quantized to int8, which is usually 2-3x faster on CPU for a
+    small loss of accuracy. Texts are sorted by length before batching so
+    each batch is padded as little as possible.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str,
+        batch_size: int = 32,
+        num_threads: Optional[int] = None,
+        quantize: bool = False,
+        max_length: int = 512,
+    ) -> None:
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError as error:
+            raise ImportError(
+                "The onnx embedding engines need optimum with onnxruntime, "
+                "install it with `pip install optimum[onnxruntime]`"
+            ) from error
+
+        self.batch_size = batch_size
+        self.max_length = max_length
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        export_dir = os.path.join(cache_dir, model_name.replace("/", "--"))
+        if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+            logger.info("Exporting %s to ONNX in %s", model_name, export_dir)
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+        file_name = "model.onnx"
+        if quantize:
+            file_name = "model_quantized.onnx"
+            if not os.path.exists(os.path.join(export_dir, file_name)):
+                logger.info("Quantizing %s to int8", model_name)
+                quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+                quantizer.quantize(
+                    save_dir=export_dir,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+                )
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            export_dir, file_name=file_name, session_options=session_options, provider="CPUExecutionProvider"
+        )
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for index, vector in zip(batch, self._encode([texts[index] for index in batch])):
+                vectors[index] = vector.tolist()
+        return vectors  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+def build_embeddings(
+    model_name: str,
+    engine: EmbeddingEngine = "sentence_transformers",
+    batch_size: int = 32,
+    num_threads: Optional[int] = None,
+    device: str = "cpu",
+    onnx_cache_dir: str = "models/onnx",
+    inference_server_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    timeout_seconds: float = 10,
+    max_connections: int = 20,
+    coalesce_window_ms: float = 5,
+) -> Embeddings:
+    """Build the embedding model of the given engine.
+
+    ``sentence_transformers`` is the plain PyTorch path, ``onnx`` and
+    ``onnx_int8`` run the exported (and quantized) model with ONNX Runtime,
+    on CPU only. ``remote`` loads nothing in-process and calls the
+    OpenAI-compatible embeddings server at ``inference_server_url``.
+    """
+    logger.info("Loading %s embeddings with the %s engine", model_name, engine)
+    if engine == "remote":
+        from api.components.embedding.remote import RemoteEmbeddings
+
+        if not inference_server_url:
+            raise ValueError("The remote embedding engine needs an inference_server_url")
+        return RemoteEmbeddings(
+            inference_server_url,
+            model_name,
+            api_key=api_key,
+            batch_size=batch_size,
+            timeout_seconds=timeout_seconds,
+            max_connections=max_connections,
+            coalesce_window_ms=coalesce_window_ms,
+        )
+    if engine == "sentence_transformers":
+        from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+
+        if num_threads:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": device},
+            encode_kwargs={"batch_size": batch_size},
+        )
+    if engine in ("onnx", "onnx_int8"):
+        return OnnxEmbeddings(
+            model_name,
+            onnx_cache_dir,
+            batch_size=batch_size,
+            num_threads=num_threads,
+            quantize=engine == "onnx_int8",
+        )
+    raise ValueError(f"Unknown embedding engine {engine}")
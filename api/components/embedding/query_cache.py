@@ -0,0 +1,146 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from api.components.metrics.metrics_component import MetricsComponent
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper caching query embeddings in a bounded LRU with a TTL.
+
+    Keys are the model name and the whitespace-normalized query text. When
+    ``persist_path`` is set, entries are also kept in a SQLite file so they
+    survive restarts and are shared between workers on the same host.
+    New entries are written to SQLite by a writer thread, the entries
+    arriving while a write is pending go in the same transaction, and the
+    SQLite reads do not hold the lock of the in-memory LRU.
+    Document embeddings are passed through untouched.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        max_size: int,
+        ttl_seconds: float,
+        persist_path: Optional[str] = None,
+        metrics: Optional[MetricsComponent] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, tuple[float, List[float]]] = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._pending: List[tuple[str, float, str]] = []
+        self._flush_scheduled = False
+        self._writer = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, created REAL, vector TEXT)"
+            )
+            self._db.commit()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-cache-writer")
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}\x00{_WHITESPACE.sub(' ', text).strip()}"
+
+    def _count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.incr(f"embedding.query_cache.{name}")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._cache.move_to_end(key)
+                    self._count("hit")
+                    return entry[1]
+                del self._cache[key]
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT created, vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and not self._expired(row[0]):
+                vector = json.loads(row[1])
+                with self._lock:
+                    self._remember(key, row[0], vector)
+                self._count("disk_hit")
+                return vector
+        self._count("miss")
+        return None
+
+    def _remember(self, key: str, created: float, vector: List[float]) -> None:
+        self._cache[key] = (created, vector)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self._count("evicted")
+
+    def _put(self, key: str, vector: List[float]) -> None:
+        created = time.time()
+        schedule = False
+        with self._lock:
+            self._remember(key, created, vector)
+            if self._db is not None:
+                self._pending.append((key, created, json.dumps(vector)))
+                schedule = not self._flush_scheduled
+                self._flush_scheduled = True
+        if schedule:
+            self._writer.submit(self.flush)
+
+    def flush(self) -> None:
+        """Write the pending entries to SQLite in one transaction"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._flush_scheduled = False
+        if not rows:
+            return
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings (key, created, vector) VALUES (?, ?, ?)", rows
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error persisting {len(rows)} query embeddings: {e}")
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._pending = []
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM query_embeddings")
+                self._db.commit()
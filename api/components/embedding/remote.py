@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+class RemoteEmbeddings(Embeddings):
+    """Client of an OpenAI-compatible ``/embeddings`` endpoint.
+
+    Requests share one pooled keep-alive HTTP client. Documents are sent in
+    batches of ``batch_size`` texts. Concurrent ``embed_query`` calls are
+    coalesced: a background thread collects the queries arriving within
+    ``coalesce_window_ms`` of the first one (up to ``batch_size``) and sends
+    them in a single request, so a burst of users costs one round trip.
+    The batches are sent from a pool of ``max_connections`` threads, a slow
+    request does not hold back the batches formed after it.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model_name: str,
+        api_key: Optional[str] = None,
+        batch_size: int = 32,
+        timeout_seconds: float = 10,
+        max_connections: int = 20,
+        max_retries: int = 2,
+        coalesce_window_ms: float = 5,
+    ) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.coalesce_window = coalesce_window_ms / 1000
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.Client(
+            base_url=base_url.rstrip("/"),
+            headers=headers,
+            timeout=httpx.Timeout(timeout_seconds),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._queries: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="embedding-sender")
+        self._worker = threading.Thread(target=self._coalesce_queries, name="embedding-coalescer", daemon=True)
+        self._worker.start()
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.post("/embeddings", json={"model": self.model_name, "input": texts})
+                response.raise_for_status()
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError) as error:
+                retryable = isinstance(error, httpx.TransportError) or error.response.status_code >= 500
+                if not retryable or attempt == self.max_retries:
+                    raise
+                logger.warning("Embedding request failed (%s), retrying", error)
+                time.sleep(0.1 * 2 ** attempt)
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def _coalesce_queries(self) -> None:
+        while True:
+            batch = [self._queries.get()]
+            deadline = time.monotonic() + self.coalesce_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queries.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._senders.submit(self._send_queries, batch)
+
+    def _send_queries(self, batch: List[tuple[str, Future]]) -> None:
+        try:
+            vectors = self._request([text for text, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._request(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queries.put((text, future))
+        return future.result()
+
+    def close(self) -> None:
+        self._senders.shutdown(wait=True)
+        self.client.close()
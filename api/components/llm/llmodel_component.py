@@ -1,31 +1,123 @@
+import asyncio
 import logging
-from collections.abc import Callable
-from typing import Any
+
+import httpx
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
 
-from api.settings.settings import Settings
+from api.components.llm.router import LLMBackend, LLMRouter
+from api.components.llm.slots import SlotAffinity
+from api.components.metrics.metrics_component import MetricsComponent
+from api.settings.settings import ARAHLLMBackendSettings, Settings
 from injector import inject, singleton
 
 logger = logging.getLogger(__name__)
 
 @singleton
 class LLModelComponent:
+    """OpenAI-compatible clients of the inference servers.
+
+    Every backend has one keep-alive connection pool per sync/async client,
+    at most ``max_in_flight`` requests are open at a time and failed requests
+    are retried with backoff by the OpenAI client. The chains use
+    ``rephrase_llm`` and ``answer_llm``, which route each request to a
+    backend of that role through the ``LLMRouter``. With ``slot_affinity``
+    the requests of a session are also pinned to one of the parallel slots
+    of its backend, so the prompt cache is reused across the turns of the
+    conversation; ``cache_prompt`` asks for the cache without pinning.
+    """
     llm: ChatOpenAI
+    rephrase_llm: Runnable
+    answer_llm: Runnable
 
     @inject
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, metrics: MetricsComponent) -> None:
         logger.info("Initializing LLModelComponent")
+        self.settings = settings.llm
+        self._http_clients: list[httpx.Client] = []
+        self._async_http_clients: list[httpx.AsyncClient] = []
+        backends = self.settings.backends or [
+            ARAHLLMBackendSettings(
+                name="default",
+                inference_server_url=self.settings.inference_server_url,
+                llm_name=self.settings.llm_name,
+                api_key=self.settings.api_key,
+                parallel_slots=self.settings.parallel_slots,
+            )
+        ]
+        self.router = LLMRouter(
+            [self._build_backend(backend) for backend in backends],
+            metrics,
+            routing=self.settings.routing,
+            failure_threshold=self.settings.circuit_failure_threshold,
+            reset_seconds=self.settings.circuit_reset_seconds,
+        )
+        missing = {"rephrase", "answer"} - {role for backend in self.router.backends for role in backend.roles}
+        if missing:
+            raise ValueError(f"No LLM backend has the role(s): {', '.join(sorted(missing))}")
+        # the client of the first answer backend, for direct use outside the chains
+        self.llm = next(backend.llm for backend in self.router.backends if "answer" in backend.roles)
+        self.rephrase_llm = self.router.runnable("rephrase")
+        self.answer_llm = self.router.runnable("answer")
+        if self.settings.health_check_interval_seconds is not None:
+            self.router.start_health_checks(self.settings.health_check_interval_seconds, self.settings.connect_timeout_seconds)
+
+    def _build_backend(self, backend: ARAHLLMBackendSettings) -> LLMBackend:
+        timeout = httpx.Timeout(
+            self.settings.request_timeout_seconds,
+            connect=self.settings.connect_timeout_seconds,
+            # waiting for a free connection is bounded by the generation scheduler
+            pool=None,
+        )
+        limits = httpx.Limits(
+            max_connections=self.settings.max_in_flight,
+            max_keepalive_connections=self.settings.max_in_flight,
+            keepalive_expiry=self.settings.keepalive_expiry_seconds,
+        )
+        http_client = httpx.Client(timeout=timeout, limits=limits)
+        http_async_client = httpx.AsyncClient(timeout=timeout, limits=limits)
+        self._http_clients.append(http_client)
+        self._async_http_clients.append(http_async_client)
         kwargs = {
             k: v
             for k, v in [
-                ("model",settings.llm.llm_name),
-                ("openai_api_key", settings.llm.api_key),
-                ("openai_api_base", settings.llm.inference_server_url),
-                ("temperature", 0),
-                ("streaming", settings.llm.stream)
+                ("model", backend.llm_name),
+                ("openai_api_key", backend.api_key),
+                ("openai_api_base", backend.inference_server_url),
+                ("temperature", self.settings.temperature),
+                ("max_tokens", self.settings.max_tokens),
+                ("streaming", self.settings.stream),
+                ("request_timeout", timeout),
+                ("max_retries", self.settings.max_retries),
+                ("http_client", http_client),
+                ("http_async_client", http_async_client),
             ]
             if v is not None
         }
-        self.llm = ChatOpenAI(**kwargs)
-        
+        return LLMBackend(
+            backend.name,
+            ChatOpenAI(**kwargs),
+            backend.inference_server_url,
+            weight=backend.weight,
+            roles=tuple(backend.roles),
+            parallel_slots=backend.parallel_slots,
+            slots=SlotAffinity(backend.parallel_slots) if self.settings.slot_affinity else None,
+            cache_prompt=self.settings.cache_prompt,
+        )
+
+    def warm_up(self) -> None:
+        """Open a connection to every backend with a one token generation"""
+        for backend in self.router.backends:
+            backend.llm.bind(max_tokens=1).invoke("ping")
+
+    def close(self) -> None:
+        """Stop the health checks and close the sync connection pools"""
+        self.router.close()
+        for client in self._http_clients:
+            client.close()
 
+    async def aclose(self) -> None:
+        """Close everything ``close`` does and the async connection pools, on the event loop they were used on"""
+        await asyncio.to_thread(self.close)
+        for client in self._async_http_clients:
+            await client.aclose()
@@ -0,0 +1,300 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator
+from typing import Any, Optional
+
+import httpx
+import openai
+from langchain_core.messages import BaseMessageChunk
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_openai import ChatOpenAI
+
+from api.components.llm.slots import SlotAffinity
+from api.components.metrics.metrics_component import MetricsComponent
+
+logger = logging.getLogger(__name__)
+
+# weight of the last request in the moving average of the time to first chunk
+LATENCY_ALPHA = 0.2
+# errors of the backend itself, a 4xx is an error of the request and fails on every backend alike
+BACKEND_ERRORS = (
+    httpx.TransportError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    ConnectionError,
+    TimeoutError,
+)
+
+def is_backend_error(error: Exception) -> bool:
+    if isinstance(error, BACKEND_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class LLMBackend:
+    """One inference server: its client, load and health"""
+
+    def __init__(
+        self,
+        name: str,
+        llm: ChatOpenAI,
+        base_url: str,
+        weight: float = 1,
+        roles: tuple[str, ...] = ("rephrase", "answer"),
+        parallel_slots: int = 1,
+        slots: Optional[SlotAffinity] = None,
+        cache_prompt: bool = False,
+    ) -> None:
+        self.name = name
+        self.llm = llm
+        self.base_url = base_url.rstrip("/")
+        self.weight = weight
+        self.roles = roles
+        self.parallel_slots = parallel_slots
+        self.slots = slots
+        self.cache_prompt = cache_prompt
+        self.outstanding = 0
+        # moving average of the seconds to the first chunk, None until the first request
+        self.latency: Optional[float] = None
+        self.healthy = True
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # half-open circuit: the one request testing the backend is running
+        self.trial_in_flight = False
+
+    def trial_due(self, now: float, reset_seconds: float) -> bool:
+        """The circuit is open for long enough and no trial request is running"""
+        return self.opened_at is not None and not self.trial_in_flight and now - self.opened_at >= reset_seconds
+
+    def available(self, now: float, reset_seconds: float) -> bool:
+        """Healthy and the circuit is closed, or due for a trial request"""
+        return self.healthy and (self.opened_at is None or self.trial_due(now, reset_seconds))
+
+    def bound(self, slot: Optional[int]) -> Runnable:
+        # llama.cpp server: run in the slot and keep the prompt in its cache
+        extra_body: dict[str, Any] = {}
+        if slot is not None:
+            extra_body["id_slot"] = slot
+        if slot is not None or self.cache_prompt:
+            extra_body["cache_prompt"] = True
+        return self.llm.bind(extra_body=extra_body) if extra_body else self.llm
+
+    def state(self) -> dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "circuit": "closed" if self.opened_at is None else "half_open" if self.trial_in_flight else "open",
+            "outstanding": self.outstanding,
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+            "weight": self.weight,
+            "roles": list(self.roles),
+        }
+
+class LLMRouter:
+    """Balancing of the generations over several inference servers.
+
+    Each request goes to a backend serving its role ('rephrase' or
+    'answer'), picked among the healthy ones with a closed circuit by
+    least outstanding requests per weight, or by that load times the moving
+    average of the time to the first chunk ('latency'). The requests of a
+    session and role stick to their last backend while that one has a free
+    slot, so the prompt cache of the server is reused. After ``failure_threshold`` consecutive failures
+    the circuit of a backend opens for ``reset_seconds``, then it lets a
+    single trial request through (half-open) while the other requests skip
+    the backend: a success closes the circuit, a failure opens it again. A request failing before its first chunk
+    on a connection error, a timeout or a 5xx is retried on another backend,
+    other errors (e.g. a 400 for a prompt over the context size) are raised
+    without counting against the backend. When no backend is available the request
+    is tried on all of them anyway rather than failed upfront.
+    """
+
+    def __init__(
+        self,
+        backends: list[LLMBackend],
+        metrics: MetricsComponent,
+        routing: str = "least_outstanding",
+        failure_threshold: int = 3,
+        reset_seconds: float = 30,
+        max_sessions: int = 10000,
+    ) -> None:
+        self.backends = backends
+        self.metrics = metrics
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # (session_id, role) -> backend of its last request
+        self._sessions: OrderedDict[tuple[str, str], LLMBackend] = OrderedDict()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def _score(self, backend: LLMBackend) -> float:
+        load = (backend.outstanding + 1) / backend.weight
+        if self.routing == "latency":
+            # backends without a measure yet go first, they get one quickly
+            return load * (backend.latency or 0.0)
+        return load
+
+    def pick(self, role: str, session_id: Optional[str] = None, exclude: frozenset = frozenset()) -> LLMBackend:
+        return self._pick(role, session_id, exclude)[0]
+
+    def _pick(self, role: str, session_id: Optional[str], exclude: frozenset) -> tuple[LLMBackend, bool]:
+        """The backend of the request, and whether the request is the trial of its half-open circuit"""
+        with self._lock:
+            candidates = [backend for backend in self.backends if role in backend.roles and backend.name not in exclude]
+            if not candidates:
+                raise RuntimeError(f"No LLM backend left for the '{role}' requests")
+            now = time.monotonic()
+            available = [backend for backend in candidates if backend.available(now, self.reset_seconds)]
+            if not available:
+                self.metrics.incr("llm.no_available_backend")
+                available = candidates
+            key = (session_id, role)
+            backend = self._sessions.get(key) if session_id else None
+            if backend not in available or backend.outstanding >= backend.parallel_slots:
+                backend = min(available, key=self._score)
+            if session_id:
+                self._sessions[key] = backend
+                self._sessions.move_to_end(key)
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            backend.outstanding += 1
+            trial = backend.trial_due(now, self.reset_seconds)
+            if trial:
+                backend.trial_in_flight = True
+            return backend, trial
+
+    def _done(self, backend: LLMBackend, latency: Optional[float], failed: bool, trial: bool = False) -> None:
+        """Record the end of a request, ``latency`` is None if it ended before its first chunk"""
+        with self._lock:
+            backend.outstanding -= 1
+            if trial:
+                backend.trial_in_flight = False
+            if failed:
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    if backend.opened_at is None:
+                        logger.warning("LLM backend %s failed %d times in a row, opening its circuit", backend.name, backend.failures)
+                        self.metrics.incr("llm.circuit_opened")
+                    backend.opened_at = time.monotonic()
+                self.metrics.incr(f"llm.{backend.name}.failures")
+                return
+            if latency is None:
+                # cancelled by the caller, says nothing about the backend
+                return
+            backend.latency = latency if backend.latency is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * backend.latency
+            )
+            if backend.opened_at is not None:
+                logger.info("LLM backend %s recovered, closing its circuit", backend.name)
+            backend.failures = 0
+            backend.opened_at = None
+            backend.trial_in_flight = False
+        self.metrics.incr(f"llm.{backend.name}.requests")
+        self.metrics.observe(f"llm.{backend.name}.first_chunk", latency)
+
+    @staticmethod
+    def _session_id(config: RunnableConfig) -> Optional[str]:
+        return config.get("configurable", {}).get("session_id") or None
+
+    def _can_fail_over(self, role: str, tried: set, error: Exception) -> bool:
+        left = [backend for backend in self.backends if role in backend.roles and backend.name not in tried]
+        if left:
+            logger.warning("LLM request failed on %s (%s), retrying on another backend", ", ".join(sorted(tried)), error)
+            self.metrics.incr("llm.failovers")
+        return bool(left)
+
+    def stream(self, role: str, input: Any, config: RunnableConfig) -> Iterator[BaseMessageChunk]:
+        session_id = self._session_id(config)
+        tried: set = set()
+        while True:
+            backend, trial = self._pick(role, session_id, frozenset(tried))
+            tried.add(backend.name)
+            slot = backend.slots.acquire((session_id, role)) if backend.slots is not None and session_id else None
+            start = time.perf_counter()
+            latency = None
+            failed = False
+            try:
+                for chunk in backend.bound(slot).stream(input, config):
+                    if latency is None:
+                        latency = time.perf_counter() - start
+                    yield chunk
+                latency = time.perf_counter() - start if latency is None else latency
+                return
+            except Exception as error:
+                if not is_backend_error(error):
+                    raise
+                failed = True
+                if latency is not None or not self._can_fail_over(role, tried, error):
+                    raise
+            finally:
+                if slot is not None:
+                    backend.slots.release(slot)
+                self._done(backend, latency, failed, trial)
+
+    async def astream(self, role: str, input: Any, config: RunnableConfig) -> AsyncIterator[BaseMessageChunk]:
+        session_id = self._session_id(config)
+        tried: set = set()
+        while True:
+            backend, trial = self._pick(role, session_id, frozenset(tried))
+            tried.add(backend.name)
+            slot = backend.slots.acquire((session_id, role)) if backend.slots is not None and session_id else None
+            start = time.perf_counter()
+            latency = None
+            failed = False
+            try:
+                async for chunk in backend.bound(slot).astream(input, config):
+                    if latency is None:
+                        latency = time.perf_counter() - start
+                    yield chunk
+                latency = time.perf_counter() - start if latency is None else latency
+                return
+            except Exception as error:
+                if not is_backend_error(error):
+                    raise
+                failed = True
+                if latency is not None or not self._can_fail_over(role, tried, error):
+                    raise
+            finally:
+                if slot is not None:
+                    backend.slots.release(slot)
+                self._done(backend, latency, failed, trial)
+
+    def runnable(self, role: str) -> Runnable:
+        """Chat model runnable routing its requests over the backends of ``role``"""
+        def stream(input: Any, config: RunnableConfig) -> Iterator[BaseMessageChunk]:
+            yield from self.stream(role, input, config)
+
+        async def astream(input: Any, config: RunnableConfig) -> AsyncIterator[BaseMessageChunk]:
+            async for chunk in self.astream(role, input, config):
+                yield chunk
+
+        return RunnableLambda(stream, afunc=astream).with_config(run_name=f"llm_{role}")
+
+    def check_health(self, client: httpx.Client) -> None:
+        """Probe the ``/models`` endpoint of every backend"""
+        for backend in self.backends:
+            try:
+                healthy = client.get(f"{backend.base_url}/models").status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning("LLM backend %s is %s", backend.name, "healthy again" if healthy else "unhealthy")
+            backend.healthy = healthy
+
+    def start_health_checks(self, interval_seconds: float, timeout_seconds: float) -> None:
+        def run() -> None:
+            with httpx.Client(timeout=timeout_seconds) as client:
+                while not self._stop.wait(interval_seconds):
+                    self.check_health(client)
+
+        self._health_thread = threading.Thread(target=run, name="llm-health-checks", daemon=True)
+        self._health_thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def state(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {backend.name: backend.state() for backend in self.backends}
@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Optional
+
+class SlotAffinity:
+    """Assignment of the sessions to the parallel slots of the inference server.
+
+    A slot keeps the KV cache of the last prompt it processed, so sending the
+    turns of a conversation to the same slot lets the server reuse the cached
+    prefix (system prompt and history) instead of evaluating it again. The
+    key is the session and the role of the request, the rephrase and answer
+    prompts start with different system prompts and would evict each
+    other's cached prefix from a shared slot. A key keeps its slot while the
+    slot is free; when it is busy and another slot is idle the key moves,
+    preferring the slot used least recently, whose cache is the least likely
+    to be wanted again.
+    """
+
+    def __init__(self, slots: int, max_sessions: int = 10000) -> None:
+        self.slots = slots
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[Hashable, int] = OrderedDict()
+        self._busy = [0] * slots
+        self._last_used = [0.0] * slots
+
+    def acquire(self, key: Hashable) -> int:
+        with self._lock:
+            slot = self._sessions.get(key)
+            if slot is None or (self._busy[slot] and 0 in self._busy):
+                slot = min(range(self.slots), key=lambda index: (self._busy[index], self._last_used[index]))
+            self._sessions[key] = slot
+            self._sessions.move_to_end(key)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._busy[slot] += 1
+            self._last_used[slot] = time.monotonic()
+            return slot
+
+    def release(self, slot: int) -> None:
+        with self._lock:
+            self._busy[slot] -= 1
+            self._last_used[slot] = time.monotonic()
+
+    def slot_of(self, key: Hashable) -> Optional[int]:
+        return self._sessions.get(key)
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Iterator
+from uuid import UUID
+
+from injector import singleton
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+@singleton
+class MetricsComponent:
+    """In-process counters and timings shared by the ARAH components."""
+
+    def __init__(self) -> None:
+        logger.info("Initializing MetricsComponent")
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._timings: dict[str, dict[str, float]] = {}
+        self._values: dict[str, dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            )
+            ms = seconds * 1000
+            timing["count"] += 1
+            timing["total_ms"] += ms
+            timing["max_ms"] = max(timing["max_ms"], ms)
+            timing["last_ms"] = ms
+
+    def record(self, name: str, value: float) -> None:
+        """Track the distribution of a non-time value, e.g. a score"""
+        with self._lock:
+            stats = self._values.get(name)
+            if stats is None:
+                stats = self._values[name] = {"count": 0, "total": 0.0, "min": value, "max": value, "last": value}
+            stats["count"] += 1
+            stats["total"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+            stats["last"] = value
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            timings = {
+                name: {**timing, "avg_ms": timing["total_ms"] / timing["count"]}
+                for name, timing in self._timings.items()
+            }
+            values = {
+                name: {**stats, "avg": stats["total"] / stats["count"]}
+                for name, stats in self._values.items()
+            }
+            return {"counters": dict(self._counters), "timings": timings, "values": values}
+
+
+class StageTimingHandler(BaseCallbackHandler):
+    """Callback handler recording the duration of named chain stages.
+
+    Only runs whose ``run_name`` is listed in ``stages`` are recorded, under
+    ``<prefix>.<run_name>``. A new handler is expected per request.
+    """
+
+    # cheap enough to run on the event loop instead of an executor
+    run_inline = True
+
+    def __init__(self, metrics: MetricsComponent, stages: set[str], prefix: str = "request") -> None:
+        self.metrics = metrics
+        self.stages = stages
+        self.prefix = prefix
+        self.durations: dict[str, float] = {}
+        self._starts: dict[UUID, tuple[str, float]] = {}
+
+    def _start(self, run_id: UUID, name: Any) -> None:
+        if name in self.stages:
+            self._starts[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            name, start = started
+            elapsed = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            self.metrics.observe(f"{self.prefix}.{name}", elapsed)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs) -> None:
+        self._start(run_id, kwargs.get("name"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs) -> None:
+        self._start(run_id, kwargs.get("name"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id)
@@ -1,14 +1,16 @@
 import json
 import logging
-from typing import List
+from typing import Any, List, Optional, Sequence
 
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import (
     BaseMessage,
+    SystemMessage,
+    get_buffer_string,
     message_to_dict,
     messages_from_dict,
 )
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, errors, ASCENDING, DESCENDING
 import certifi
 from datetime import datetime
 
@@ -16,6 +18,47 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_DBNAME = "chat_history"
 DEFAULT_COLLECTION_NAME = "message_store"
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+# Newest first, _id breaks ties between messages stored in the same millisecond
+_NEWEST_FIRST = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+_OLDEST_FIRST = [("timestamp", ASCENDING), ("_id", ASCENDING)]
+TITLE_LENGTH = 80
+
+def session_title(message: Optional[dict]) -> str:
+    """Title of a session listing, the start of its first message"""
+    if not message:
+        return ""
+    return message.get("data", {}).get("content", "")[:TITLE_LENGTH]
+
+def _after(marker: Any) -> dict:
+    """Query of the messages sorted after a ``messages_to_summarize`` marker"""
+    if isinstance(marker, datetime):
+        # marker of a summary stored before the _id was part of it
+        return {"timestamp": {"$gt": marker}}
+    return {"$or": [
+        {"timestamp": {"$gt": marker["timestamp"]}},
+        {"timestamp": marker["timestamp"], "_id": {"$gt": marker["_id"]}},
+    ]}
+
+def approx_token_count(message: BaseMessage) -> int:
+    """Rough token estimate of a message, about four characters per token"""
+    return len(get_buffer_string([message])) // 4 + 1
+
+def window_size(total: int, max_messages: Optional[int], step: Optional[int] = None) -> int:
+    """Number of the newest of ``total`` messages in the history window.
+
+    With a ``step`` the start of the window only moves by ``step`` messages
+    at a time, so the window holds between ``max_messages - step + 1`` and
+    ``max_messages`` messages and keeps the same oldest message for several
+    turns, which keeps the prompt prefix cached by the inference server.
+    """
+    if max_messages is None:
+        return total
+    if step is None or total <= max_messages:
+        return min(total, max_messages)
+    start = -(-(total - max_messages) // step) * step
+    return total - start
 
 class MongoDBChatMessageHistory(BaseChatMessageHistory):
     """Chat message history that stores history in MongoDB.
@@ -28,6 +71,25 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
             of a single user.
         database_name: name of the database to use
         collection_name: name of the collection to use
+        client: shared MongoClient to use instead of opening a new one.
+            A shared client is neither closed by this history nor used to
+            create the indexes, its owner is expected to do both.
+        async_collection: optional Motor collection backing the async reads
+            and clears, without it they run the sync ones in an executor.
+            Writes go through ``add_messages``, the only method
+            ``RunnableWithMessageHistory`` stores a turn with.
+        max_messages: only the newest ``max_messages`` messages are loaded,
+            enforced in the Mongo query. None loads the whole session.
+        window_step: move the start of the window by this many messages at
+            a time instead of one, see ``window_size``. None slides it by one.
+        token_budget: drop the oldest loaded messages until the estimated
+            token count fits. None disables the budget.
+        summary_collection_name: collection holding the rolling summary of
+            the messages that fell out of the window. None disables it.
+        sessions_collection_name: collection holding one listing document
+            per session (title, message count, last activity), kept up to
+            date by ``add_messages`` so ``list_sessions`` does not group the
+            messages. None disables it.
     """
 
     def __init__(
@@ -37,69 +99,261 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
         user_id: str,
         database_name: str = DEFAULT_DBNAME,
         collection_name: str = DEFAULT_COLLECTION_NAME,
+        client: Optional[MongoClient] = None,
+        async_collection: Optional[Any] = None,
+        max_messages: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        summary_collection_name: Optional[str] = None,
+        window_step: Optional[int] = None,
+        sessions_collection_name: Optional[str] = None,
         ):
         self.connection_string = connection_string
         self.session_id = session_id
         self.user_id = user_id
         self.database_name = database_name
         self.collection_name = collection_name
-        
-        try:
-            self.client: MongoClient = MongoClient(connection_string)
-                                                #    ,tlsCAFile=certifi.where()
-        except errors.ConnectionFailure as error:
-            logger.error(error)
+        self.owns_client = client is None
+        self.async_collection = async_collection
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.window_step = window_step
+
+        if client is not None:
+            self.client = client
+        else:
+            try:
+                self.client: MongoClient = MongoClient(connection_string)
+                                                    #    ,tlsCAFile=certifi.where()
+            except errors.ConnectionFailure as error:
+                logger.error(error)
 
         self.db = self.client[database_name]
         self.collection = self.db[collection_name]
-        self.collection.create_index("SessionId")
-        self.collection.create_index("UserId")
-        self.collection.create_index([("timestamp", 1)])  # Ascending index for timestamp
+        self.summary_collection = self.db[summary_collection_name] if summary_collection_name else None
+        self.sessions_collection = self.db[sessions_collection_name] if sessions_collection_name else None
+        self.async_summary_collection = None
+        if async_collection is not None and summary_collection_name:
+            self.async_summary_collection = async_collection.database[summary_collection_name]
+        self.async_sessions_collection = None
+        if async_collection is not None and sessions_collection_name:
+            self.async_sessions_collection = async_collection.database[sessions_collection_name]
+        if self.owns_client:
+            self.ensure_indexes(self.collection, self.summary_collection, self.sessions_collection)
+
+    @staticmethod
+    def ensure_indexes(collection, summary_collection=None, sessions_collection=None) -> None:
+        """Create the indexes used by the history queries, no-op if they exist"""
+        collection.create_index("SessionId")
+        collection.create_index("UserId")
+        collection.create_index([("timestamp", 1)])  # Ascending index for timestamp
+        # serves the windowed "newest N messages of a session" query
+        collection.create_index([("SessionId", 1), ("UserId", 1), ("timestamp", -1)])
+        collection.create_index([("UserId", 1), ("timestamp", 1)])
+        if summary_collection is not None:
+            summary_collection.create_index([("SessionId", 1), ("UserId", 1)], unique=True)
+        if sessions_collection is not None:
+            sessions_collection.create_index([("SessionId", 1), ("UserId", 1)], unique=True)
+            # serves the session listing of a user
+            sessions_collection.create_index([("UserId", 1), ("timestamp", -1), ("SessionId", -1)])
+
+    @property
+    def _filter(self) -> dict:
+        return {"SessionId": self.session_id, "UserId": self.user_id}
 
-    
     def clear(self) -> None:
         """Clear session memory from MongoDB"""
         try:
-            self.collection.delete_many({"SessionId": self.session_id, "UserId": self.user_id})
+            self.collection.delete_many(self._filter)
+            if self.summary_collection is not None:
+                self.summary_collection.delete_many(self._filter)
+            if self.sessions_collection is not None:
+                self.sessions_collection.delete_one(self._filter)
         except errors.WriteError as err:
             logger.error(err)
 
+    @staticmethod
+    def _decode(documents: List[dict]) -> List[BaseMessage]:
+        """Decode newest-first message documents, oldest first"""
+        return messages_from_dict([json.loads(document["History"]) for document in reversed(documents)])
+
+    @property
+    def _stepped(self) -> bool:
+        return self.window_step is not None and self.max_messages is not None
+
+    def _window(self, messages: List[BaseMessage], summary: Optional[dict]) -> List[BaseMessage]:
+        """Apply the token budget and the summary to the windowed messages, oldest first"""
+        if self.token_budget is not None:
+            tokens = sum(approx_token_count(message) for message in messages)
+            while messages and tokens > self.token_budget:
+                tokens -= approx_token_count(messages.pop(0))
+        if summary and summary.get("summary"):
+            messages.insert(0, SystemMessage(content=SUMMARY_PREFIX + summary["summary"]))
+        return messages
 
     @property
     def messages(self) -> List[BaseMessage]:  # type: ignore
         """Retrieve the messages from MongoDB"""
         try:
-            cursor = self.collection.find({"SessionId": self.session_id, "UserId": self.user_id})
+            cursor = self.collection.find(self._filter).sort(_NEWEST_FIRST)
+            if self.max_messages is not None:
+                cursor = cursor.limit(self.max_messages)
+            documents = list(cursor)
+            if self._stepped and len(documents) == self.max_messages:
+                documents = documents[:window_size(self.collection.count_documents(self._filter), self.max_messages, self.window_step)]
+            summary = self.get_summary()
         except errors.OperationFailure as error:
             logger.error(error)
-    
-        if cursor:
-            items = [json.loads(document["History"]) for document in cursor]
-        else:
-            items = []
-    
-        messages = messages_from_dict(items)
-        return messages
-    
-    
+            return []
+        return self._window(self._decode(documents), summary)
+
+    def all_messages(self) -> List[BaseMessage]:
+        """Every stored message of the session, oldest first, without window or summary"""
+        try:
+            documents = list(self.collection.find(self._filter, {"_id": 0, "History": 1}).sort(_OLDEST_FIRST))
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        return messages_from_dict([json.loads(document["History"]) for document in documents])
+
+    @staticmethod
+    def list_sessions(collection, user_id: str, limit: int, before: Optional[tuple[datetime, str]] = None) -> List[dict]:
+        """Sessions of a user by last activity, newest first, starting after the ``before`` cursor.
+
+        ``collection`` is the sessions collection, its listing documents are
+        read with an index range scan instead of grouping the messages.
+        """
+        query: dict = {"UserId": user_id}
+        if before is not None:
+            query["$or"] = [
+                {"timestamp": {"$lt": before[0]}},
+                {"timestamp": before[0], "SessionId": {"$lt": before[1]}},
+            ]
+        cursor = collection.find(query, {"_id": 0}).sort([("timestamp", -1), ("SessionId", -1)]).limit(limit)
+        return [
+            {
+                "session_id": document["SessionId"],
+                "title": document.get("title", ""),
+                "message_count": document.get("message_count", 0),
+                "last_activity": document["timestamp"],
+            }
+            for document in cursor
+        ]
+
+    def _update_listing(self, documents: List[dict]) -> None:
+        if self.sessions_collection is None:
+            return
+        self.sessions_collection.update_one(
+            self._filter,
+            {
+                "$inc": {"message_count": len(documents)},
+                "$max": {"timestamp": documents[-1]["timestamp"]},
+                "$setOnInsert": {
+                    "title": session_title(json.loads(documents[0]["History"])),
+                    "created": documents[0]["timestamp"],
+                },
+            },
+            upsert=True,
+        )
+
+    def _to_document(self, message: BaseMessage) -> dict:
+        return {
+            "SessionId": self.session_id,
+            "UserId": self.user_id,
+            "History": json.dumps(message_to_dict(message)),
+            "timestamp": datetime.utcnow(),  # Add current UTC timestamp
+        }
+
     def add_message(self, message: BaseMessage) -> None:
         """Append the message to the record in MongoDB"""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the record in MongoDB with one insert"""
+        if not messages:
+            return
+        documents = [self._to_document(message) for message in messages]
+        try:
+            self.collection.insert_many(documents)
+            self._update_listing(documents)
+        except errors.WriteError as err:
+            logger.error(err)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Retrieve the messages from MongoDB without blocking the event loop"""
+        if self.async_collection is None:
+            return await super().aget_messages()
+        try:
+            cursor = self.async_collection.find(self._filter).sort(_NEWEST_FIRST)
+            if self.max_messages is not None:
+                cursor = cursor.limit(self.max_messages)
+            documents = [document async for document in cursor]
+            if self._stepped and len(documents) == self.max_messages:
+                total = await self.async_collection.count_documents(self._filter)
+                documents = documents[:window_size(total, self.max_messages, self.window_step)]
+            summary = None
+            if self.async_summary_collection is not None:
+                summary = await self.async_summary_collection.find_one(self._filter)
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        return self._window(self._decode(documents), summary)
+
+    async def aclear(self) -> None:
+        """Clear session memory from MongoDB without blocking the event loop"""
+        if self.async_collection is None:
+            return await super().aclear()
+        try:
+            await self.async_collection.delete_many(self._filter)
+            if self.async_summary_collection is not None:
+                await self.async_summary_collection.delete_many(self._filter)
+            if self.async_sessions_collection is not None:
+                await self.async_sessions_collection.delete_one(self._filter)
+        except errors.WriteError as err:
+            logger.error(err)
+
+    def get_summary(self) -> Optional[dict]:
+        """Return the rolling summary document of the session, if any"""
+        if self.summary_collection is None:
+            return None
+        return self.summary_collection.find_one(self._filter)
+
+    def messages_to_summarize(self) -> tuple[List[BaseMessage], Any]:
+        """Messages outside the window that are not part of the summary yet.
+
+        Returns the messages oldest first and the marker to pass to
+        ``update_summary``, here the timestamp and ``_id`` of the newest one.
+        The messages of a turn can share a timestamp, the ``_id`` breaks the
+        tie the same way the history queries sort them.
+        """
+        if self.summary_collection is None or self.max_messages is None:
+            return [], None
+        query = dict(self._filter)
+        summary = self.get_summary()
+        if summary and summary.get("summarized_until"):
+            query.update(_after(summary["summarized_until"]))
+        in_window = self.max_messages
+        if self._stepped:
+            in_window = window_size(self.collection.count_documents(self._filter), self.max_messages, self.window_step)
+        documents = list(self.collection.find(query).sort(_NEWEST_FIRST).skip(in_window))
+        if not documents:
+            return [], None
+        return self._decode(documents), {"timestamp": documents[0]["timestamp"], "_id": documents[0]["_id"]}
+
+    def update_summary(self, summary: str, summarized_until: Any) -> None:
+        """Store the rolling summary covering the messages up to ``summarized_until``"""
         try:
-            self.collection.insert_one(
-                {
-                    "SessionId": self.session_id,
-                    "UserId": self.user_id,
-                    "History": json.dumps(message_to_dict(message)),
-                    "timestamp": datetime.utcnow(),  # Add current UTC timestamp
-                
-                }
+            self.summary_collection.update_one(
+                self._filter,
+                {"$set": {"summary": summary, "summarized_until": summarized_until, "timestamp": datetime.utcnow()}},
+                upsert=True,
             )
         except errors.WriteError as err:
             logger.error(err)
-    
+
     def __del__(self):
-        self.client.close()
-    
+        if self.owns_client:
+            self.client.close()
+
     def getformatedmessage(self,pipeline: List[dict]):
         try:
             results = self.collection.aggregate(pipeline)
@@ -109,4 +363,4 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
                 items = []
             return items
         except errors.WriteError as err:
-            logger.error(err)
\ No newline at end of file
+            logger.error(err)
@@ -0,0 +1,187 @@
+import logging
+from typing import Any, List, Optional, Sequence
+
+from langchain_core.messages import (
+    BaseMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+from pymongo import errors
+from datetime import datetime
+
+from .MongoDBChatMessageHistory import MongoDBChatMessageHistory, session_title, window_size
+
+logger = logging.getLogger(__name__)
+
+class MongoDBSessionChatMessageHistory(MongoDBChatMessageHistory):
+    """Chat message history storing one MongoDB document per session.
+
+    The messages of a session are kept as a native BSON array in a single
+    document next to its metadata (``message_count``, ``created``, last
+    update ``timestamp``) and the rolling summary, so reading the history is
+    one indexed point lookup without JSON parsing.
+
+    Args:
+        max_stored_messages: cap of the stored message array, older messages
+            are dropped with ``$slice`` when appending. None keeps them all.
+        Other arguments are the same as ``MongoDBChatMessageHistory``, except
+        ``summary_collection_name`` which only toggles the summary since it
+        lives in the session document, and ``sessions_collection_name`` which
+        is ignored since the session documents are listed directly.
+    """
+
+    def __init__(self, *args: Any, max_stored_messages: Optional[int] = None, **kwargs: Any):
+        self.summary_enabled = kwargs.pop("summary_collection_name", None) is not None
+        kwargs.pop("sessions_collection_name", None)
+        super().__init__(*args, **kwargs)
+        self.max_stored_messages = max_stored_messages
+
+    @staticmethod
+    def ensure_indexes(collection, summary_collection=None, sessions_collection=None) -> None:
+        """Create the indexes used by the session queries, no-op if they exist"""
+        collection.create_index([("SessionId", 1), ("UserId", 1)], unique=True)
+        collection.create_index([("UserId", 1), ("timestamp", -1)])
+
+    def _projection(self) -> dict:
+        projection = {"_id": 0, "messages": 1, "summary": 1, "message_count": 1}
+        if self.max_messages is not None:
+            projection["messages"] = {"$slice": -self.max_messages}
+        return projection
+
+    def _from_session(self, session: Optional[dict]) -> List[BaseMessage]:
+        if not session:
+            return []
+        summary = session if self.summary_enabled else None
+        stored = session.get("messages", [])
+        if self._stepped:
+            in_window = window_size(session.get("message_count", len(stored)), self.max_messages, self.window_step)
+            stored = stored[len(stored) - min(in_window, len(stored)):]
+        return self._window(messages_from_dict(stored), summary)
+
+    def _append_update(self, messages: Sequence[BaseMessage]) -> dict:
+        now = datetime.utcnow()
+        push: dict = {"$each": [message_to_dict(message) for message in messages]}
+        if self.max_stored_messages is not None:
+            push["$slice"] = -self.max_stored_messages
+        return {
+            "$push": {"messages": push},
+            "$inc": {"message_count": len(messages)},
+            "$set": {"timestamp": now},
+            "$setOnInsert": {"created": now},
+        }
+
+    def clear(self) -> None:
+        """Clear session memory from MongoDB"""
+        try:
+            self.collection.delete_one(self._filter)
+        except errors.WriteError as err:
+            logger.error(err)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        """Retrieve the messages from MongoDB"""
+        try:
+            session = self.collection.find_one(self._filter, self._projection())
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        return self._from_session(session)
+
+    def all_messages(self) -> List[BaseMessage]:
+        """Every stored message of the session, oldest first, without window or summary"""
+        try:
+            session = self.collection.find_one(self._filter, {"_id": 0, "messages": 1})
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        return messages_from_dict(session.get("messages", [])) if session else []
+
+    @staticmethod
+    def list_sessions(collection, user_id: str, limit: int, before: Optional[tuple[datetime, str]] = None) -> List[dict]:
+        """Sessions of a user by last activity, newest first, starting after the ``before`` cursor"""
+        query: dict = {"UserId": user_id}
+        if before is not None:
+            query["$or"] = [
+                {"timestamp": {"$lt": before[0]}},
+                {"timestamp": before[0], "SessionId": {"$lt": before[1]}},
+            ]
+        projection = {"_id": 0, "SessionId": 1, "message_count": 1, "timestamp": 1, "messages": {"$slice": 1}}
+        cursor = collection.find(query, projection).sort([("timestamp", -1), ("SessionId", -1)]).limit(limit)
+        return [
+            {
+                "session_id": document["SessionId"],
+                "title": session_title(document["messages"][0] if document.get("messages") else None),
+                "message_count": document.get("message_count", 0),
+                "last_activity": document["timestamp"],
+            }
+            for document in cursor
+        ]
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Append the message to the session document in MongoDB"""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the session document in one round trip"""
+        try:
+            self.collection.update_one(self._filter, self._append_update(messages), upsert=True)
+        except errors.WriteError as err:
+            logger.error(err)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Retrieve the messages from MongoDB without blocking the event loop"""
+        if self.async_collection is None:
+            return await super().aget_messages()
+        try:
+            session = await self.async_collection.find_one(self._filter, self._projection())
+        except errors.OperationFailure as error:
+            logger.error(error)
+            return []
+        return self._from_session(session)
+
+    async def aclear(self) -> None:
+        """Clear session memory from MongoDB without blocking the event loop"""
+        if self.async_collection is None:
+            return await super().aclear()
+        try:
+            await self.async_collection.delete_one(self._filter)
+        except errors.WriteError as err:
+            logger.error(err)
+
+    def get_summary(self) -> Optional[dict]:
+        """Return the rolling summary fields of the session, if any"""
+        if not self.summary_enabled:
+            return None
+        return self.collection.find_one(self._filter, {"_id": 0, "summary": 1, "summarized_count": 1})
+
+    def messages_to_summarize(self) -> tuple[List[BaseMessage], Any]:
+        """Messages outside the window that are not part of the summary yet.
+
+        Returns the messages oldest first and the marker to pass to
+        ``update_summary``, here the number of messages the summary covers.
+        """
+        if not self.summary_enabled or self.max_messages is None:
+            return [], None
+        session = self.collection.find_one(self._filter, {"_id": 0, "messages": 1, "message_count": 1, "summarized_count": 1})
+        if not session:
+            return [], None
+        stored = session.get("messages", [])
+        # messages dropped by max_stored_messages are no longer in the array
+        offset = session.get("message_count", len(stored)) - len(stored)
+        total = session.get("message_count", len(stored))
+        summarized_until = total - window_size(total, self.max_messages, self.window_step)
+        start = max(session.get("summarized_count", 0) - offset, 0)
+        end = summarized_until - offset
+        if end <= start:
+            return [], None
+        return messages_from_dict(stored[start:end]), summarized_until
+
+    def update_summary(self, summary: str, summarized_until: Any) -> None:
+        """Store the rolling summary covering the first ``summarized_until`` messages"""
+        try:
+            self.collection.update_one(
+                self._filter,
+                {"$set": {"summary": summary, "summarized_count": summarized_until}},
+            )
+        except errors.WriteError as err:
+            logger.error(err)
@@ -1,21 +1,199 @@
+import asyncio
+import base64
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence
+
 from injector import inject, singleton
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, errors
 
 from api.settings.settings import Settings
 from .MongoDBChatMessageHistory import MongoDBChatMessageHistory
+from .MongoDBSessionChatMessageHistory import MongoDBSessionChatMessageHistory
 
 import logging
 
+logger = logging.getLogger(__name__)
+
+def encode_cursor(last_activity: datetime, session_id: str) -> str:
+    payload = json.dumps({"t": last_activity.isoformat(), "s": session_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(payload["t"]), payload["s"]
+
+class BackgroundWriteChatMessageHistory(BaseChatMessageHistory):
+    """Session history whose writes are queued on the writer thread of the component.
+
+    ``RunnableWithMessageHistory`` stores the messages of a turn once the
+    answer is complete, the write is handed over so the end of the response
+    does not wait on MongoDB. Reads and clears of the session first wait for
+    its pending write, a follow-up question always sees the previous turn.
+    """
+
+    def __init__(self, history: BaseChatMessageHistory, component: "MongoChatHistoryComponent") -> None:
+        self.history = history
+        self.component = component
+        self.key = (history.session_id, history.user_id)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.history, name)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        self.component.wait_for_writes(self.key)
+        return self.history.messages
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        await self.component.await_writes(self.key)
+        return await self.history.aget_messages()
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.component.write(self.key, self.history.add_messages, list(messages))
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.add_messages(messages)
+
+    def all_messages(self) -> List[BaseMessage]:
+        self.component.wait_for_writes(self.key)
+        return self.history.all_messages()
+
+    def messages_to_summarize(self) -> tuple[List[BaseMessage], Any]:
+        self.component.wait_for_writes(self.key)
+        return self.history.messages_to_summarize()
+
+    def clear(self) -> None:
+        self.component.wait_for_writes(self.key)
+        self.history.clear()
+
+    async def aclear(self) -> None:
+        await self.component.await_writes(self.key)
+        await self.history.aclear()
+
 @singleton
 class MongoChatHistoryComponent:
+    client: MongoClient
+    async_client: AsyncIOMotorClient
 
     @inject
     def __init__(self, settings: Settings) -> None:
+        logger.info("Initializing MongoChatHistoryComponent")
         self.settings = settings
+        pool_kwargs = dict(
+            maxPoolSize=settings.mongodb.max_pool_size,
+            minPoolSize=settings.mongodb.min_pool_size,
+            maxIdleTimeMS=settings.mongodb.max_idle_time_ms,
+            connectTimeoutMS=settings.mongodb.connect_timeout_ms,
+            serverSelectionTimeoutMS=settings.mongodb.server_selection_timeout_ms,
+            socketTimeoutMS=settings.mongodb.socket_timeout_ms,
+        )
+        # one pooled client shared by every session history, pymongo is thread safe
+        self.client = MongoClient(settings.mongodb.url, **pool_kwargs)
+        db = self.client[settings.mongodb.db_name]
+        if settings.mongodb.history_storage == "session":
+            self.history_class = MongoDBSessionChatMessageHistory
+            self.collectionname = settings.mongodb.session_collectionname
+            # the session documents are listed directly
+            self.listing_collectionname = None
+        else:
+            self.history_class = MongoDBChatMessageHistory
+            self.collectionname = settings.mongodb.history_collectionname
+            self.listing_collectionname = settings.mongodb.session_listing_collectionname
+        self.collection = db[self.collectionname]
+        self.listing_collection = db[self.listing_collectionname] if self.listing_collectionname else self.collection
+        # Motor client for the async request path, it binds to the event loop on first use
+        self.async_client = AsyncIOMotorClient(settings.mongodb.url, **pool_kwargs)
+        self.async_collection = self.async_client[settings.mongodb.db_name][self.collectionname]
+        self.summary_collectionname = None
+        if settings.rag.history_summary.enabled:
+            self.summary_collectionname = settings.mongodb.summary_collectionname
+        try:
+            self.history_class.ensure_indexes(
+                self.collection,
+                db[self.summary_collectionname] if self.summary_collectionname else None,
+                db[self.listing_collectionname] if self.listing_collectionname else None,
+            )
+        except errors.PyMongoError as e:
+            logger.error(f"Error creating chat history indexes: {e}")
+        self._writer = None
+        self._pending_writes: dict[tuple[str, str], Future] = {}
+        self._pending_lock = threading.Lock()
+        if settings.mongodb.background_writes:
+            # a single writer keeps the turns of a session in order
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+
+    def write(self, key: tuple[str, str], func: Callable[..., None], *args: Any) -> None:
+        """Run a write of the session on the writer thread"""
+        def run() -> None:
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Error writing the history of session {key[0]}: {e}")
+            finally:
+                with self._pending_lock:
+                    if self._pending_writes.get(key) is future:
+                        del self._pending_writes[key]
+
+        with self._pending_lock:
+            future = self._writer.submit(run)
+            self._pending_writes[key] = future
+
+    def _pending(self, key: tuple[str, str]) -> Optional[Future]:
+        with self._pending_lock:
+            return self._pending_writes.get(key)
+
+    def wait_for_writes(self, key: tuple[str, str]) -> None:
+        future = self._pending(key)
+        if future is not None:
+            future.result()
+
+    async def await_writes(self, key: tuple[str, str]) -> None:
+        future = self._pending(key)
+        if future is not None:
+            await asyncio.wrap_future(future)
 
     def get_session_history(self, session_id: str,user_id: str) -> MongoDBChatMessageHistory:
+        kwargs = {}
+        if self.history_class is MongoDBSessionChatMessageHistory:
+            kwargs["max_stored_messages"] = self.settings.mongodb.session_max_messages
         try:
-            return MongoDBChatMessageHistory(self.settings.mongodb.url, session_id,
-                                              user_id, database_name=self.settings.mongodb.db_name, collection_name=self.settings.mongodb.history_collectionname)
+            history = self.history_class(self.settings.mongodb.url, session_id,
+                                              user_id, database_name=self.settings.mongodb.db_name, collection_name=self.collectionname,
+                                              client=self.client, async_collection=self.async_collection,
+                                              max_messages=self.settings.rag.history_max_messages,
+                                              window_step=self.settings.rag.history_window_step,
+                                              token_budget=self.settings.rag.history_token_budget,
+                                              summary_collection_name=self.summary_collectionname,
+                                              sessions_collection_name=self.listing_collectionname,
+                                              **kwargs)
+            if self._writer is not None:
+                return BackgroundWriteChatMessageHistory(history, self)
+            return history
         except Exception as e:
             logging.error(f"Error getting session history: {e}")
 
+    def list_sessions(self, user_id: str, limit: int, cursor: Optional[str] = None) -> dict:
+        """One page of the sessions of a user, newest first, with the cursor of the next page"""
+        before = decode_cursor(cursor) if cursor else None
+        sessions = self.history_class.list_sessions(self.listing_collection, user_id, limit + 1, before)
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_cursor(sessions[-1]["last_activity"], sessions[-1]["session_id"])
+        return {"sessions": sessions, "next_cursor": next_cursor}
+
+    def close(self) -> None:
+        if self._writer is not None:
+            # flush the pending writes before the clients go away
+            self._writer.shutdown(wait=True)
+        self.client.close()
+        self.async_client.close()
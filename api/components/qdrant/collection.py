@@ -0,0 +1,114 @@
+import logging
+import uuid
+from typing import Any, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+logger = logging.getLogger(__name__)
+
+# single point of the revision collection, its payload holds the revision
+_REVISION_POINT_ID = 0
+
+def quantization_config(quantization: Optional[str], always_ram: bool = True) -> Optional[models.ScalarQuantization]:
+    if quantization != "int8":
+        return None
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=always_ram)
+    )
+
+def hnsw_config(m: Optional[int], ef_construct: Optional[int]) -> Optional[models.HnswConfigDiff]:
+    if m is None and ef_construct is None:
+        return None
+    return models.HnswConfigDiff(m=m, ef_construct=ef_construct)
+
+def search_params(
+    hnsw_ef: Optional[int],
+    quantization: Optional[str] = None,
+    rescore: bool = True,
+    oversampling: Optional[float] = None,
+) -> Optional[models.SearchParams]:
+    """Search-time parameters, None keeps the Qdrant defaults"""
+    quantization_params = None
+    if quantization == "int8":
+        quantization_params = models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    if hnsw_ef is None and quantization_params is None:
+        return None
+    return models.SearchParams(hnsw_ef=hnsw_ef, quantization=quantization_params)
+
+def create_collection(
+    client: QdrantClient,
+    collection_name: str,
+    vector_size: int,
+    sparse_vectors_config: Optional[dict] = None,
+    m: Optional[int] = None,
+    ef_construct: Optional[int] = None,
+    on_disk: Optional[bool] = None,
+    quantization: Optional[str] = None,
+    always_ram: bool = True,
+) -> None:
+    """Create the cosine collection of the chunks with the given index settings"""
+    client.create_collection(
+        collection_name,
+        vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE, on_disk=on_disk),
+        sparse_vectors_config=sparse_vectors_config,
+        hnsw_config=hnsw_config(m, ef_construct),
+        quantization_config=quantization_config(quantization, always_ram),
+    )
+
+def update_collection(
+    client: QdrantClient,
+    collection_name: str,
+    m: Optional[int] = None,
+    ef_construct: Optional[int] = None,
+    on_disk: Optional[bool] = None,
+    quantization: Optional[str] = None,
+    always_ram: bool = True,
+) -> bool:
+    """Apply the index settings that differ from the collection, None leaves a setting as is.
+
+    Returns True if the collection was updated, Qdrant then rebuilds the
+    index and the quantized vectors in the background.
+    """
+    config = client.get_collection(collection_name).config
+    changes: dict[str, Any] = {}
+    if (m is not None and m != config.hnsw_config.m) or (
+        ef_construct is not None and ef_construct != config.hnsw_config.ef_construct
+    ):
+        changes["hnsw_config"] = hnsw_config(m, ef_construct)
+    vectors = config.params.vectors
+    if on_disk is not None and isinstance(vectors, models.VectorParams) and bool(vectors.on_disk) != on_disk:
+        changes["vectors_config"] = {"": models.VectorParamsDiff(on_disk=on_disk)}
+    if quantization is not None:
+        wanted = quantization_config(quantization, always_ram)
+        if config.quantization_config != wanted:
+            changes["quantization_config"] = wanted if wanted is not None else models.Disabled.DISABLED
+    if not changes:
+        return False
+    logger.info("Updating collection %s: %s", collection_name, ", ".join(changes))
+    client.update_collection(collection_name, **changes)
+    return True
+
+def revision_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_revision"
+
+def bump_revision(client: QdrantClient, collection_name: str) -> str:
+    """Record a new content revision of the collection after its chunks changed.
+
+    The revision lives in a one point side collection, so readers notice an
+    ingestion that replaced chunks without changing their number.
+    """
+    name = revision_collection_name(collection_name)
+    if not client.collection_exists(name):
+        client.create_collection(name, vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT))
+    revision = uuid.uuid4().hex
+    client.upsert(name, points=[models.PointStruct(id=_REVISION_POINT_ID, vector=[1.0], payload={"revision": revision})])
+    return revision
+
+def read_revision(client: QdrantClient, collection_name: str) -> Optional[str]:
+    """Content revision recorded by ``bump_revision``, None if there is none yet"""
+    name = revision_collection_name(collection_name)
+    if not client.collection_exists(name):
+        return None
+    points = client.retrieve(name, [_REVISION_POINT_ID], with_payload=True)
+    return points[0].payload.get("revision") if points else None
@@ -2,10 +2,12 @@ import logging
 import typing
 from injector import inject, singleton
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
 from langchain_community.vectorstores import Qdrant
-from api.settings.settings import Settings
+from api.settings.settings import ARAHQdrantSettings, Settings
 from api.components.embedding.embedmodel_component import EmbedModelComponent
+from api.components.qdrant.collection import search_params, update_collection
 
 
 logger = logging.getLogger(__name__)
@@ -13,9 +15,40 @@ logger = logging.getLogger(__name__)
 @singleton
 class QdrantComponent:
     qdrant: Qdrant
+    client: QdrantClient
+    search_params: typing.Optional[models.SearchParams]
 
     @inject
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, embedding: EmbedModelComponent) -> None:
         logger.info("Initializing QdrantComponent")
         client = QdrantClient(url=settings.qdrant.url,api_key=settings.qdrant.api_key)
-        self.qdrant = Qdrant(client=client, collection_name=settings.qdrant.vector_collectionname, embeddings=EmbedModelComponent(settings).embed_model)
\ No newline at end of file
+        self.client = client
+        # used by the async retriever path so searches do not block the event loop
+        async_client = AsyncQdrantClient(url=settings.qdrant.url,api_key=settings.qdrant.api_key)
+        self.qdrant = Qdrant(client=client, collection_name=settings.qdrant.vector_collectionname, embeddings=embedding.embed_model, async_client=async_client)
+        qdrant_settings = settings.qdrant
+        self.search_params = search_params(
+            qdrant_settings.hnsw_ef,
+            qdrant_settings.quantization,
+            qdrant_settings.quantization_rescore,
+            qdrant_settings.quantization_oversampling,
+        )
+        if qdrant_settings.apply_index_settings:
+            self._apply_index_settings(client, qdrant_settings)
+
+    @staticmethod
+    def _apply_index_settings(client: QdrantClient, qdrant_settings: ARAHQdrantSettings) -> None:
+        """Update the index of the existing collection, opt-in since a change rebuilds it"""
+        try:
+            if client.collection_exists(qdrant_settings.vector_collectionname):
+                update_collection(
+                    client,
+                    qdrant_settings.vector_collectionname,
+                    m=qdrant_settings.hnsw_m,
+                    ef_construct=qdrant_settings.hnsw_ef_construct,
+                    on_disk=qdrant_settings.on_disk,
+                    quantization=qdrant_settings.quantization,
+                    always_ram=qdrant_settings.quantization_always_ram,
+                )
+        except Exception as e:
+            logger.warning(f"Could not apply the index settings to {qdrant_settings.vector_collectionname}: {e}")
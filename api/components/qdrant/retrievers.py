@@ -0,0 +1,159 @@
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_community.vectorstores import Qdrant
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client.http import models
+
+from api.components.qdrant.sparse import BM25SparseEncoder, rrf_scores
+
+def maximal_marginal_relevance(query: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """Indices of the k rows of ``vectors`` picked by MMR, vectorized over the candidates.
+
+    The candidate similarity matrix is computed once and the maximum
+    similarity to the picked rows is updated incrementally, so each pick is
+    one NumPy pass over the candidates.
+    """
+    if len(vectors) == 0:
+        return []
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        np.maximum(max_similarity, similarity[index], out=max_similarity)
+    return selected
+
+class QdrantRetriever(BaseRetriever):
+    """Base of the retrievers querying the collection of a langchain Qdrant vectorstore directly"""
+
+    vectorstore: Qdrant
+    k: int = 3
+    search_params: Optional[models.SearchParams] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _dense_query(self, dense: List[float]) -> Any:
+        if self.vectorstore.vector_name is not None:
+            return models.NamedVector(name=self.vectorstore.vector_name, vector=dense)
+        return dense
+
+    def _to_document(self, point_id: Any, payload: Optional[dict], **metadata: Any) -> Document:
+        payload = payload or {}
+        return Document(
+            page_content=payload.get(self.vectorstore.content_payload_key, ""),
+            metadata={
+                **(payload.get(self.vectorstore.metadata_payload_key) or {}),
+                "_id": point_id,
+                "_collection_name": self.vectorstore.collection_name,
+                **metadata,
+            },
+        )
+
+class MMRQdrantRetriever(QdrantRetriever):
+    """Maximal marginal relevance over the ``fetch_k`` nearest chunks.
+
+    Only the vectors of the candidates are fetched, MMR runs in NumPy, and the
+    payloads are then retrieved for the ``k`` picked points only.
+    """
+
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    def _dense_vector(self, hit: Any) -> List[float]:
+        # a collection with sparse vectors too returns the vectors by name, the dense one is "" when unnamed
+        if isinstance(hit.vector, dict):
+            return hit.vector[self.vectorstore.vector_name or ""]
+        return hit.vector
+
+    def _pick(self, dense: List[float], hits: List[Any]) -> List[Any]:
+        if not hits:
+            return []
+        vectors = np.array([self._dense_vector(hit) for hit in hits], dtype=np.float32)
+        picked = maximal_marginal_relevance(np.array(dense, dtype=np.float32), vectors, self.k, self.lambda_mult)
+        return [hits[index].id for index in picked]
+
+    def _search_kwargs(self, dense: List[float]) -> dict:
+        return dict(
+            collection_name=self.vectorstore.collection_name,
+            query_vector=self._dense_query(dense),
+            limit=self.fetch_k,
+            search_params=self.search_params,
+            with_payload=False,
+            # only the dense vector, not the sparse one of the hybrid collections
+            with_vectors=[self.vectorstore.vector_name or ""],
+        )
+
+    def _documents(self, ids: List[Any], points: List[Any]) -> List[Document]:
+        payloads = {point.id: point.payload for point in points}
+        return [self._to_document(point_id, payloads.get(point_id)) for point_id in ids]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense = self.vectorstore.embeddings.embed_query(query)
+        client = self.vectorstore.client
+        ids = self._pick(dense, client.search(**self._search_kwargs(dense)))
+        if not ids:
+            return []
+        points = client.retrieve(self.vectorstore.collection_name, ids=ids, with_payload=True, with_vectors=False)
+        return self._documents(ids, points)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        client = self.vectorstore.async_client
+        if client is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        dense = await self.vectorstore.embeddings.aembed_query(query)
+        ids = self._pick(dense, await client.search(**self._search_kwargs(dense)))
+        if not ids:
+            return []
+        points = await client.retrieve(self.vectorstore.collection_name, ids=ids, with_payload=True, with_vectors=False)
+        return self._documents(ids, points)
+
+class HybridQdrantRetriever(QdrantRetriever):
+    """Dense + sparse retrieval fused with reciprocal rank fusion.
+
+    The dense (e5) and sparse (BM25) searches are sent to Qdrant in a single
+    ``search_batch`` request, ``prefetch_k`` hits each, and the ``k`` best
+    fused hits are returned. The collection needs the sparse vectors written
+    by ``embeddocs.py --sparse``.
+    """
+
+    encoder: BM25SparseEncoder
+    sparse_vector_name: str = "bm25"
+    prefetch_k: int = 20
+    rrf_k: int = 60
+
+    def _requests(self, dense: List[float], query: str) -> List[models.SearchRequest]:
+        sparse = models.NamedSparseVector(name=self.sparse_vector_name, vector=self.encoder.encode_query(query))
+        return [
+            models.SearchRequest(vector=self._dense_query(dense), limit=self.prefetch_k, params=self.search_params, with_payload=True),
+            models.SearchRequest(vector=sparse, limit=self.prefetch_k, with_payload=True),
+        ]
+
+    def _fuse(self, results: List[List[Any]]) -> List[Document]:
+        points = {point.id: point for hits in results for point in hits}
+        scores = rrf_scores([[point.id for point in hits] for hits in results], self.rrf_k)
+        return [
+            self._to_document(point_id, points[point_id].payload, rrf_score=scores[point_id])
+            for point_id in sorted(scores, key=scores.get, reverse=True)[:self.k]
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense = self.vectorstore.embeddings.embed_query(query)
+        results = self.vectorstore.client.search_batch(self.vectorstore.collection_name, self._requests(dense, query))
+        return self._fuse(results)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if self.vectorstore.async_client is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        dense = await self.vectorstore.embeddings.aembed_query(query)
+        results = await self.vectorstore.async_client.search_batch(self.vectorstore.collection_name, self._requests(dense, query))
+        return self._fuse(results)
@@ -0,0 +1,59 @@
+import re
+import zlib
+from collections import Counter
+
+from qdrant_client.http import models
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)*")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does", "for", "from",
+    "has", "have", "how", "i", "if", "in", "into", "is", "it", "its", "of", "on", "or", "so",
+    "that", "the", "their", "then", "there", "these", "this", "to", "was", "we", "what", "when",
+    "which", "who", "why", "will", "with", "you", "your",
+}
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+def token_id(token: str) -> int:
+    """Stable id of a token in the sparse vector space, no vocabulary needed"""
+    return zlib.crc32(token.encode()) & 0x7FFFFFFF
+
+class BM25SparseEncoder:
+    """BM25 style sparse vectors for the Qdrant sparse index.
+
+    Documents carry the saturated, length-normalized term frequency of BM25
+    and queries a weight of 1 per distinct term, so the dot product computed
+    by Qdrant is the BM25 score without its IDF factor. Terms are hashed
+    into the index space, which keeps ingestion and queries stateless.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float = 60) -> None:
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    @staticmethod
+    def _vector(weights: dict[int, float]) -> models.SparseVector:
+        indices = sorted(weights)
+        return models.SparseVector(indices=indices, values=[weights[index] for index in indices])
+
+    def encode_document(self, text: str) -> models.SparseVector:
+        tokens = tokenize(text)
+        norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_length)
+        weights: dict[int, float] = {}
+        for token, tf in Counter(tokens).items():
+            index = token_id(token)
+            weights[index] = weights.get(index, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+        return self._vector(weights)
+
+    def encode_query(self, text: str) -> models.SparseVector:
+        return self._vector({token_id(token): 1.0 for token in set(tokenize(text))})
+
+def rrf_scores(rankings: list[list], k: int = 60) -> dict:
+    """Reciprocal rank fusion of several rankings of ids, higher is better"""
+    scores: dict = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1 / (k + rank + 1)
+    return scores
@@ -0,0 +1,54 @@
+import logging
+from typing import List
+
+from injector import inject, singleton
+from langchain_core.documents import Document
+
+from api.settings.settings import Settings
+from api.components.metrics.metrics_component import MetricsComponent
+
+logger = logging.getLogger(__name__)
+
+@singleton
+class RerankComponent:
+    """Cross-encoder reranking of the retrieved chunks.
+
+    The (question, chunk) pairs of all candidates are scored in batches and
+    the ``top_n`` best chunks are kept, best first, with their score in the
+    ``rerank_score`` metadata. The model is only loaded when enabled.
+    """
+
+    @inject
+    def __init__(self, settings: Settings, metrics: MetricsComponent) -> None:
+        self.settings = settings.rag.rerank
+        self.enabled = self.settings.enabled
+        self.metrics = metrics
+        self.model = None
+        if self.enabled:
+            logger.info("Initializing RerankComponent")
+            from sentence_transformers import CrossEncoder
+
+            self.model = CrossEncoder(
+                self.settings.model, max_length=self.settings.max_length, device=self.settings.device
+            )
+
+    def score(self, question: str, docs: List[Document]) -> List[float]:
+        pairs = [(question, doc.page_content) for doc in docs]
+        with self.metrics.timer("rerank.score"):
+            scores = self.model.predict(pairs, batch_size=self.settings.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def rerank(self, question: str, docs: List[Document]) -> List[Document]:
+        if not docs:
+            return docs
+        scores = self.score(question, docs)
+        ranked = sorted(zip(scores, docs), key=lambda pair: pair[0], reverse=True)[:self.settings.top_n]
+        self.metrics.incr("rerank.candidates", len(docs))
+        for score in scores:
+            self.metrics.record("rerank.candidate_score", score)
+        self.metrics.record("rerank.top_score", ranked[0][0])
+        self.metrics.record("rerank.cutoff_score", ranked[-1][0])
+        kept = []
+        for score, doc in ranked:
+            kept.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score": score}))
+        return kept
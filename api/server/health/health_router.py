@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Request
+from starlette.responses import JSONResponse
+
+from api.components.llm.llmodel_component import LLModelComponent
+from api.server.health.health_service import HealthService
+
+health_router = APIRouter()
+
+@health_router.get("/health/ready")
+async def ready(request: Request):
+    service = request.state.injector.get(HealthService)
+    if not service.ready:
+        # retries the failed steps, e.g. a dependency that was down at startup
+        service.start()
+    body = {"ready": service.ready, "warming": service.warming, "checks": service.checks}
+    if service.ready:
+        body["llm_backends"] = request.state.injector.get(LLModelComponent).router.state()
+    return JSONResponse(body, status_code=200 if service.ready else 503)
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from injector import Injector, inject, singleton
+from langchain_core.documents import Document
+
+from api.components.embedding.embedmodel_component import EmbedModelComponent
+from api.components.llm.llmodel_component import LLModelComponent
+from api.components.metrics.metrics_component import MetricsComponent
+from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
+from api.components.qdrant.qdrant_component import QdrantComponent
+from api.components.rerank.rerank_component import RerankComponent
+from api.server.ragchat.ragchat_service import RagChatService
+from api.settings.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+@singleton
+class HealthService:
+    """Startup warm-up and readiness of the API.
+
+    The warm-up resolves every component through the injector, runs a dummy
+    embedding, opens the Qdrant, MongoDB and LLM connections and compiles the
+    RAG chain, so the first request does not pay for any of it. It runs in a
+    background thread, the API is ready once every step succeeded.
+    """
+
+    @inject
+    def __init__(self, injector: Injector, settings: Settings, metrics: MetricsComponent) -> None:
+        self.injector = injector
+        self.settings = settings
+        self.metrics = metrics
+        self.ready = False
+        self.checks: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def warming(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the warm-up in a background thread, unless it is running or done"""
+        with self._lock:
+            if self.ready or self.warming:
+                return
+            self._thread = threading.Thread(target=self.warm_up, name="warm-up", daemon=True)
+            self._thread.start()
+
+    def _check(self, name: str, step: Callable[[], Any]) -> bool:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as error:
+            logger.error("Warm-up step %s failed: %s", name, error)
+            self.checks[name] = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+            return False
+        seconds = time.perf_counter() - start
+        self.metrics.observe(f"startup.warmup.{name}", seconds)
+        self.checks[name] = {"ok": True, "ms": round(seconds * 1000, 1)}
+        return True
+
+    @staticmethod
+    def _warm_reranker(reranker: RerankComponent) -> None:
+        if reranker.enabled:
+            reranker.score("warm-up", [Document(page_content="warm-up")])
+
+    def warm_up(self) -> bool:
+        logger.info("Warming up the ARAH components")
+        injector = self.injector
+        steps = [
+            ("components", lambda: injector.get(RagChatService)),
+            # embed_documents bypasses the query embedding cache
+            ("embedding", lambda: injector.get(EmbedModelComponent).embed_model.embed_documents(["warm-up"])),
+            ("qdrant", lambda: injector.get(QdrantComponent).client.get_collection(self.settings.qdrant.vector_collectionname)),
+            ("mongodb", lambda: injector.get(MongoChatHistoryComponent).client.admin.command("ping")),
+            ("rerank", lambda: self._warm_reranker(injector.get(RerankComponent))),
+            ("llm", lambda: injector.get(LLModelComponent).warm_up()),
+            ("chain", lambda: injector.get(RagChatService)._with_message_history()),
+        ]
+        ok = True
+        for name, step in steps:
+            ok = self._check(name, step) and ok
+        self.ready = ok
+        logger.info("Warm-up %s: %s", "done" if ok else "failed", self.checks)
+        return ok
@@ -0,0 +1,350 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import suppress
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, TypeVar, Union
+
+from injector import inject, singleton
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables.config import RunnableConfig
+
+from api.components.metrics.metrics_component import MetricsComponent
+from api.settings.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class SchedulerFullError(RuntimeError):
+    """The generation queue is at ``max_queue_size``"""
+
+class SchedulerTimeoutError(TimeoutError):
+    """A request waited longer than ``queue_timeout_seconds`` or generated longer than ``generation_timeout_seconds``"""
+
+class Ticket:
+    """A request waiting for, or holding, a generation slot"""
+
+    def __init__(self, user_id: str, on_position: Optional[Callable[[int, int], None]]) -> None:
+        self.user_id = user_id
+        self.on_position = on_position
+        # 0 once the ticket holds a slot, 1 is the next one to get a slot
+        self.position: Optional[int] = None
+        self.granted: Future = Future()
+        self.enqueued = time.perf_counter()
+        self.released = False
+
+@singleton
+class GenerationScheduler:
+    """Admission of the generations to the LLM.
+
+    At most ``max_concurrent`` LLM calls run at a time, by default the
+    parallel slots of the inference servers. The others wait in a bounded
+    queue, in arrival order ('fifo') or round robin over the users ('fair'),
+    and are told their position whenever it changes. A request leaving the
+    queue, e.g. because its client disconnected, frees its place or slot.
+    Slots are granted by resolving a future, so sync and async callers share
+    one queue without a poll loop. A streamed request runs its chain on a
+    thread (sync) or a task (async) of its own, so the queue positions are
+    sent while its LLM calls wait.
+    """
+
+    @inject
+    def __init__(self, settings: Settings, metrics: MetricsComponent) -> None:
+        self.settings = settings.rag.scheduler
+        self.enabled = self.settings.enabled
+        self.metrics = metrics
+        self.max_concurrent = self.settings.max_concurrent or sum(backend.parallel_slots for backend in settings.llm.backends) or settings.llm.parallel_slots
+        self._lock = threading.Lock()
+        self._queues: OrderedDict[str, deque[Ticket]] = OrderedDict()
+        self._waiting = 0
+        self._running = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def _key(self, user_id: str) -> str:
+        return user_id if self.settings.ordering == "fair" else ""
+
+    def _order(self) -> list[Ticket]:
+        """The waiting tickets in the order they will get a slot"""
+        queues = list(self._queues.values())
+        order = []
+        for index in range(max((len(tickets) for tickets in queues), default=0)):
+            order.extend(tickets[index] for tickets in queues if index < len(tickets))
+        return order
+
+    def _dispatch(self) -> list[tuple[Ticket, int, int]]:
+        """Grant the free slots, returns the position updates to send once the lock is released"""
+        updates = []
+        while self._running < self.max_concurrent and self._queues:
+            key, tickets = next(iter(self._queues.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._waiting -= 1
+            if not ticket.granted.set_running_or_notify_cancel():
+                continue
+            self._running += 1
+            ticket.position = 0
+            ticket.granted.set_result(True)
+            self.metrics.observe("scheduler.wait", time.perf_counter() - ticket.enqueued)
+            updates.append((ticket, 0, self._waiting))
+        for position, ticket in enumerate(self._order(), 1):
+            if ticket.position != position:
+                ticket.position = position
+                updates.append((ticket, position, self._waiting))
+        return updates
+
+    @staticmethod
+    def _notify(updates: list[tuple[Ticket, int, int]]) -> None:
+        for ticket, position, waiting in updates:
+            if ticket.on_position is None:
+                continue
+            try:
+                ticket.on_position(position, waiting)
+            except Exception as e:
+                logger.error(f"Error notifying the queue position of user {ticket.user_id}: {e}")
+
+    def check_capacity(self) -> None:
+        """Raise SchedulerFullError if the queue is full, e.g. before a streamed response starts"""
+        if self._waiting >= self.settings.max_queue_size:
+            self.metrics.incr("scheduler.rejected")
+            raise SchedulerFullError(f"The generation queue is full ({self._waiting} requests waiting)")
+
+    def submit(self, user_id: str, on_position: Optional[Callable[[int, int], None]] = None) -> Ticket:
+        """Queue a request, ``on_position(position, waiting)`` is called on every change of its position"""
+        ticket = Ticket(user_id, on_position)
+        with self._lock:
+            if self._waiting >= self.settings.max_queue_size:
+                self.metrics.incr("scheduler.rejected")
+                raise SchedulerFullError(f"The generation queue is full ({self._waiting} requests waiting)")
+            self._queues.setdefault(self._key(user_id), deque()).append(ticket)
+            self._waiting += 1
+            self.metrics.record("scheduler.queue_length", self._waiting)
+            updates = self._dispatch()
+        self._notify(updates)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Free the slot of a ticket, or its place in the queue if it is still waiting"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                self._running -= 1
+            else:
+                ticket.granted.cancel()
+                tickets = self._queues.get(self._key(ticket.user_id))
+                if tickets is not None and ticket in tickets:
+                    tickets.remove(ticket)
+                    self._waiting -= 1
+                    if not tickets:
+                        del self._queues[self._key(ticket.user_id)]
+                self.metrics.incr("scheduler.cancelled")
+            updates = self._dispatch()
+        self._notify(updates)
+
+    def _timed_out(self, ticket: Ticket) -> SchedulerTimeoutError:
+        self.release(ticket)
+        self.metrics.incr("scheduler.timeouts")
+        return SchedulerTimeoutError(f"No generation slot after {self.settings.queue_timeout_seconds}s")
+
+    def wait(self, ticket: Ticket) -> None:
+        try:
+            ticket.granted.result(self.settings.queue_timeout_seconds)
+        except FutureTimeoutError:
+            raise self._timed_out(ticket) from None
+
+    async def await_slot(self, ticket: Ticket) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(ticket.granted)), self.settings.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            raise self._timed_out(ticket) from None
+
+    def _generation_timeout(self) -> SchedulerTimeoutError:
+        self.metrics.incr("scheduler.timeouts")
+        return SchedulerTimeoutError(f"Generation took longer than {self.settings.generation_timeout_seconds}s")
+
+    def _deadline(self) -> Optional[float]:
+        if self.settings.generation_timeout_seconds is None:
+            return None
+        return time.perf_counter() + self.settings.generation_timeout_seconds
+
+    def _submit(self, config: RunnableConfig) -> tuple[Ticket, Optional["GenerationRequest"]]:
+        configurable = config.get("configurable", {})
+        request = configurable.get("generation_request")
+        ticket = self.submit(configurable.get("user_id", ""), request.on_position if request is not None else None)
+        if request is not None:
+            request.add(ticket)
+        return ticket, request
+
+    def _gated_stream(self, runnable: Runnable, input: Any, config: RunnableConfig) -> Iterator[Any]:
+        ticket, _ = self._submit(config)
+        try:
+            self.wait(ticket)
+            deadline = self._deadline()
+            for chunk in runnable.stream(input, config):
+                if deadline is not None and time.perf_counter() > deadline:
+                    raise self._generation_timeout()
+                yield chunk
+        finally:
+            self.release(ticket)
+
+    async def _agated_stream(self, runnable: Runnable, input: Any, config: RunnableConfig) -> AsyncIterator[Any]:
+        ticket, _ = self._submit(config)
+        chunks = None
+        try:
+            await self.await_slot(ticket)
+            deadline = self._deadline()
+            chunks = runnable.astream(input, config)
+            while True:
+                try:
+                    # also bounds a single chunk, e.g. a stalled inference server
+                    timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise self._generation_timeout() from None
+                yield chunk
+        finally:
+            self.release(ticket)
+            if chunks is not None and hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def gate(self, runnable: Runnable) -> Runnable:
+        """The runnable, an LLM, holding a generation slot while it runs.
+
+        The user and the ``GenerationRequest`` the queue positions go to are
+        read from the ``configurable`` of the run. Only the LLM calls take a
+        slot, the history, the rephrase prompt and the retrieval of a request
+        run while other requests generate.
+        """
+        if not self.enabled:
+            return runnable
+        return RunnableLambda(
+            partial(self._gated_stream, runnable),
+            afunc=partial(self._agated_stream, runnable),
+        ).with_config(run_name="generation_slot")
+
+    def stream(self, start: Callable[["GenerationRequest"], Iterator[T]]) -> Iterator[Union[dict, T]]:
+        """The chunks of ``start(request)`` with the queue positions of its LLM calls as ``{"queue_position", "queue_length"}`` chunks.
+
+        ``start`` runs on its own thread, so the positions come while its LLM
+        calls wait for a slot. Closing the stream frees their places.
+        """
+        events: queue.SimpleQueue = queue.SimpleQueue()
+        request = GenerationRequest(self, lambda position, waiting: events.put(("position", (position, waiting))))
+
+        def produce() -> None:
+            chunks = None
+            try:
+                chunks = start(request)
+                for chunk in chunks:
+                    if request.closed:
+                        break
+                    events.put(("chunk", chunk))
+            except BaseException as e:
+                events.put(("error", e))
+                return
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            events.put(("end", None))
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(produce,), name="generation-stream", daemon=True).start()
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "position":
+                    if value[0] > 0:
+                        yield {"queue_position": value[0], "queue_length": value[1]}
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            request.close()
+
+    async def astream(self, start: Callable[["GenerationRequest"], AsyncIterator[T]]) -> AsyncIterator[Union[dict, T]]:
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        request = GenerationRequest(self, lambda position, waiting: loop.call_soon_threadsafe(events.put_nowait, ("position", (position, waiting))))
+
+        async def produce() -> None:
+            chunks = None
+            try:
+                chunks = start(request)
+                async for chunk in chunks:
+                    events.put_nowait(("chunk", chunk))
+            except Exception as e:
+                events.put_nowait(("error", e))
+                return
+            finally:
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+            events.put_nowait(("end", None))
+
+        task = asyncio.ensure_future(produce())
+        try:
+            while True:
+                kind, value = await events.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "position":
+                    if value[0] > 0:
+                        yield {"queue_position": value[0], "queue_length": value[1]}
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            request.close()
+            if not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+
+class GenerationRequest:
+    """The LLM calls of one streamed request, set in the ``configurable`` of its run as ``generation_request``"""
+
+    def __init__(self, scheduler: GenerationScheduler, on_position: Callable[[int, int], None]) -> None:
+        self.scheduler = scheduler
+        self.on_position = on_position
+        self.closed = False
+        self._tickets: list[Ticket] = []
+        self._lock = threading.Lock()
+
+    def add(self, ticket: Ticket) -> None:
+        with self._lock:
+            if not self.closed:
+                self._tickets.append(ticket)
+                return
+        # the stream was closed while the chain was still running
+        self.scheduler.release(ticket)
+
+    def close(self) -> None:
+        """Free the queue places and slots of the LLM calls, e.g. when the client disconnected"""
+        with self._lock:
+            self.closed = True
+            tickets, self._tickets = self._tickets, []
+        for ticket in tickets:
+            self.scheduler.release(ticket)
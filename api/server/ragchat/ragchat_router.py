@@ -1,9 +1,19 @@
-from fastapi import APIRouter, Request
+import json
+import logging
+import time
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
 from api.server.ragchat.ragchat_service import RagChatService
+from api.server.ragchat.generation_scheduler import SchedulerFullError, SchedulerTimeoutError
+from api.components.metrics.metrics_component import MetricsComponent
+from api.components.answercache.answercache_component import AnswerCacheComponent
 from starlette.responses import StreamingResponse
 from typing import Union
-from collections.abc import Iterator
+from collections.abc import AsyncIterator
+
+logger = logging.getLogger(__name__)
 
 class ChatCompletion(BaseModel):
     response: str
@@ -17,38 +27,131 @@ class RAGChatBody(BaseModel):
     session_id: str
     user_id: str
 
+def to_sse_event(data: Union[dict, str], event: Union[str, None] = None) -> str:
+    if not isinstance(data, str):
+        data = json.dumps(data, separators=(",", ":"), default=str)
+    if event is None:
+        return f"data: {data}\n\n"
+    return f"event: {event}\ndata: {data}\n\n"
+
 def to_openai_sse_stream(
-    response_generator: Iterator[dict],
-) -> Iterator[dict]:
-    for response in response_generator:
-            yield f"data: {response}\n\n"
+    response_generator: AsyncIterator[dict],
+    model: str,
+) -> AsyncIterator[str]:
+    """Convert the chain output into OpenAI style ``chat.completion.chunk`` events.
+
+    While the request waits for a generation slot, ``queue`` events carry its
+    position. A ``sources`` event carrying only page/source metadata is sent
+    as soon as retrieval finishes, then one chunk per token delta, the final
+    chunk with ``finish_reason``, a ``done`` event with the number of answer
+    chunks and the timing, and ``[DONE]``. The chunks are not tokens, e.g. a
+    cached answer is replayed word by word.
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    def chunk(delta: dict, finish_reason: Union[str, None] = None) -> dict:
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    async def generate() -> AsyncIterator[str]:
+        start = time.perf_counter()
+        first_token = None
+        completion_chunks = 0
+        sources_sent = False
+        try:
+            async for response in response_generator:
+                if "queue_position" in response:
+                    yield to_sse_event({"id": completion_id, "position": response["queue_position"], "length": response["queue_length"]}, event="queue")
+                    continue
+                if "context" in response and not sources_sent:
+                    sources_sent = True
+                    yield to_sse_event({"id": completion_id, "sources": RagChatService.source_metadata(response["context"])}, event="sources")
+                if response.get("answer"):
+                    delta = {"content": response["answer"]}
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        delta["role"] = "assistant"
+                    completion_chunks += 1
+                    yield to_sse_event(chunk(delta))
+        except Exception as e:
+            logger.exception("Error while streaming the chat completion")
+            yield to_sse_event({"error": {"message": str(e), "type": type(e).__name__}}, event="error")
+            return
+        yield to_sse_event(chunk({}, finish_reason="stop"))
+        end = time.perf_counter()
+        yield to_sse_event({
+            "id": completion_id,
+            "completion_chunks": completion_chunks,
+            "timing": {
+                "time_to_first_token_ms": round((first_token - start) * 1000, 1) if first_token else None,
+                "total_ms": round((end - start) * 1000, 1),
+            },
+        }, event="done")
+        yield to_sse_event("[DONE]")
+
+    return generate()
 
 @ragchat_router.post("/arahchat", response_model=None)
 async def arahchat(request: Request, body: RAGChatBody) -> Union[ChatCompletion, StreamingResponse]:
     service = request.state.injector.get(RagChatService)
     if body.stream:
-        completion_gen = service.stream(body.message, body.session_id, body.user_id)
+        try:
+            completion_gen = service.astream(body.message, body.session_id, body.user_id)
+        except SchedulerFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         return StreamingResponse(
             to_openai_sse_stream(
-                completion_gen.response
+                completion_gen.response, service.settings.llm.llm_name
             ),
             media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
     else:
-        chatcompletion = service.chat(body.message, body.session_id, body.user_id)
+        try:
+            chatcompletion = await service.achat(body.message, body.session_id, body.user_id)
+        except SchedulerFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except SchedulerTimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
         return chatcompletion
     
+# plain def routes run in the threadpool, so the sync Mongo calls do not block the event loop
 @ragchat_router.get("/get_aggregated_history_per_user/{user_id}")
-async def get_aggregated_history_per_user(request: Request, user_id: str):
+def get_aggregated_history_per_user(request: Request, user_id: str):
     service = request.state.injector.get(RagChatService)
     history = service.get_aggregated_history_per_user(user_id)
     return history
 
+@ragchat_router.get("/sessions/{user_id}")
+def list_sessions(request: Request, user_id: str, limit: int = Query(20, ge=1, le=100), cursor: Union[str, None] = None):
+    service = request.state.injector.get(RagChatService)
+    return service.list_sessions(user_id, limit, cursor)
+
+@ragchat_router.get("/sessions/{user_id}/{session_id}/messages")
+def get_session_messages(request: Request, user_id: str, session_id: str):
+    service = request.state.injector.get(RagChatService)
+    return service.get_session_messages(session_id, user_id)
+
 @ragchat_router.delete("/delete_session_history/{session_id}/{user_id}")
-async def delete_session_history(request: Request, session_id: str, user_id: str):
+def delete_session_history(request: Request, session_id: str, user_id: str):
     try:
         service = request.state.injector.get(RagChatService)
         service.delete_session_history(session_id, user_id)
         return True
     except Exception as e:
         return str(e)
+
+@ragchat_router.get("/metrics")
+async def metrics(request: Request):
+    return request.state.injector.get(MetricsComponent).snapshot()
+
+@ragchat_router.delete("/answer_cache")
+def clear_answer_cache(request: Request):
+    request.state.injector.get(AnswerCacheComponent).invalidate()
+    return True
@@ -10,18 +10,96 @@ from langchain_core.runnables import (
     RunnablePassthrough,
     RunnableParallel,
     RunnableLambda,
+    RunnableBranch,
+    RunnableGenerator,
 )
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
-from typing import Generator,Union
-from pydantic import BaseModel
+from api.components.metrics.metrics_component import MetricsComponent, StageTimingHandler
+from api.components.answercache.answercache_component import AnswerCacheComponent
+from api.components.rerank.rerank_component import RerankComponent
+from api.components.contextpacking.contextpacking_component import ContextPackingComponent
+from api.components.qdrant.retrievers import HybridQdrantRetriever, MMRQdrantRetriever
+from api.components.qdrant.sparse import BM25SparseEncoder
+from api.server.ragchat.generation_scheduler import GenerationRequest, GenerationScheduler
+from langchain_core.runnables.config import RunnableConfig, run_in_executor
+from langchain_core.messages import get_buffer_string
+from langchain_core.retrievers import BaseRetriever
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncGenerator,Generator,Iterator,Optional,Union
+from collections.abc import AsyncIterator
+from pydantic import BaseModel, ConfigDict
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Named runs of the chain whose duration is recorded per request
+CHAIN_STAGES = {"load_history", "condense_question", "retrieve", "rerank", "pack_context", "generate_answer"}
+
+# Words that usually point back to earlier turns, a question containing one is not standalone
+_REFERRING_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "she", "his", "her", "him", "one", "ones", "above", "previous", "previously",
+    "earlier", "former", "latter", "mentioned", "same", "again", "else", "more", "other",
+}
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# Pieces a cached answer is streamed back in, words with their trailing whitespace
+_ANSWER_PIECES = re.compile(r"\s*\S+\s*")
+
+def is_standalone_question(question: str, min_words: int) -> bool:
+    words = _WORD_PATTERN.findall(question.lower())
+    return len(words) >= min_words and not any(word in _REFERRING_WORDS for word in words)
+
+def same_question(a: str, b: str) -> bool:
+    """True if the rephrased question only differs from the raw one by case, spacing or final punctuation"""
+    return _WORD_PATTERN.findall(a.lower()) == _WORD_PATTERN.findall(b.lower())
+
+def build_rag_prompt(system_prompt: str, context_prompt: str, layout: str) -> ChatPromptTemplate:
+    """Answer prompt for the ``rag.prompt_layout``.
+
+    'stable_prefix' puts the retrieved context in the last user message, so
+    the system prompt and the history stay a prefix of the next turn's
+    prompt and the inference server reuses their cached evaluation.
+    'context_in_system' keeps the context in the system prompt. 'auto' picks
+    'context_in_system' for a system prompt with a {context} placeholder and
+    'stable_prefix' otherwise. A system prompt that does not match an
+    explicit layout would silently drop the context or put it twice, it
+    raises a ValueError instead.
+    """
+    if layout == "auto":
+        layout = "context_in_system" if "{context}" in system_prompt else "stable_prefix"
+    if layout == "stable_prefix":
+        if "{context}" in system_prompt:
+            raise ValueError("The rag_system_prompt must not contain {context} with the 'stable_prefix' prompt layout, "
+                             "the context goes in the rag_context_prompt")
+        last_message = context_prompt
+    else:
+        if "{context}" not in system_prompt:
+            raise ValueError("The rag_system_prompt must contain {context} with the 'context_in_system' prompt layout")
+        last_message = "{question}"
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", last_message),
+        ])
 
 
 class ChatCompletionGen(BaseModel):
     response: Generator[dict, None, None]
 
+class ChatCompletionAsyncGen(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    response: AsyncIterator
+
 class ChatCompletion(BaseModel):
     response: str
     sources: Union[list, None]
@@ -30,91 +108,376 @@ class ChatCompletion(BaseModel):
 class RagChatService:
 
     @inject
-    def __init__(self, settings: Settings, qdrant: QdrantComponent, llm: LLModelComponent, mongodb: MongoChatHistoryComponent ) -> None:
+    def __init__(self, settings: Settings, qdrant: QdrantComponent, llm: LLModelComponent, mongodb: MongoChatHistoryComponent, metrics: MetricsComponent, answer_cache: AnswerCacheComponent, reranker: RerankComponent, scheduler: GenerationScheduler, context_packer: ContextPackingComponent) -> None:
         self.settings = settings
         self.qdrant = qdrant.qdrant
-        self.llm = llm.llm
+        self.search_params = qdrant.search_params
+        # only the LLM calls wait for a generation slot
+        self.llm = scheduler.gate(llm.answer_llm)
+        self.rephrase_llm = scheduler.gate(llm.rephrase_llm)
         self.mongodb = mongodb
-        self.sources = []
+        self.metrics = metrics
+        self.answer_cache = answer_cache
+        self.reranker = reranker
+        self.scheduler = scheduler
+        self.context_packer = context_packer
+        self._chain = None
+        self._chain_lock = threading.Lock()
+        self._retrieval = None
+        self._speculations: dict[str, Union[Future, asyncio.Future]] = {}
+        self._speculation_executor = None
+        if settings.rag.speculative_retrieval:
+            self._speculation_executor = ThreadPoolExecutor(thread_name_prefix="speculative-retrieval")
+        self._summary_chain = None
+        self._summary_executor = None
+        if settings.rag.history_summary.enabled:
+            self._summary_chain = self._build_summary_chain()
+            # a single worker keeps the summary updates of a session in order
+            self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        # compile the chain once at startup, requests only bind session_id/user_id
+        self._with_message_history()
 
     def format_docs(self,docs):
             return {
             'content': "\n\n".join([d.page_content for d in docs]),
             'sources': [str(d.metadata.get('page', '')) + ' ' + str(d.metadata.get('source', '')) for d in docs]}
     
-    def capture_output(self, output):
-        self.sources = output['context']['sources']
-        return output
+    def format_context(self, docs):
+        """Context interpolated in the answer prompt"""
+        if self.context_packer.enabled:
+            return self.context_packer.format(docs)
+        return self.format_docs(docs)
+
+    @staticmethod
+    def source_metadata(docs) -> list[dict]:
+        return [{'page': d.metadata.get('page'), 'source': d.metadata.get('source')} for d in docs]
     
     def _with_message_history(self) -> RunnableWithMessageHistory:
-        question_system_prompt = self.settings.ui.question_system_prompt
-        rephrase_question_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", question_system_prompt),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{question}"),
-            ]
-        )
+        if self._chain is None:
+            with self._chain_lock:
+                if self._chain is None:
+                    with self.metrics.timer("startup.build_chain"):
+                        self._chain = self._build_chain()
+                    startup = {name: timing["last_ms"] for name, timing in self.metrics.snapshot()["timings"].items() if name.startswith("startup.")}
+                    logger.info("RAG chain compiled (ms): %s", " ".join(f"{name}={ms:.1f}" for name, ms in startup.items()))
+        return self._chain
+
+    def _build_retriever(self) -> BaseRetriever:
+        qdrant_settings = self.settings.qdrant
+        k = qdrant_settings.similarity_top_k
+        if self.reranker.enabled:
+            # over-fetch, the cross-encoder keeps the rerank.top_n best candidates
+            k = self.settings.rag.rerank.candidates
+        if qdrant_settings.search_type == "hybrid":
+            return HybridQdrantRetriever(
+                vectorstore=self.qdrant,
+                encoder=BM25SparseEncoder(),
+                sparse_vector_name=qdrant_settings.sparse_vector_name,
+                k=k,
+                prefetch_k=max(qdrant_settings.hybrid_prefetch_k, k),
+                rrf_k=qdrant_settings.rrf_k,
+                search_params=self.search_params,
+            )
+        if qdrant_settings.search_type == "mmr":
+            return MMRQdrantRetriever(
+                vectorstore=self.qdrant,
+                k=k,
+                fetch_k=max(qdrant_settings.fetch_k, 2 * k if self.reranker.enabled else k),
+                lambda_mult=qdrant_settings.lambda_mult,
+                search_params=self.search_params,
+            )
+        return self.qdrant.as_retriever(search_type="similarity", search_kwargs={'k': k, 'search_params': self.search_params})
+
+    def _build_chain(self) -> RunnableWithMessageHistory:
+        with self.metrics.timer("startup.prompts"):
+            question_system_prompt = self.settings.ui.question_system_prompt
+            rephrase_question_prompt = ChatPromptTemplate.from_messages(
+                [
+                    ("system", question_system_prompt),
+                    MessagesPlaceholder(variable_name="chat_history"),
+                    ("human", "{question}"),
+                ]
+            )
+            rag_prompt = build_rag_prompt(self.settings.ui.rag_system_prompt,
+                                          self.settings.ui.rag_context_prompt,
+                                          self.settings.rag.prompt_layout)
         parse_output = StrOutputParser()
 
-        retriever = self.qdrant.as_retriever(search_type=self.settings.qdrant.search_type,search_kwargs={'k': self.settings.qdrant.similarity_top_k, 'lambda_mult': self.settings.qdrant.lambda_mult})
+        with self.metrics.timer("startup.retriever"):
+            retriever = self._build_retriever()
 
-        question_chain = rephrase_question_prompt | self.llm | parse_output
+        with self.metrics.timer("startup.graph"):
+            question_chain = (rephrase_question_prompt | self.rephrase_llm | parse_output).with_config(run_name="condense_question")
+            condense_chain = RunnableBranch(
+                (self._should_condense, question_chain),
+                RunnableLambda(lambda x: x['question']).with_config(run_name="skip_condense"),
+            )
 
-        retriever_chain = question_chain | retriever
+            retriever_chain = RunnableLambda(lambda x: x['standalone_question']) | retriever.with_config(run_name="retrieve")
+            if self.reranker.enabled:
+                rerank_chain = RunnableLambda(lambda x: self.reranker.rerank(x['standalone_question'], x['context'])).with_config(run_name="rerank")
+                retriever_chain = RunnablePassthrough.assign(context=retriever_chain) | rerank_chain
+            self._retrieval = retriever_chain
 
-        rag_system_prompt = self.settings.ui.rag_system_prompt
+            rag_chain_from_docs = (RunnablePassthrough.assign(context=(lambda x: self.format_context(x["context"]))) | rag_prompt | self.llm | parse_output).with_config(run_name="generate_answer")
+            context_chain = RunnableLambda(self._retrieve, afunc=self._aretrieve).with_config(run_name="context")
+            if self.context_packer.enabled:
+                context_chain = context_chain | RunnableLambda(self.context_packer.pack).with_config(run_name="pack_context")
+            generate_chain = RunnablePassthrough.assign(context=context_chain).assign(answer=rag_chain_from_docs)
+            rag_chain_with_source = RunnablePassthrough.assign(standalone_question=condense_chain)
+            if self.answer_cache.enabled:
+                cached_answer_chain = RunnablePassthrough.assign(context=lambda x: x['cached']['context']).assign(
+                    answer=RunnableGenerator(self._replay_cached_answer, self._areplay_cached_answer)).with_config(run_name="cached_answer")
+                rag_chain_with_source = (rag_chain_with_source
+                                         | RunnablePassthrough.assign(cached=lambda x: self.answer_cache.lookup(x['standalone_question']))
+                                         | RunnableBranch((lambda x: x['cached'] is not None, cached_answer_chain), generate_chain)
+                                         | RunnableGenerator(self._remember_answer, self._aremember_answer))
+            else:
+                rag_chain_with_source = rag_chain_with_source | generate_chain
 
-        rag_prompt = ChatPromptTemplate.from_messages(
+            with_message_history = RunnableWithMessageHistory(rag_chain_with_source,
+                                                              self.mongodb.get_session_history,
+                                                              input_messages_key="question",
+                                                              history_messages_key="chat_history",
+                                                              output_messages_key="answer",
+                                                              history_factory_config=[
+                                                                ConfigurableFieldSpec(
+                                                                    id="user_id",
+                                                                    annotation=str,
+                                                                    name="User ID",
+                                                                    description="Unique identifier for the user.",
+                                                                    default="",
+                                                                    is_shared=True,
+                                                                ),
+                                                                ConfigurableFieldSpec(
+                                                                    id="session_id",
+                                                                    annotation=str,
+                                                                    name="Session ID",
+                                                                    description="Unique identifier for the conversation.",
+                                                                    default="",
+                                                                    is_shared=True,
+                                                                )])
+        return with_message_history
+
+    def _build_summary_chain(self):
+        summary_prompt = ChatPromptTemplate.from_messages(
             [
-                ("system", rag_system_prompt),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{question}"),
+                ("system", self.settings.rag.history_summary.prompt),
+                ("human", "Previous summary:\n{summary}\n\nNew lines of conversation:\n{conversation}"),
             ])
-        
-        # rag_chain = (retriever_chain | self.capture_output | rag_prompt | self.llm | parse_output)
-        
+        return (summary_prompt | self.rephrase_llm | StrOutputParser()).with_config(run_name="summarize_history")
+
+    def _update_history_summary(self, session_id: str, user_id: str) -> None:
+        """Fold the messages that fell out of the history window into the session summary"""
+        try:
+            history = self.mongodb.get_session_history(session_id, user_id)
+            pending, summarized_until = history.messages_to_summarize()
+            if len(pending) < self.settings.rag.history_summary.min_messages:
+                return
+            previous = history.get_summary() or {}
+            with self.metrics.timer("history.summarize"):
+                summary = self._summary_chain.invoke({"summary": previous.get("summary", ""), "conversation": get_buffer_string(pending)})
+            history.update_summary(summary, summarized_until)
+            self.metrics.incr("history.summaries")
+        except Exception as e:
+            logger.error(f"Error updating the history summary of session {session_id}: {e}")
+
+    def _after_turn(self, session_id: str, user_id: str) -> None:
+        if self._summary_executor is not None:
+            self._summary_executor.submit(self._update_history_summary, session_id, user_id)
+
+    def _speculate(self, message: str, timings: StageTimingHandler, is_async: bool = False) -> Optional[str]:
+        """Start retrieving on the raw question before the chain runs.
+
+        The retrieval overlaps the history load and the rephrase, the chain
+        picks the result up by the returned request id. The async path runs it
+        as a task on the event loop, the sync path on the speculation threads.
+        """
+        if self._speculation_executor is None:
+            return None
+        request_id = uuid.uuid4().hex
+        inputs, config = {'standalone_question': message}, {"callbacks": [timings]}
+        if is_async:
+            self._speculations[request_id] = asyncio.ensure_future(self._retrieval.ainvoke(inputs, config))
+        else:
+            self._speculations[request_id] = self._speculation_executor.submit(self._retrieval.invoke, inputs, config)
+        return request_id
+
+    def _take_speculation(self, inputs: dict, config: RunnableConfig) -> Optional[Union[Future, asyncio.Future]]:
+        """The speculative retrieval of the request if it matches the standalone question, cancelled otherwise"""
+        speculation = self._speculations.pop(config.get("configurable", {}).get("request_id"), None)
+        if speculation is None:
+            return None
+        if same_question(inputs['standalone_question'], inputs['question']):
+            self.metrics.incr("retrieval.speculative_hit")
+            return speculation
+        speculation.cancel()
+        self.metrics.incr("retrieval.speculative_miss")
+        return None
+
+    def _discard_speculation(self, request_id: Optional[str]) -> None:
+        """Cancel a speculative retrieval the chain did not use, e.g. on an answer cache hit"""
+        speculation = self._speculations.pop(request_id, None)
+        if speculation is not None:
+            speculation.cancel()
+
+    def _retrieve(self, inputs: dict, config: RunnableConfig) -> list:
+        speculation = self._take_speculation(inputs, config)
+        if speculation is not None:
+            return speculation.result()
+        return self._retrieval.invoke(inputs, config)
+
+    async def _aretrieve(self, inputs: dict, config: RunnableConfig) -> list:
+        speculation = self._take_speculation(inputs, config)
+        if speculation is not None:
+            return await (speculation if asyncio.isfuture(speculation) else asyncio.wrap_future(speculation))
+        return await self._retrieval.ainvoke(inputs, config)
+
+    def _should_condense(self, inputs: dict) -> bool:
+        """Decide if the question needs the rephrasing LLM call before retrieval"""
+        mode = self.settings.rag.condense_question
+        if mode == "always":
+            condense = True
+        elif not inputs['chat_history']:
+            condense = False
+        elif mode == "heuristic":
+            condense = not is_standalone_question(inputs['question'], self.settings.rag.standalone_min_words)
+        else:
+            condense = True
+        self.metrics.incr("rephrase.invoked" if condense else "rephrase.skipped")
+        return condense
+
+    @staticmethod
+    def _merge_chunk(final: dict, chunk: dict) -> dict:
+        for key, value in chunk.items():
+            if key == 'answer' and key in final:
+                final[key] += value
+            else:
+                final[key] = value
+        return final
+
+    def _replay_cached_answer(self, inputs: Iterator[dict]) -> Iterator[str]:
+        """Stream a cached answer back word by word"""
+        final = {}
+        for chunk in inputs:
+            self._merge_chunk(final, chunk)
+        yield from _ANSWER_PIECES.findall(final['cached']['answer'])
+
+    async def _areplay_cached_answer(self, inputs: AsyncIterator[dict]) -> AsyncIterator[str]:
+        final = {}
+        async for chunk in inputs:
+            self._merge_chunk(final, chunk)
+        for piece in _ANSWER_PIECES.findall(final['cached']['answer']):
+            yield piece
+
+    def _store_answer(self, final: dict) -> None:
+        if final.get('cached') is None and final.get('answer'):
+            self.answer_cache.store(final['standalone_question'], final['answer'], final['context'])
+
+    def _remember_answer(self, chunks: Iterator[dict]) -> Iterator[dict]:
+        """Pass the output through and cache the answer once it is complete"""
+        final = {}
+        for chunk in chunks:
+            yield chunk
+            self._merge_chunk(final, chunk)
+        self._store_answer(final)
+
+    async def _aremember_answer(self, chunks: AsyncIterator[dict]) -> AsyncIterator[dict]:
+        final = {}
+        async for chunk in chunks:
+            yield chunk
+            self._merge_chunk(final, chunk)
+        await run_in_executor(None, self._store_answer, final)
+
+    def _request_config(self, session_id: str, user_id: str, timings: StageTimingHandler, request_id: Optional[str] = None, generation_request: Optional[GenerationRequest] = None) -> dict:
+        # the request id picks up the speculative retrieval, it stays out of the chain output
+        configurable = {"session_id": session_id, "user_id": user_id, "request_id": request_id}
+        if generation_request is not None:
+            configurable["generation_request"] = generation_request
+        return {"configurable": configurable, "callbacks": [timings]}
+
+    def _log_timings(self, kind: str, timings: StageTimingHandler, total: float) -> None:
+        self.metrics.observe(f"request.{kind}_total", total)
+        logger.info("%s timings (ms): total=%.1f %s", kind, total * 1000,
+                    " ".join(f"{name}={seconds * 1000:.1f}" for name, seconds in timings.durations.items()))
+
+    def _timed_stream(self, chunks: Iterator[dict], timings: StageTimingHandler, start: float, session_id: str, user_id: str, request_id: Optional[str] = None) -> Generator[dict, None, None]:
+        first_token = False
+        try:
+            for chunk in chunks:
+                if not first_token and 'answer' in chunk:
+                    first_token = True
+                    self.metrics.observe("request.time_to_first_token", time.perf_counter() - start)
+                yield chunk
+        finally:
+            self._discard_speculation(request_id)
+        self._log_timings("stream", timings, time.perf_counter() - start)
+        self._after_turn(session_id, user_id)
+
+    async def _atimed_stream(self, chunks: AsyncIterator[dict], timings: StageTimingHandler, start: float, session_id: str, user_id: str, request_id: Optional[str] = None) -> AsyncGenerator[dict, None]:
+        first_token = False
+        try:
+            async for chunk in chunks:
+                if not first_token and 'answer' in chunk:
+                    first_token = True
+                    self.metrics.observe("request.time_to_first_token", time.perf_counter() - start)
+                yield chunk
+        finally:
+            self._discard_speculation(request_id)
+        self._log_timings("astream", timings, time.perf_counter() - start)
+        self._after_turn(session_id, user_id)
 
-        rag_chain_from_docs = RunnablePassthrough.assign(context=(lambda x: self.format_docs(x["context"]))) | rag_prompt | self.llm | parse_output
-        extract_history = RunnableLambda(lambda x: x['chat_history'])
-        extract_question = RunnableLambda(lambda x: x['question'])
-        rag_chain_with_source = RunnableParallel({"context": retriever_chain, "chat_history": extract_history,"question": extract_question}).assign(answer=rag_chain_from_docs)
-
-        with_message_history = RunnableWithMessageHistory(rag_chain_with_source,
-                                                          self.mongodb.get_session_history,
-                                                          input_messages_key="question",
-                                                          history_messages_key="chat_history",
-                                                          output_messages_key="answer",
-                                                          history_factory_config=[
-                                                            ConfigurableFieldSpec(
-                                                                id="user_id",
-                                                                annotation=str,
-                                                                name="User ID",
-                                                                description="Unique identifier for the user.",
-                                                                default="",
-                                                                is_shared=True,
-                                                            ),
-                                                            ConfigurableFieldSpec(
-                                                                id="session_id",
-                                                                annotation=str,
-                                                                name="Session ID",
-                                                                description="Unique identifier for the conversation.",
-                                                                default="",
-                                                                is_shared=True,
-                                                            )])
-        return with_message_history
-                
     def chat(self,message:str,session_id:str,user_id:str) -> ChatCompletion:
-        response = self._with_message_history().invoke({"question": message}, {"configurable": {"session_id": session_id, "user_id": user_id}})
+        start = time.perf_counter()
+        timings = StageTimingHandler(self.metrics, CHAIN_STAGES)
+        request_id = self._speculate(message, timings)
+        try:
+            response = self._with_message_history().invoke({"question": message}, self._request_config(session_id, user_id, timings, request_id))
+        finally:
+            self._discard_speculation(request_id)
         sources = self.format_docs(response['context'])
         chatcompletion = ChatCompletion(response=response['answer'], sources=sources['sources'])
+        self._log_timings("chat", timings, time.perf_counter() - start)
+        self._after_turn(session_id, user_id)
         return chatcompletion
     
     def stream(self,message:str,session_id:str,user_id:str) -> ChatCompletionGen:
-        streamresponse = self._with_message_history().stream({"question": message}, {"configurable": {"session_id": session_id, "user_id": user_id}})
-        chatcompletiongen = ChatCompletionGen(response=streamresponse)
+        # a full queue fails the request before the response starts streaming
+        if self.scheduler.enabled:
+            self.scheduler.check_capacity()
+        start = time.perf_counter()
+        timings = StageTimingHandler(self.metrics, CHAIN_STAGES)
+        request_id = self._speculate(message, timings)
+        start_stream = lambda generation_request=None: self._with_message_history().stream({"question": message}, self._request_config(session_id, user_id, timings, request_id, generation_request))
+        # the chain output with the queue positions of its LLM calls
+        streamresponse = self.scheduler.stream(start_stream) if self.scheduler.enabled else start_stream()
+        chatcompletiongen = ChatCompletionGen(response=self._timed_stream(streamresponse, timings, start, session_id, user_id, request_id))
         return chatcompletiongen
 
+    async def achat(self,message:str,session_id:str,user_id:str) -> ChatCompletion:
+        start = time.perf_counter()
+        timings = StageTimingHandler(self.metrics, CHAIN_STAGES)
+        request_id = self._speculate(message, timings, is_async=True)
+        try:
+            response = await self._with_message_history().ainvoke({"question": message}, self._request_config(session_id, user_id, timings, request_id))
+        finally:
+            self._discard_speculation(request_id)
+        sources = self.format_docs(response['context'])
+        chatcompletion = ChatCompletion(response=response['answer'], sources=sources['sources'])
+        self._log_timings("achat", timings, time.perf_counter() - start)
+        self._after_turn(session_id, user_id)
+        return chatcompletion
+
+    def astream(self,message:str,session_id:str,user_id:str) -> ChatCompletionAsyncGen:
+        if self.scheduler.enabled:
+            self.scheduler.check_capacity()
+        start = time.perf_counter()
+        timings = StageTimingHandler(self.metrics, CHAIN_STAGES)
+        request_id = self._speculate(message, timings, is_async=True)
+        start_stream = lambda generation_request=None: self._with_message_history().astream({"question": message}, self._request_config(session_id, user_id, timings, request_id, generation_request))
+        streamresponse = self.scheduler.astream(start_stream) if self.scheduler.enabled else start_stream()
+        return ChatCompletionAsyncGen(response=self._atimed_stream(streamresponse, timings, start, session_id, user_id, request_id))
+
     def get_aggregated_history_per_user(self, user_id: str):
         pipeline = [
             {
@@ -122,21 +485,42 @@ class RagChatService:
                     'UserId': user_id 
                 }
             },
+            {
+                '$sort': {'timestamp': 1, '_id': 1}
+            },
             {
                 '$group': {
                     '_id': '$SessionId',  
                     'user_id': {'$first': '$UserId'}, 
                     'count': {'$sum': 1},  
-                    'History': {'$push': '$History'} 
+                    'History': {'$push': '$History'},
+                    'timestamp': {'$max': '$timestamp'}
                 }
             },
             {
                 '$sort': {'timestamp': -1}  # Sort (descending) by timestamp
             }
             ]
+        if self.settings.mongodb.history_storage == "session":
+            pipeline = [
+                {'$match': {'UserId': user_id}},
+                {'$sort': {'timestamp': -1}},
+                {'$project': {'_id': '$SessionId', 'user_id': '$UserId', 'count': '$message_count', 'History': '$messages'}},
+            ]
         history = self.mongodb.get_session_history("","").getformatedmessage(pipeline)
+        if self.settings.mongodb.history_storage == "session":
+            # same shape as the per-message schema, one JSON string per message
+            for item in history or []:
+                item['History'] = [json.dumps(message) for message in item['History']]
         return history
     
+    def list_sessions(self, user_id: str, limit: int = 20, cursor: Union[str, None] = None) -> dict:
+        return self.mongodb.list_sessions(user_id, limit, cursor)
+
+    def get_session_messages(self, session_id: str, user_id: str) -> list[dict]:
+        messages = self.mongodb.get_session_history(session_id, user_id).all_messages()
+        return [{'role': message.type, 'content': message.content} for message in messages]
+
     def delete_session_history(self, session_id: str, user_id: str):
         try:
             return self.mongodb.get_session_history(session_id, user_id).clear()
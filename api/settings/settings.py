@@ -1,6 +1,6 @@
 
 
-from typing import Any, Literal
+from typing import Any, Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -59,6 +59,38 @@ class ARAHServerSettings(BaseModel):
         description="Authentication configuration",
         default_factory=lambda: ARAHAuthSettings(enabled=False, secret="secret-key"),
     )
+    warmup: bool = Field(
+        description="Warm up the models and connections at startup, /health/ready reports when it is done",
+        default=True,
+    )
+
+class ARAHLLMBackendSettings(BaseModel):
+    name: str = Field(
+        description="Name of the backend in the logs and metrics",
+    )
+    inference_server_url: str = Field(
+        description="OpenAI-compatible URL of the inference server",
+    )
+    llm_name: str = Field(
+        description="Model name to use for inference",
+        default="no-model",
+    )
+    api_key: str = Field(
+        description="API key to use for inference",
+        default="no-key",
+    )
+    weight: float = Field(
+        description="Relative share of the requests sent to the backend",
+        default=1,
+    )
+    parallel_slots: int = Field(
+        description="Number of parallel slots of the inference server (llama.cpp --parallel)",
+        default=1,
+    )
+    roles: list[Literal["rephrase", "answer"]] = Field(
+        description="Requests served by the backend: 'rephrase' (question rephrasing and history summaries) and/or 'answer'",
+        default=["rephrase", "answer"],
+    )
 
 class ARAHLLMSettings(BaseModel):
     inference_server_url: str = Field(
@@ -77,6 +109,69 @@ class ARAHLLMSettings(BaseModel):
         description="Flag indicating if the server should stream the response or not",
         default=False,
     )
+    temperature: float = Field(
+        description="Sampling temperature of the generations",
+        default=0,
+    )
+    max_tokens: Optional[int] = Field(
+        description="Maximum number of tokens generated per request, None leaves it to the inference server",
+        default=None,
+    )
+    request_timeout_seconds: float = Field(
+        description="Timeout of a request to the inference server, between two streamed chunks when streaming",
+        default=120,
+    )
+    connect_timeout_seconds: float = Field(
+        description="Timeout of opening a connection to the inference server",
+        default=5,
+    )
+    max_retries: int = Field(
+        description="Retries of a request failing on a connection error, a timeout, 429 or 5xx, with exponential backoff",
+        default=2,
+    )
+    max_in_flight: int = Field(
+        description="Maximum number of requests open at once to the inference server, the size of the keep-alive connection pool",
+        default=8,
+    )
+    keepalive_expiry_seconds: float = Field(
+        description="Time an idle connection to the inference server is kept open",
+        default=60,
+    )
+    slot_affinity: bool = Field(
+        description="Flag indicating if the requests of a session are pinned to one of the parallel slots of the server "
+        "(llama.cpp id_slot/cache_prompt), so the prompt cache of the slot is reused across turns",
+        default=False,
+    )
+    cache_prompt: bool = Field(
+        description="Flag indicating if the requests ask the server to keep the prompt in its cache (llama.cpp cache_prompt), "
+        "also without slot affinity",
+        default=False,
+    )
+    parallel_slots: int = Field(
+        description="Number of parallel slots of the inference server (llama.cpp --parallel)",
+        default=1,
+    )
+    backends: list[ARAHLLMBackendSettings] = Field(
+        description="Inference servers the requests are balanced over. Empty uses inference_server_url, llm_name, "
+        "api_key and parallel_slots as the only backend",
+        default=[],
+    )
+    routing: Literal["least_outstanding", "latency"] = Field(
+        description="Backend choice: least outstanding requests per weight, or that load times the average time to the first token ('latency')",
+        default="least_outstanding",
+    )
+    health_check_interval_seconds: Optional[float] = Field(
+        description="Interval of the health checks of the backends, None disables them",
+        default=10,
+    )
+    circuit_failure_threshold: int = Field(
+        description="Consecutive failed requests after which a backend is taken out of the rotation",
+        default=3,
+    )
+    circuit_reset_seconds: float = Field(
+        description="Time a failing backend stays out of the rotation before a trial request",
+        default=30,
+    )
 
 class ARAHEmbeddingsSettings(BaseModel):
     embed_name: str = Field(
@@ -91,6 +186,51 @@ class ARAHEmbeddingsSettings(BaseModel):
         description="API key to use for embeddings",
         default="no-key",
     )
+    engine: Literal["sentence_transformers", "onnx", "onnx_int8", "remote"] = Field(
+        description="Embedding engine: PyTorch sentence-transformers, ONNX Runtime, int8-quantized ONNX Runtime (CPU only), "
+        "or remote to call the OpenAI-compatible server at inference_server_url",
+        default="sentence_transformers",
+    )
+    batch_size: int = Field(
+        description="Number of texts encoded per forward pass",
+        default=32,
+    )
+    num_threads: Optional[int] = Field(
+        description="Intra-op threads of the encoder, None lets the runtime decide",
+        default=None,
+    )
+    device: str = Field(
+        description="Torch device of the sentence_transformers engine",
+        default="cpu",
+    )
+    onnx_cache_dir: str = Field(
+        description="Directory where the ONNX exports and int8 quantizations of the model are kept",
+        default="models/onnx",
+    )
+    request_timeout_seconds: float = Field(
+        description="Timeout of a request to the remote embeddings server",
+        default=10,
+    )
+    max_connections: int = Field(
+        description="Size of the connection pool to the remote embeddings server",
+        default=20,
+    )
+    coalesce_window_ms: float = Field(
+        description="Milliseconds concurrent query embeddings wait to be sent to the remote server in one request",
+        default=5,
+    )
+    query_cache_size: int = Field(
+        description="Maximum number of query embeddings kept in the in-memory LRU cache, 0 disables the cache",
+        default=1024,
+    )
+    query_cache_ttl_seconds: float = Field(
+        description="Seconds a cached query embedding stays valid, 0 keeps it until evicted",
+        default=86400,
+    )
+    query_cache_path: Optional[str] = Field(
+        description="Path of an optional SQLite file used as a persistent tier of the query embedding cache",
+        default=None,
+    )
 
 class ARAHQdrantSettings(BaseModel):
     url: str = Field(
@@ -105,8 +245,8 @@ class ARAHQdrantSettings(BaseModel):
         description="Qdrant Vector Collection Name",
         default="ARH_Tool",
     )
-    search_type: Literal["mmr"] = Field(
-        description="Qdrant Search Type",
+    search_type: Literal["mmr", "similarity", "hybrid"] = Field(
+        description="Qdrant Search Type: dense 'mmr', dense 'similarity', or 'hybrid' dense + BM25 sparse search fused with RRF",
         default="mmr",
     )
     lambda_mult: float = Field(
@@ -117,6 +257,59 @@ class ARAHQdrantSettings(BaseModel):
         description="Qdrant Similarity Top K",
         default=3,
     )
+    fetch_k: int = Field(
+        description="Number of nearest chunks MMR picks the similarity_top_k diverse ones from",
+        default=20,
+    )
+    apply_index_settings: bool = Field(
+        description="Flag indicating if the API applies hnsw_m, hnsw_ef_construct, on_disk and quantization to the existing collection "
+        "at startup, which makes Qdrant rebuild the index when they changed. Otherwise only embeddocs.py sets them",
+        default=False,
+    )
+    hnsw_m: Optional[int] = Field(
+        description="HNSW graph degree of the collection, None leaves the collection setting as is",
+        default=None,
+    )
+    hnsw_ef_construct: Optional[int] = Field(
+        description="HNSW build-time candidate list size of the collection, None leaves the collection setting as is",
+        default=None,
+    )
+    hnsw_ef: Optional[int] = Field(
+        description="HNSW search-time candidate list size, None uses the Qdrant default",
+        default=None,
+    )
+    on_disk: Optional[bool] = Field(
+        description="Keep the original vectors on disk (memmap) instead of RAM, None leaves the collection setting as is",
+        default=None,
+    )
+    quantization: Optional[Literal["none", "int8"]] = Field(
+        description="Scalar quantization of the collection vectors, None leaves the collection setting as is",
+        default=None,
+    )
+    quantization_always_ram: bool = Field(
+        description="Keep the quantized vectors in RAM, useful with on_disk original vectors",
+        default=True,
+    )
+    quantization_rescore: bool = Field(
+        description="Rescore the quantized search hits with the original vectors",
+        default=True,
+    )
+    quantization_oversampling: Optional[float] = Field(
+        description="Factor of extra quantized hits fetched before rescoring",
+        default=None,
+    )
+    sparse_vector_name: str = Field(
+        description="Name of the BM25 sparse vector of the points, written by embeddocs.py --sparse",
+        default="bm25",
+    )
+    hybrid_prefetch_k: int = Field(
+        description="Number of hits of each of the dense and sparse searches fused by the hybrid search",
+        default=20,
+    )
+    rrf_k: int = Field(
+        description="Rank constant of the reciprocal rank fusion of the hybrid search",
+        default=60,
+    )
 
 class ARAHMongodbSettings(BaseModel):
     url: str = Field(
@@ -131,6 +324,226 @@ class ARAHMongodbSettings(BaseModel):
         description="MongoDB Collection Name",
         default="chat_history",
     )
+    max_pool_size: int = Field(
+        description="Maximum number of connections in the shared MongoDB connection pool",
+        default=50,
+    )
+    min_pool_size: int = Field(
+        description="Number of connections kept open in the shared MongoDB connection pool",
+        default=2,
+    )
+    max_idle_time_ms: int = Field(
+        description="Milliseconds a pooled MongoDB connection may stay idle before it is closed",
+        default=300000,
+    )
+    connect_timeout_ms: int = Field(
+        description="MongoDB connection timeout in milliseconds",
+        default=5000,
+    )
+    server_selection_timeout_ms: int = Field(
+        description="MongoDB server selection timeout in milliseconds",
+        default=5000,
+    )
+    socket_timeout_ms: int = Field(
+        description="MongoDB socket timeout in milliseconds",
+        default=10000,
+    )
+    summary_collectionname: str = Field(
+        description="MongoDB Collection Name of the rolling chat history summaries",
+        default="chat_history_summary",
+    )
+    history_storage: Literal["message", "session"] = Field(
+        description="Chat history schema: one document per 'message' in history_collectionname, "
+        "or one document per 'session' with a message array in session_collectionname",
+        default="message",
+    )
+    session_collectionname: str = Field(
+        description="MongoDB Collection Name of the session documents when history_storage is 'session'",
+        default="chat_sessions",
+    )
+    session_listing_collectionname: str = Field(
+        description="MongoDB Collection Name of the per-session listing documents (title, message count, last activity) "
+        "kept next to the messages when history_storage is 'message'",
+        default="chat_history_sessions",
+    )
+    session_max_messages: Optional[int] = Field(
+        description="Maximum number of messages kept in a session document, older ones are dropped. None keeps them all",
+        default=None,
+    )
+    background_writes: bool = Field(
+        description="Flag indicating if the messages of a turn are written on a background thread once the answer is complete, "
+        "reads of the same session wait for the pending write",
+        default=True,
+    )
+
+class ARAHAnswerCacheSettings(BaseModel):
+    enabled: bool = Field(
+        description="Flag indicating if answers are cached by the embedding of the standalone question",
+        default=False,
+    )
+    similarity_threshold: float = Field(
+        description="Minimum cosine similarity between two standalone questions to reuse a cached answer",
+        default=0.95,
+    )
+    max_size: int = Field(
+        description="Maximum number of cached answers per collection, the least recently used are evicted",
+        default=512,
+    )
+    collection_check_interval_seconds: float = Field(
+        description="Seconds between checks of the Qdrant collection, cached answers are dropped when it changed",
+        default=60,
+    )
+
+class ARAHHistorySummarySettings(BaseModel):
+    enabled: bool = Field(
+        description="Flag indicating if messages falling out of the history window are folded into a rolling summary",
+        default=False,
+    )
+    min_messages: int = Field(
+        description="Number of messages outside the window to collect before the summary is updated",
+        default=4,
+    )
+    prompt: str = Field(
+        description="System prompt used to update the rolling summary",
+        default="Progressively summarize the conversation below, extending the previous summary. "
+        "Keep the facts, decisions and open questions, and return only the new summary.",
+    )
+
+class ARAHRerankSettings(BaseModel):
+    enabled: bool = Field(
+        description="Rerank the retrieved candidates with a cross-encoder before building the prompt",
+        default=False,
+    )
+    model: str = Field(
+        description="Cross-encoder model scoring the (question, chunk) pairs",
+        default="BAAI/bge-reranker-base",
+    )
+    top_n: int = Field(
+        description="Number of best scored chunks passed to the prompt",
+        default=3,
+    )
+    candidates: int = Field(
+        description="Number of chunks fetched from Qdrant and scored by the cross-encoder",
+        default=20,
+    )
+    batch_size: int = Field(
+        description="Number of pairs scored per cross-encoder forward pass",
+        default=32,
+    )
+    max_length: int = Field(
+        description="Maximum number of tokens of a (question, chunk) pair, longer pairs are truncated",
+        default=512,
+    )
+    device: str = Field(
+        description="Torch device of the cross-encoder",
+        default="cpu",
+    )
+
+class ARAHContextPackingSettings(BaseModel):
+    enabled: bool = Field(
+        description="Merge the overlapping chunks, drop the near-duplicates and fit the context to a token budget before generation",
+        default=False,
+    )
+    token_budget: int = Field(
+        description="Maximum number of tokens of the context put in the answer prompt",
+        default=1500,
+    )
+    tokenizer: Optional[str] = Field(
+        description="Hugging Face tokenizer of the LLM counting the context tokens, None estimates four characters per token",
+        default=None,
+    )
+    duplicate_threshold: float = Field(
+        description="Share of the word shingles of a chunk found in a better ranked one above which it is dropped as a near-duplicate",
+        default=0.9,
+    )
+    citations: bool = Field(
+        description="Flag indicating if every passage of the context starts with a short [n] file p.page citation",
+        default=True,
+    )
+
+class ARAHSchedulerSettings(BaseModel):
+    enabled: bool = Field(
+        description="Flag indicating if the generations go through the scheduler, which bounds how many run at once",
+        default=True,
+    )
+    max_concurrent: Optional[int] = Field(
+        description="Maximum number of LLM calls running at once, None for the parallel slots of the inference servers (llama.cpp --parallel)",
+        default=None,
+    )
+    max_queue_size: int = Field(
+        description="Maximum number of requests waiting for a generation slot, further requests are rejected",
+        default=64,
+    )
+    ordering: Literal["fifo", "fair"] = Field(
+        description="Order the waiting requests get a slot: 'fifo' by arrival or 'fair' round robin over the users",
+        default="fair",
+    )
+    queue_timeout_seconds: float = Field(
+        description="Maximum time a request waits for a generation slot",
+        default=120,
+    )
+    generation_timeout_seconds: Optional[float] = Field(
+        description="Maximum duration of an LLM call once it has a slot, None for no limit",
+        default=300,
+    )
+
+class ARAHRagSettings(BaseModel):
+    condense_question: Literal["always", "history", "heuristic"] = Field(
+        description="When to rephrase the question into a standalone one before retrieval: "
+        "'always', only when the session has 'history', or when it has history and the "
+        "question does not look standalone ('heuristic')",
+        default="history",
+    )
+    standalone_min_words: int = Field(
+        description="Minimum number of words for the 'heuristic' mode to treat a question without references to earlier turns as standalone",
+        default=6,
+    )
+    speculative_retrieval: bool = Field(
+        description="Flag indicating if retrieval on the raw question starts with the request, overlapping the history load "
+        "and the rephrase. The result is kept when the standalone question equals the raw one",
+        default=True,
+    )
+    answer_cache: ARAHAnswerCacheSettings = Field(
+        description="Semantic answer cache configuration",
+        default_factory=ARAHAnswerCacheSettings,
+    )
+    history_max_messages: Optional[int] = Field(
+        description="Maximum number of the most recent chat history messages put in the prompts, None loads the whole session",
+        default=10,
+    )
+    history_window_step: Optional[int] = Field(
+        description="Move the start of the history window by this many messages at a time, so the prompt prefix stays "
+        "the same for several turns and is reused from the inference server cache. None slides it by one message",
+        default=None,
+    )
+    history_token_budget: Optional[int] = Field(
+        description="Approximate token budget of the chat history put in the prompts, the oldest messages are dropped first",
+        default=None,
+    )
+    history_summary: ARAHHistorySummarySettings = Field(
+        description="Rolling summary of the chat history older than the window",
+        default_factory=ARAHHistorySummarySettings,
+    )
+    rerank: ARAHRerankSettings = Field(
+        description="Cross-encoder reranking of the retrieved chunks",
+        default_factory=ARAHRerankSettings,
+    )
+    context_packing: ARAHContextPackingSettings = Field(
+        description="Packing of the retrieved chunks into the answer prompt",
+        default_factory=ARAHContextPackingSettings,
+    )
+    scheduler: ARAHSchedulerSettings = Field(
+        description="Queueing of the generations in front of the LLM",
+        default_factory=ARAHSchedulerSettings,
+    )
+    prompt_layout: Literal["auto", "context_in_system", "stable_prefix"] = Field(
+        description="Place of the retrieved context in the answer prompt: in the system prompt ('context_in_system'), "
+        "or in the last user message after the system prompt and the history ('stable_prefix'), which keeps the "
+        "prompt prefix identical across turns so the inference server reuses its cache. The rag_system_prompt "
+        "must contain {context} with 'context_in_system' and must not with 'stable_prefix'. 'auto' picks "
+        "'context_in_system' when the rag_system_prompt contains {context} and 'stable_prefix' otherwise",
+        default="auto",
+    )
 
 class ARAHUISettings(BaseModel):
     enabled: bool = Field(
@@ -149,6 +562,10 @@ class ARAHUISettings(BaseModel):
         description="Rag System Prompt",
         default="Please ask me a question."
     )
+    rag_context_prompt: str = Field(
+        description="Last user message of the 'stable_prefix' prompt layout, with the {context} and {question} placeholders",
+        default="Context:\n{context}\n\nQuestion: {question}"
+    )
 
 class Settings(BaseModel):
     server: ARAHServerSettings
@@ -156,13 +573,14 @@ class Settings(BaseModel):
     embeddings: ARAHEmbeddingsSettings
     qdrant: ARAHQdrantSettings
     mongodb: ARAHMongodbSettings
+    rag: ARAHRagSettings = Field(default_factory=ARAHRagSettings)
     ui: ARAHUISettings
 
 unsafe_settings = load_settings_from_profile()
 unsafe_typed_settings = Settings(**unsafe_settings)
 
 def settings() -> Settings:
-    from api.di import global_injector
+    from api.dependencyinjector import global_injector
     return global_injector.get(Settings)
 
 
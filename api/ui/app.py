@@ -1,14 +1,13 @@
 import streamlit as st
 from api.dependencyinjector import global_injector
 from api.server.ragchat.ragchat_service import RagChatService
+from api.server.health.health_service import HealthService
 import os
 os.environ["OPENAI_API_KEY"] = "your_openai_api_key"
 from streamlit_server_state import server_state, server_state_lock, no_rerun
 from datetime import datetime
 import hmac
 import pandas as pd
-import json
-import time
 import uuid
 
 
@@ -33,16 +32,6 @@ def setup_metadata(settings):
 def determine_availability():
     if "users_list" not in st.session_state:
         st.session_state["users_list"] = pd.read_csv("metadata/user_list.csv")
-    if "in_use" not in server_state:
-        update_server_state("in_use", False)
-    if "first_boot" not in st.session_state:
-        st.session_state["first_boot"] = True
-    else:
-        st.session_state["first_boot"] = False
-    if server_state["in_use"] and st.session_state["first_boot"]:
-        st.session_state["available"] = False
-    else:
-        st.session_state["available"] = True
     if "user_name" in st.session_state:
         if (
             f'{st.session_state["user_name"]}_count' in server_state
@@ -56,12 +45,6 @@ def determine_availability():
                 st.stop()
                 
 def check_password():
-    if "last_used" not in server_state:
-        update_server_state("last_used", datetime.now())
-    if (datetime.now() - server_state["last_used"]).total_seconds() > 60:
-        update_server_state("in_use", False)
-    if not (st.session_state["available"]):
-        st.error("The model is currently generating, try again in a few seconds.")
     def password_entered():
         if hmac.compare_digest(st.session_state["password"], st.secrets["password"]):
             st.session_state["password_correct"] = True
@@ -69,8 +52,7 @@ def check_password():
         else:
             st.session_state["password_correct"] = False
     if st.session_state.get("password_correct", False):
-        if st.session_state["available"]:
-            return True
+        return True
     st.session_state["user_name"] = st.text_input(
         "User",
         value="",
@@ -118,16 +100,27 @@ def delete_chat_history(chat_id,user_id,my_service):
     my_service.delete_session_history(chat_id,user_id)
 
 def ui_display_chat_history(my_service):
-    allmessages = my_service.get_aggregated_history_per_user(st.session_state['user_name'])
-    for chat_index, chat in enumerate(allmessages, start=1):
-        chat_label = f"Chat {chat_index}"
+    if "sessions_cursors" not in st.session_state:
+        st.session_state["sessions_cursors"] = [None]
+    page = my_service.list_sessions(st.session_state['user_name'], cursor=st.session_state["sessions_cursors"][-1])
+    for chat in page["sessions"]:
+        chat_label = chat["title"] or chat["session_id"]
         with st.sidebar.expander(chat_label):
-            parsed_messages = [json.loads(message) for message in chat["History"]]
-            for message_index, message in enumerate(parsed_messages, start=1):
-                st.write(message['data']['content'])
-            if st.button(f"Delete Chat {chat_index}", key=f"delete_{chat_index}"):
-                delete_chat_history(chat["_id"], chat["user_id"],my_service)
+            st.caption(f'{chat["message_count"]} messages, last active {chat["last_activity"]:%Y-%m-%d %H:%M}')
+            # messages are only fetched once the user asks for them
+            if st.toggle("Show messages", key=f'show_{chat["session_id"]}'):
+                for message in my_service.get_session_messages(chat["session_id"], st.session_state['user_name']):
+                    st.write(message['content'])
+            if st.button("Delete Chat", key=f'delete_{chat["session_id"]}'):
+                delete_chat_history(chat["session_id"], st.session_state['user_name'], my_service)
                 st.rerun()
+    newer, older = st.sidebar.columns(2)
+    if len(st.session_state["sessions_cursors"]) > 1 and newer.button("Newer chats"):
+        st.session_state["sessions_cursors"].pop()
+        st.rerun()
+    if page["next_cursor"] and older.button("Older chats"):
+        st.session_state["sessions_cursors"].append(page["next_cursor"])
+        st.rerun()
 
 def export_chat_history():
     chat_history = f'*{st.session_state["user_name"]}\'s chat history from {str(datetime.now().date())}*\n\n'
@@ -212,10 +205,18 @@ def format_docs(docs):
             return {
             'sources': [str(d.metadata.get('page', '')) + ' ' + str(d.metadata.get('source', '')) for d in docs]}
 
-def streamed_response(streamer):
-    "stream the LLM's response"
+def streamed_response(streamer, queue_placeholder):
+    "stream the LLM's response, the generation scheduler reports the queue position until it starts"
+    queued = False
     with st.spinner("Thinking..."):
         for token in streamer:
+            if 'queue_position' in token:
+                queued = True
+                queue_placeholder.markdown(f'You are place {token["queue_position"]} of {token["queue_length"]}')
+                continue
+            if queued:
+                queued = False
+                queue_placeholder.empty()
             if 'answer' in token:
                 yield token['answer']
                 st.session_state["finalresponse"] += token['answer']
@@ -246,54 +247,6 @@ def import_chat(my_service):
                 + [{"role": "user", "content": prompt + prompt_time}],
             )
 
-            # lock the model to perform requests sequentially
-            if "in_use" not in server_state:
-                update_server_state("in_use", False)
-            if "last_used" not in server_state:
-                update_server_state("last_used", datetime.now())
-
-            if "exec_queue" not in server_state:
-                update_server_state("exec_queue", [st.session_state["user_name"]])
-            if len(server_state["exec_queue"]) == 0:
-                update_server_state("exec_queue", [st.session_state["user_name"]])
-            else:
-                if st.session_state["user_name"] not in server_state["exec_queue"]:
-                    # add to the queue
-                    update_server_state(
-                        "exec_queue",
-                        server_state["exec_queue"] + [st.session_state["user_name"]],
-                    )
-
-            with st.spinner("Query queued..."):
-                t = st.empty()
-                while (
-                    server_state["in_use"]
-                    or server_state["exec_queue"][0] != st.session_state["user_name"]
-                ):
-                    # check if it hasn't been used in a while, potentially interrupted while executing
-                    if (
-                        datetime.now() - server_state["last_used"]
-                    ).total_seconds() > 60:
-                        if (
-                            server_state["exec_queue"][1]
-                            == st.session_state["user_name"]
-                        ):  # only perform if first in the queue
-                            update_server_state("in_use", False)
-                            update_server_state(
-                                "exec_queue", server_state["exec_queue"][1:]
-                            ) # take out of the queue
-                            update_server_state("last_used", datetime.now())
-
-                    t.markdown(
-                        f'You are place {server_state["exec_queue"].index(st.session_state["user_name"])} of {len(server_state["exec_queue"]) - 1}'
-                    )
-                    time.sleep(1)
-                t.empty()
-
-            # lock the model while generating
-            update_server_state("in_use", True)
-            update_server_state("last_used", datetime.now())
-
             # generate response
             try:
                 if f'{st.session_state["user_name"]}_session_id' not in server_state:
@@ -307,6 +260,7 @@ def import_chat(my_service):
                             )
                         )
                     ], server_state[f'{st.session_state["user_name"]}_session_id'], st.session_state["user_name"])
+                queue_placeholder = st.empty()
                 chat_placeholder = st.empty()
                 source_placeholder = st.empty()
                 source_placeholder.empty()
@@ -315,7 +269,7 @@ def import_chat(my_service):
                     "assistant", avatar=st.session_state["assistant_avatar"]
                 ):
                     with st.empty():
-                        st.write_stream(streamed_response(response.response))
+                        st.write_stream(streamed_response(response.response, queue_placeholder))
                 
                 with source_placeholder.chat_message(
                     "sources_avatar", avatar=st.session_state["sources_avatar"]
@@ -338,11 +292,6 @@ def import_chat(my_service):
                             )
                             del st.session_state[f'{st.session_state["user_name"]} retriever_output']                    
 
-                update_server_state("in_use", False)
-                update_server_state(
-                    "exec_queue", server_state["exec_queue"][1:]
-                ) 
-
                 update_server_state(
                     f'{st.session_state["user_name"]} messages',
                     server_state[f'{st.session_state["user_name"]} messages']
@@ -361,16 +310,15 @@ def import_chat(my_service):
                 st.session_state["finalresponse"] = "" 
             except Exception as e:
                 st.error(f"An error was encountered.: {e}")
-                update_server_state("in_use", False)
-                update_server_state(
-                    "exec_queue", server_state["exec_queue"][1:]
-                )
 
 
 
 def main():
     my_service = get_service()
     settings = my_service.getsettings()
+    if settings.server.warmup:
+        # warms the models and connections while the user logs in, no-op once done
+        global_injector.get(HealthService).start()
     setup_metadata(settings)
     determine_availability()
 
@@ -381,7 +329,8 @@ def main():
         page_icon="https://www.svgrepo.com/show/87025/female-assistant-of-a-call-center.svg",
     )
     ui_header(settings)
-    update_server_state(f'model_{st.session_state["per_user"]}', my_service._with_message_history())
+    if f'model_{st.session_state["per_user"]}' not in server_state:
+        update_server_state(f'model_{st.session_state["per_user"]}', my_service._with_message_history())
     import_styles()
     ui_display_chat_history(my_service)
     import_chat(my_service)
@@ -0,0 +1,81 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.components.embedding.engines import build_embeddings
+
+SAMPLE_QUERIES = [
+    "How do I reset my password?",
+    "What is the refund policy for cancelled orders?",
+    "Which documents are needed to open an account?",
+    "Summarize the safety instructions of chapter 3",
+]
+
+def sample_documents(pdf_folder_path, num_docs, chunksize):
+    """Chunks of the PDFs of the folder, or synthetic paragraphs without a folder"""
+    if pdf_folder_path:
+        from embeddocs import list_pdfs, load_pdf
+        docs = []
+        for file_name in list_pdfs(pdf_folder_path):
+            docs.extend(chunk.page_content for chunk in load_pdf(pdf_folder_path, file_name, chunksize, 0)[1])
+            if len(docs) >= num_docs:
+                break
+        return docs[:num_docs]
+    sentence = "The quick brown fox jumps over the lazy dog while the committee reviews the quarterly report. "
+    return [(sentence * (1 + i % 8))[:chunksize] for i in range(num_docs)]
+
+def benchmark(engine, model_name, docs, batch_size, num_threads, num_queries, onnx_cache_dir):
+    start = time.perf_counter()
+    embed_model = build_embeddings(
+        model_name, engine=engine, batch_size=batch_size, num_threads=num_threads, onnx_cache_dir=onnx_cache_dir
+    )
+    load_seconds = time.perf_counter() - start
+
+    embed_model.embed_documents(docs[:batch_size])  # warm-up
+    start = time.perf_counter()
+    embed_model.embed_documents(docs)
+    docs_per_second = len(docs) / (time.perf_counter() - start)
+
+    latencies = []
+    for i in range(num_queries):
+        start = time.perf_counter()
+        embed_model.embed_query(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "engine": engine,
+        "load_s": load_seconds,
+        "docs_per_s": docs_per_second,
+        "query_p50_ms": statistics.median(latencies),
+        "query_p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the embedding engines.")
+    parser.add_argument("--model_name", type=str, default='intfloat/e5-base-v2', help="Model name for embedding")
+    parser.add_argument("--engines", type=str, nargs="+", default=["sentence_transformers", "onnx", "onnx_int8"], help="Engines to compare")
+    parser.add_argument("--pdf_folder_path", type=str, default=None, help="Embed chunks of these PDFs instead of synthetic text")
+    parser.add_argument("--num_docs", type=int, default=512, help="Number of chunks embedded")
+    parser.add_argument("--chunksize", type=int, default=512, help="Chunk size in characters")
+    parser.add_argument("--num_queries", type=int, default=100, help="Number of single query embeddings timed")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of texts encoded per forward pass")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of the encoder")
+    parser.add_argument("--onnx_cache_dir", type=str, default="models/onnx", help="Directory of the ONNX exports of the model")
+
+    args = parser.parse_args()
+    docs = sample_documents(args.pdf_folder_path, args.num_docs, args.chunksize)
+    print(f"✨ Embedding {len(docs)} chunks and {args.num_queries} queries with {args.model_name}")
+    print(f"{'engine':<24}{'load s':>10}{'docs/s':>10}{'query p50 ms':>15}{'query p95 ms':>15}")
+    for engine in args.engines:
+        try:
+            result = benchmark(engine, args.model_name, docs, args.batch_size, args.threads, args.num_queries, args.onnx_cache_dir)
+        except ImportError as error:
+            print(f"❌ {engine}: {error}")
+            continue
+        print(f"{result['engine']:<24}{result['load_s']:>10.1f}{result['docs_per_s']:>10.1f}{result['query_p50_ms']:>15.1f}{result['query_p95_ms']:>15.1f}")
+
+
+# python3 benchmark_embeddings.py --model_name "intfloat/e5-base-v2" --engines sentence_transformers onnx onnx_int8 --threads 4
@@ -0,0 +1,98 @@
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string
+from api.components.mongochathistory.MongoDBChatMessageHistory import window_size
+from api.server.ragchat.ragchat_service import build_rag_prompt
+from api.settings.settings import unsafe_typed_settings
+
+SAMPLE_QUESTIONS = [
+    "What is the strangler fig pattern?",
+    "How do I split a monolith into services?",
+    "Which database should each service own?",
+    "How do the services communicate?",
+    "What about distributed transactions?",
+]
+SAMPLE_CONTEXT = "The monolith is decomposed incrementally, each new service owns its data and exposes an API. "
+SAMPLE_ANSWER = "Start from a bounded context, route its calls to the new service and retire the old code step by step. "
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def tokens(text):
+    """Word and punctuation pieces, a stand-in for the model tokenizer"""
+    return _TOKEN_PATTERN.findall(text)
+
+def common_prefix(a, b):
+    size = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        size += 1
+    return size
+
+def render(system_prompt, context_prompt, layout, history, turn, context_chunks):
+    """Prompt text of a turn, the messages flattened one per line"""
+    # every turn retrieves other chunks
+    context = "\n".join(f"[{turn}.{chunk}] {SAMPLE_CONTEXT}" for chunk in range(context_chunks))
+    system_prompt = system_prompt if layout == "stable_prefix" or "{context}" in system_prompt else system_prompt + "\nContext: {context}"
+    prompt = build_rag_prompt(system_prompt, context_prompt, layout)
+    question = SAMPLE_QUESTIONS[turn % len(SAMPLE_QUESTIONS)]
+    return get_buffer_string(prompt.format_messages(chat_history=history, context=context, question=question)) + "\nAI: ", question
+
+def simulate(system_prompt, context_prompt, layout, turns, max_messages, step, context_chunks, server=None):
+    """Prompt tokens and tokens evaluated again per turn, counted locally or reported by the server"""
+    messages = []
+    cached = []
+    total = evaluated = 0
+    for turn in range(turns):
+        history = messages[len(messages) - window_size(len(messages), max_messages, step):]
+        text, question = render(system_prompt, context_prompt, layout, history, turn, context_chunks)
+        prompt_tokens = tokens(text)
+        total += len(prompt_tokens)
+        if server is None:
+            evaluated += len(prompt_tokens) - common_prefix(prompt_tokens, cached)
+        else:
+            evaluated += server(text)
+        # the cache holds the prompt followed by the generated answer
+        cached = prompt_tokens + tokens(SAMPLE_ANSWER)
+        messages += [HumanMessage(content=question), AIMessage(content=SAMPLE_ANSWER)]
+    return total, evaluated
+
+def llama_server(server_url, slot):
+    """Send the prompt to a llama.cpp server and return the prompt tokens it evaluated"""
+    import httpx
+
+    client = httpx.Client(base_url=server_url.rstrip("/"), timeout=300)
+
+    def evaluate(text):
+        body = {"prompt": text, "n_predict": len(tokens(SAMPLE_ANSWER)), "cache_prompt": True, "id_slot": slot}
+        response = client.post("/completion", json=body)
+        response.raise_for_status()
+        return response.json()["timings"]["prompt_n"]
+
+    return evaluate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the prompt tokens the inference server evaluates again at each turn, per prompt layout.")
+    parser.add_argument("--turns", type=int, default=20, help="Number of turns of the simulated conversation")
+    parser.add_argument("--max_messages", type=int, default=unsafe_typed_settings.rag.history_max_messages, help="History window size")
+    parser.add_argument("--window_step", type=int, default=unsafe_typed_settings.rag.history_window_step or 4, help="Step of the stepped history window")
+    parser.add_argument("--context_chunks", type=int, default=8, help="Size of the retrieved context, in sample sentences")
+    parser.add_argument("--server_url", type=str, default=None, help="llama.cpp server (e.g. http://localhost:8009) measuring the evaluated tokens instead of counting them")
+    parser.add_argument("--slot", type=int, default=0, help="Slot of the llama.cpp server the prompts are sent to")
+
+    args = parser.parse_args()
+    system_prompt = unsafe_typed_settings.ui.rag_system_prompt.replace("{context}", "")
+    context_prompt = unsafe_typed_settings.ui.rag_context_prompt
+    server = llama_server(args.server_url, args.slot) if args.server_url else None
+    print(f"✨ {args.turns} turns, history window of {args.max_messages} messages, {'measured by ' + args.server_url if server else 'counted locally'}")
+    print(f"{'layout':<20}{'window step':>12}{'prompt tokens':>15}{'evaluated':>12}{'reused %':>10}")
+    for layout, step in [("context_in_system", None), ("stable_prefix", None), ("stable_prefix", args.window_step)]:
+        total, evaluated = simulate(system_prompt, context_prompt, layout, args.turns, args.max_messages, step, args.context_chunks, server)
+        print(f"{layout:<20}{step or 1:>12}{total:>15}{evaluated:>12}{100 * (1 - evaluated / total):>10.1f}")
+
+
+# python3 benchmark_prompt_cache.py --turns 20 --max_messages 10 --window_step 4
+# python3 benchmark_prompt_cache.py --turns 20 --server_url http://localhost:8009
@@ -1,26 +1,134 @@
 import argparse
+import hashlib
+import json
+import logging
 import os
-from langchain_community.vectorstores import Qdrant
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import CharacterTextSplitter
 import re
+import uuid
+import numpy as np
 from tqdm import tqdm
 from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.components.embedding.engines import build_embeddings
+from api.components.qdrant.collection import bump_revision, create_collection, update_collection
+from api.components.qdrant.sparse import BM25SparseEncoder
+logging.getLogger().setLevel(logging.INFO)
 
 def clear_database(url="http://localhost:6333",collection_name="ARH_Tool",api_key=None):
     client = QdrantClient(url,api_key=api_key)
     client.delete_collection(collection_name)
 
-def extract_text_from_pdf(pdf_folder_path):
-    documents = []
-    loaders = [PyPDFLoader(os.path.join(pdf_folder_path, fn)) for fn in os.listdir(pdf_folder_path)]
-    for loader in tqdm(loaders):
-        try:
-            documents.extend(loader.load())
-        except:
-            pass
-    return documents
+# namespace of the deterministic point ids derived from the chunk hashes
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1f4bde-7c55-4b52-a3a5-3c1a0b0e5a9d")
+
+def list_pdfs(pdf_folder_path):
+    return sorted(fn for fn in os.listdir(pdf_folder_path) if fn.lower().endswith(".pdf"))
+
+def load_pdf(pdf_folder_path, file_name, chunksize=512, chunkoverlap=100):
+    """Parse, split and clean one PDF, runs in the worker processes.
+
+    Returns the file name, its chunks and the error message if it failed.
+    """
+    try:
+        pages = PyPDFLoader(os.path.join(pdf_folder_path, file_name)).load()
+        for page in pages:
+            page.metadata["source_file"] = file_name
+        chunks = split_text(pages, chunksize, chunkoverlap)
+        for chunk in chunks:
+            chunk.page_content = remove_emojis(chunk.page_content)
+        return file_name, chunks, None
+    except Exception as error:
+        return file_name, [], f"{type(error).__name__}: {error}"
+
+def iter_pdf_chunks(pdf_folder_path, file_names, chunksize=512, chunkoverlap=100, workers=None, queue_size=None):
+    """Yield (file_name, chunks, error) per file as the worker processes finish them.
+
+    At most queue_size files are parsed or waiting to be consumed at once,
+    so the memory stays flat whatever the size of the corpus.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for file_name in file_names:
+            yield load_pdf(pdf_folder_path, file_name, chunksize, chunkoverlap)
+        return
+    queue_size = max(queue_size or 2 * workers, workers)
+    pending_files = iter(file_names)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        while True:
+            for file_name in pending_files:
+                in_flight.add(executor.submit(load_pdf, pdf_folder_path, file_name, chunksize, chunkoverlap))
+                if len(in_flight) >= queue_size:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_chunk(doc):
+    key = json.dumps([doc.metadata.get("source_file"), doc.metadata.get("page"), doc.page_content])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def chunk_point_id(chunk_hash):
+    """Deterministic point id, re-upserting the same chunk overwrites its point"""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, chunk_hash))
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def manifest_from_collection(client, collection_name):
+    """Rebuild the file manifest from the file_hash/chunk_hash payloads of the collection"""
+    manifest = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name,
+            limit=1024,
+            offset=offset,
+            with_payload=["source_file", "file_hash", "chunk_hash"],
+            with_vectors=False,
+        )
+        for point in points:
+            payload = point.payload or {}
+            if "source_file" not in payload:
+                continue
+            entry = manifest.setdefault(payload["source_file"], {"hash": payload.get("file_hash"), "chunks": []})
+            entry["chunks"].append(payload.get("chunk_hash"))
+        if offset is None:
+            return manifest
+
+def delete_files(client, collection_name, manifest, file_names):
+    """Delete the points of the given files, by id when the manifest knows them"""
+    for file_name in file_names:
+        chunks = [chunk for chunk in manifest.get(file_name, {}).get("chunks", []) if chunk]
+        if chunks:
+            selector = models.PointIdsList(points=[chunk_point_id(chunk) for chunk in chunks])
+        else:
+            selector = models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="source_file", match=models.MatchValue(value=file_name))
+            ]))
+        client.delete(collection_name, points_selector=selector)
 
 def remove_emojis(string):
     emoji_pattern = re.compile(
@@ -36,8 +144,12 @@ def remove_emojis(string):
     )
     return emoji_pattern.sub(r'', string)
 
-def setup_embeddings(embedding_model_id):
-    embed_model = HuggingFaceEmbeddings(model_name=embedding_model_id)
+def setup_embeddings(embedding_model_id, engine="sentence_transformers", batch_size=64, num_threads=None, onnx_cache_dir="models/onnx",
+                     inference_server_url=None, embeddings_api_key=None):
+    embed_model = build_embeddings(
+        embedding_model_id, engine=engine, batch_size=batch_size, num_threads=num_threads, onnx_cache_dir=onnx_cache_dir,
+        inference_server_url=inference_server_url, api_key=embeddings_api_key,
+    )
     return embed_model
 
 def split_text(docs,chunksize=512,chunkoverlap=100):
@@ -46,41 +158,178 @@ def split_text(docs,chunksize=512,chunkoverlap=100):
         chunk_size=chunksize,
         chunk_overlap=chunkoverlap,
         length_function=len,
+        # lets the API merge the overlapping chunks of a page
+        add_start_index=True,
     )
     documents = text_splitter.split_documents(docs)
     return documents
 
-def embed_documents(documents, embed_model, url, api_key, collection_name):
-    Qdrant.from_documents(documents, embed_model, url=url, api_key=api_key, prefer_grpc=True, collection_name=collection_name)
-
-def main(url, pdf_folder_path , model_name, collection_name,chunksize,chunkoverlap,api_key = None):
-    docs = extract_text_from_pdf(pdf_folder_path)
-    docs_processed = split_text(docs,chunksize,chunkoverlap)
-    for doc in docs_processed:
-        doc.page_content = remove_emojis(doc.page_content)
-        # docslist = [doc.page_content]
-    embed_model = setup_embeddings(model_name)
-    # loop to check for each vector if similar vector present in the database or not, skip if document is similar, insert if not
-    client = QdrantClient(url,api_key=api_key)
-    qdrant = Qdrant(client=client, collection_name=collection_name, embeddings=embed_model)
-    vectors_config = {
-        "size": 768,
-        "distance": "Cosine" 
-    }
-    #check if collection does not exist creeate collection
-    if client.collection_exists(collection_name) == False:
-        embed_documents(docs_processed, embed_model, url, api_key, collection_name)
+def batched(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def embed_chunks(docs, embed_model, batch_size=64):
+    """Embed the chunk texts once, batch_size texts per encoder call"""
+    vectors = []
+    for batch in batched([doc.page_content for doc in docs], batch_size):
+        vectors.extend(embed_model.embed_documents(batch))
+    return vectors
+
+def ensure_collection(client, collection_name, vector_size, sparse_vector_name=None, index_settings=None):
+    """Create the collection if needed, returns True if it already existed.
+
+    index_settings holds the m, ef_construct, on_disk and quantization
+    arguments of the collection helpers, applied to an existing collection too.
+    """
+    index_settings = index_settings or {}
+    sparse_config = {sparse_vector_name: models.SparseVectorParams()} if sparse_vector_name else None
+    if client.collection_exists(collection_name):
+        if sparse_config and sparse_vector_name not in (client.get_collection(collection_name).config.params.sparse_vectors or {}):
+            # only the chunks upserted from now on get a sparse vector, re-ingest with --reset to cover all of them
+            client.update_collection(collection_name, sparse_vectors_config=sparse_config)
+        update_collection(client, collection_name, **index_settings)
+        return True
+    create_collection(client, collection_name, vector_size, sparse_vectors_config=sparse_config, **index_settings)
+    # incremental re-indexing deletes the points of a changed file by this field
+    client.create_payload_index(collection_name, "source_file", field_schema=models.PayloadSchemaType.KEYWORD)
+    return False
+
+def find_duplicates(client, collection_name, vectors, threshold=0.9, batch_size=256):
+    """Flag the vectors having a neighbour above threshold in the collection or earlier in vectors.
+
+    The collection is searched with one search_batch call per batch. The
+    vectors are not upserted yet, so they are also compared with the kept
+    ones before them by cosine similarity, as inserting them one by one would.
+    """
+    duplicates = []
+    for batch in batched(vectors, batch_size):
+        results = client.search_batch(
+            collection_name,
+            [models.SearchRequest(vector=vector, limit=1, score_threshold=threshold, with_payload=False) for vector in batch],
+        )
+        duplicates.extend(bool(result) for result in results)
+    if not vectors:
+        return duplicates
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    similarities = matrix @ matrix.T
+    kept = []
+    for index, duplicate in enumerate(duplicates):
+        if not duplicate and kept and similarities[index, kept].max() >= threshold:
+            duplicates[index] = True
+        elif not duplicate:
+            kept.append(index)
+    return duplicates
+
+def upsert_chunks(client, collection_name, docs, vectors, batch_size=256, file_hashes=None, sparse_vector_name=None):
+    """Bulk upsert the chunks with the payload layout of the langchain Qdrant vectorstore.
+
+    The point ids derive from the chunk hashes, so upserts are idempotent.
+    With sparse_vector_name, the BM25 sparse vector of the hybrid search is
+    stored next to the dense one.
+    """
+    file_hashes = file_hashes or {}
+    encoder = BM25SparseEncoder() if sparse_vector_name else None
+    for batch in batched(list(zip(docs, vectors)), batch_size):
+        points = []
+        for doc, vector in batch:
+            chunk_hash = hash_chunk(doc)
+            if encoder is not None:
+                vector = {"": vector, sparse_vector_name: encoder.encode_document(doc.page_content)}
+            points.append(models.PointStruct(
+                id=chunk_point_id(chunk_hash),
+                vector=vector,
+                payload={
+                    "page_content": doc.page_content,
+                    "metadata": doc.metadata,
+                    "source_file": doc.metadata.get("source_file"),
+                    "file_hash": file_hashes.get(doc.metadata.get("source_file")),
+                    "chunk_hash": chunk_hash,
+                },
+            ))
+        client.upsert(collection_name, points=points)
+
+def plan_incremental(client, collection_name, file_hashes, manifest_path=None):
+    """Compare the file hashes with the manifest, returns the files to ingest and the manifest"""
+    if manifest_path:
+        manifest = load_manifest(manifest_path)
+    elif client.collection_exists(collection_name):
+        manifest = manifest_from_collection(client, collection_name)
     else:
-        print("Collection already exists")
-        for doc in docs_processed:
-            document, score = qdrant.similarity_search_with_score(doc.page_content,k=1,score_threshold=0.9)[0]
-            if score > 0.9:
-                print("Document already present in the database")
-                continue
-            else:
-                print("Document not present in the database")
-                embed_documents([doc], embed_model, url, api_key, collection_name)
-                print("Document embedded in the database")
+        manifest = {}
+    changed = [fn for fn, file_hash in file_hashes.items() if manifest.get(fn, {}).get("hash") != file_hash]
+    removed = [fn for fn in manifest if fn not in file_hashes]
+    stale = [fn for fn in changed if fn in manifest] + removed
+    if stale and client.collection_exists(collection_name):
+        delete_files(client, collection_name, manifest, stale)
+        bump_revision(client, collection_name)
+    for fn in stale:
+        manifest.pop(fn, None)
+    print(f"✨ {len(file_hashes) - len(changed)} files unchanged, {len(changed)} new or changed, {len(removed)} removed")
+    return changed, manifest
+
+def main(url, pdf_folder_path , model_name, collection_name,chunksize,chunkoverlap,api_key = None,
+         embed_batch_size=64, upsert_batch_size=256, duplicate_threshold=0.9,
+         incremental=False, manifest_path=None, workers=None, queue_size=None,
+         engine="sentence_transformers", num_threads=None, onnx_cache_dir="models/onnx",
+         inference_server_url=None, embeddings_api_key=None, sparse_vector_name=None, index_settings=None):
+    client = QdrantClient(url,api_key=api_key,prefer_grpc=True)
+    file_names = list_pdfs(pdf_folder_path)
+    file_hashes = {fn: hash_file(os.path.join(pdf_folder_path, fn)) for fn in file_names}
+    manifest = {}
+    if incremental:
+        file_names, manifest = plan_incremental(client, collection_name, file_hashes, manifest_path)
+    embed_model = None
+    inserted = skipped = 0
+    collection_existed = None
+    failures = []
+    pending = []
+
+    def flush(batch):
+        nonlocal embed_model, collection_existed, inserted, skipped
+        if embed_model is None:
+            embed_model = setup_embeddings(model_name, engine, embed_batch_size, num_threads, onnx_cache_dir,
+                                           inference_server_url, embeddings_api_key)
+        vectors = embed_chunks(batch, embed_model, embed_batch_size)
+        if collection_existed is None:
+            collection_existed = ensure_collection(client, collection_name, len(vectors[0]), sparse_vector_name, index_settings)
+            if collection_existed:
+                print("Collection already exists, skipping chunks already present in the database")
+        if collection_existed:
+            duplicates = find_duplicates(client, collection_name, vectors, duplicate_threshold, upsert_batch_size)
+            batch = [doc for doc, duplicate in zip(batch, duplicates) if not duplicate]
+            vectors = [vector for vector, duplicate in zip(vectors, duplicates) if not duplicate]
+            skipped += len(duplicates) - len(batch)
+        upsert_chunks(client, collection_name, batch, vectors, upsert_batch_size, file_hashes, sparse_vector_name)
+        inserted += len(batch)
+        for doc in batch:
+            manifest.setdefault(doc.metadata["source_file"], {"hash": file_hashes[doc.metadata["source_file"]], "chunks": []})["chunks"].append(hash_chunk(doc))
+
+    # files are parsed and split in the worker processes while the chunks
+    # are embedded, deduplicated and upserted here batch by batch
+    chunks = iter_pdf_chunks(pdf_folder_path, file_names, chunksize, chunkoverlap, workers, queue_size)
+    for file_name, file_chunks, error in tqdm(chunks, total=len(file_names)):
+        if error is not None:
+            failures.append((file_name, error))
+            continue
+        pending.extend(file_chunks)
+        while len(pending) >= upsert_batch_size:
+            flush(pending[:upsert_batch_size])
+            pending = pending[upsert_batch_size:]
+    if pending:
+        flush(pending)
+
+    if inserted:
+        # tells the answer cache of the API that the chunks changed
+        bump_revision(client, collection_name)
+    if inserted or skipped:
+        print(f"✨ {inserted} chunks embedded in the database, {skipped} already present")
+    else:
+        print("✨ Nothing to embed.")
+    for file_name, error in failures:
+        print(f"❌ Failed to load {file_name}: {error}")
+    if incremental and manifest_path:
+        save_manifest(manifest_path, manifest)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Embed PDF documents.")
@@ -92,6 +341,24 @@ if __name__ == "__main__":
     parser.add_argument("--chunksize", type=int, default=512, help="Chunk size for splitting text")
     parser.add_argument("--chunkoverlap", type=int, default=100, help="Chunk overlap for splitting text")
     parser.add_argument("--api_key", type=str, help="API key for authentication of vectordatabase (optional)", default=None)
+    parser.add_argument("--engine", type=str, default="sentence_transformers", choices=["sentence_transformers", "onnx", "onnx_int8", "remote"], help="Embedding engine")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of the encoder")
+    parser.add_argument("--onnx_cache_dir", type=str, default="models/onnx", help="Directory of the ONNX exports of the model")
+    parser.add_argument("--inference_server_url", type=str, default=None, help="URL of the OpenAI-compatible embeddings server of the remote engine")
+    parser.add_argument("--embeddings_api_key", type=str, default=None, help="API key of the embeddings server (optional)")
+    parser.add_argument("--sparse", action="store_true", help="Also store the BM25 sparse vectors used by the hybrid search")
+    parser.add_argument("--sparse_vector_name", type=str, default="bm25", help="Name of the sparse vector, qdrant.sparse_vector_name in settings.yaml")
+    parser.add_argument("--hnsw_m", type=int, default=None, help="HNSW graph degree of the collection")
+    parser.add_argument("--hnsw_ef_construct", type=int, default=None, help="HNSW build-time candidate list size of the collection")
+    parser.add_argument("--on_disk", action="store_true", default=None, help="Keep the original vectors on disk instead of RAM")
+    parser.add_argument("--quantization", type=str, default=None, choices=["none", "int8"], help="Scalar quantization of the collection vectors")
+    parser.add_argument("--embed_batch_size", type=int, default=64, help="Number of chunks embedded per encoder call")
+    parser.add_argument("--upsert_batch_size", type=int, default=256, help="Number of chunks searched and upserted per Qdrant request")
+    parser.add_argument("--duplicate_threshold", type=float, default=0.9, help="Similarity above which a chunk is considered already present")
+    parser.add_argument("--incremental", action="store_true", help="Only embed new or changed files and delete the points of removed or changed ones")
+    parser.add_argument("--manifest_path", type=str, default=None, help="Local JSON manifest of file and chunk hashes, read from the collection payloads when omitted")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes parsing the PDFs, defaults to the number of CPUs")
+    parser.add_argument("--queue_size", type=int, default=None, help="Maximum number of PDFs parsed or waiting to be embedded at once, defaults to twice the workers")
 
     args = parser.parse_args()
     if args.reset:
@@ -109,7 +376,11 @@ if __name__ == "__main__":
     if not os.listdir(args.pdf_folder_path):
         print("❌ No PDFs found in the folder.")
         exit(1)
-    main(args.url,args.pdf_folder_path,args.model_name,args.collection_name,args.chunksize,args.chunkoverlap,args.api_key)
+    main(args.url,args.pdf_folder_path,args.model_name,args.collection_name,args.chunksize,args.chunkoverlap,args.api_key,
+         args.embed_batch_size,args.upsert_batch_size,args.duplicate_threshold,args.incremental,args.manifest_path,
+         args.workers,args.queue_size,args.engine,args.threads,args.onnx_cache_dir,
+         args.inference_server_url,args.embeddings_api_key,args.sparse_vector_name if args.sparse else None,
+         dict(m=args.hnsw_m, ef_construct=args.hnsw_ef_construct, on_disk=args.on_disk, quantization=args.quantization))
 
 
 # python3 embeddocs.py "http://localhost:6333/" --collection_name "ARH_Tool" --chunksize 512 --chunkoverlap 100 --pdf_folder_path "/yourpath/to/folder"
\ No newline at end of file
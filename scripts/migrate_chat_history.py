@@ -0,0 +1,152 @@
+import argparse
+import json
+from datetime import datetime
+from pymongo import MongoClient, ReplaceOne
+
+TITLE_LENGTH = 80
+
+def summarized_count(keys, summarized_until):
+    """Number of the (timestamp, _id) sorted messages covered by a summary marker of the per-message schema"""
+    if isinstance(summarized_until, datetime):
+        # marker of a summary stored before the _id was part of it
+        return sum(1 for timestamp, _ in keys if timestamp <= summarized_until)
+    marker = (summarized_until["timestamp"], summarized_until["_id"])
+    return sum(1 for key in keys if key <= marker)
+
+def session_documents(source, summaries=None):
+    """Group the per-message documents of the source collection into session documents.
+
+    The rolling summary of a session in ``summaries`` moves into its session
+    document, with the number of messages it covers.
+    """
+    pipeline = [
+        {"$sort": {"SessionId": 1, "UserId": 1, "timestamp": 1, "_id": 1}},
+        {
+            "$group": {
+                "_id": {"SessionId": "$SessionId", "UserId": "$UserId"},
+                "History": {"$push": "$History"},
+                "keys": {"$push": {"timestamp": "$timestamp", "_id": "$_id"}},
+                "created": {"$first": "$timestamp"},
+                "timestamp": {"$last": "$timestamp"},
+            }
+        },
+    ]
+    for group in source.aggregate(pipeline, allowDiskUse=True):
+        messages = [json.loads(history) for history in group["History"]]
+        session = {
+            "SessionId": group["_id"]["SessionId"],
+            "UserId": group["_id"]["UserId"],
+            "messages": messages,
+            "message_count": len(messages),
+            "created": group["created"],
+            "timestamp": group["timestamp"],
+        }
+        summary = summaries.find_one(group["_id"]) if summaries is not None else None
+        if summary and summary.get("summary"):
+            session["summary"] = summary["summary"]
+            session["summarized_count"] = 0
+            if summary.get("summarized_until"):
+                keys = [(key["timestamp"], key["_id"]) for key in group["keys"]]
+                session["summarized_count"] = summarized_count(keys, summary["summarized_until"])
+        yield session
+
+def listing_documents(source):
+    """Listing document of every session of the per-message source collection"""
+    pipeline = [
+        {"$sort": {"SessionId": 1, "UserId": 1, "timestamp": 1, "_id": 1}},
+        {
+            "$group": {
+                "_id": {"SessionId": "$SessionId", "UserId": "$UserId"},
+                "first_message": {"$first": "$History"},
+                "message_count": {"$sum": 1},
+                "created": {"$first": "$timestamp"},
+                "timestamp": {"$last": "$timestamp"},
+            }
+        },
+    ]
+    for group in source.aggregate(pipeline, allowDiskUse=True):
+        yield {
+            "SessionId": group["_id"]["SessionId"],
+            "UserId": group["_id"]["UserId"],
+            "title": json.loads(group["first_message"]).get("data", {}).get("content", "")[:TITLE_LENGTH],
+            "message_count": group["message_count"],
+            "created": group["created"],
+            "timestamp": group["timestamp"],
+        }
+
+def build_listing(url, db_name, source_collection, listing_collection, batch_size=500):
+    client = MongoClient(url)
+    db = client[db_name]
+    target = db[listing_collection]
+    target.create_index([("SessionId", 1), ("UserId", 1)], unique=True)
+    target.create_index([("UserId", 1), ("timestamp", -1), ("SessionId", -1)])
+
+    batch = []
+    sessions = 0
+    for listing in listing_documents(db[source_collection]):
+        batch.append(ReplaceOne({"SessionId": listing["SessionId"], "UserId": listing["UserId"]}, listing, upsert=True))
+        sessions += 1
+        if len(batch) >= batch_size:
+            target.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        target.bulk_write(batch, ordered=False)
+    print(f"✨ Listed {sessions} sessions in {listing_collection}")
+    client.close()
+
+def migrate(url, db_name, source_collection, target_collection, batch_size=500, drop_source=False, summary_collection=None, client=None):
+    owns_client = client is None
+    if owns_client:
+        client = MongoClient(url)
+    db = client[db_name]
+    source = db[source_collection]
+    target = db[target_collection]
+    summaries = db[summary_collection] if summary_collection else None
+    target.create_index([("SessionId", 1), ("UserId", 1)], unique=True)
+    target.create_index([("UserId", 1), ("timestamp", -1)])
+
+    batch = []
+    sessions = 0
+    messages = 0
+    for session in session_documents(source, summaries):
+        batch.append(ReplaceOne({"SessionId": session["SessionId"], "UserId": session["UserId"]}, session, upsert=True))
+        sessions += 1
+        messages += session["message_count"]
+        if len(batch) >= batch_size:
+            target.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        target.bulk_write(batch, ordered=False)
+    print(f"✨ Migrated {messages} messages into {sessions} sessions")
+
+    if drop_source:
+        source.drop()
+        print(f"✨ Dropped {source_collection}")
+        if summaries is not None:
+            summaries.drop()
+            print(f"✨ Dropped {summary_collection}")
+    if owns_client:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-message chat history into one document per session, "
+                                     "or backfill the session listing of the per-message history with --listing_only.")
+    parser.add_argument("url", help="URL of the MongoDB server")
+    parser.add_argument("--db_name", type=str, default="ARH_chatbot", help="MongoDB database name")
+    parser.add_argument("--source_collection", type=str, default="chat_history", help="Collection with one document per message")
+    parser.add_argument("--target_collection", type=str, default="chat_sessions", help="Collection receiving one document per session")
+    parser.add_argument("--batch_size", type=int, default=500, help="Number of sessions written per bulk write")
+    parser.add_argument("--summary_collection", type=str, default="chat_history_summary", help="Collection with the rolling summaries of the per-message schema, moved into the session documents")
+    parser.add_argument("--drop_source", action="store_true", help="Drop the source and summary collections after the migration")
+    parser.add_argument("--listing_only", action="store_true", help="Keep the per-message schema and only (re)build its session listing")
+    parser.add_argument("--listing_collection", type=str, default="chat_history_sessions", help="Collection receiving the session listing with --listing_only")
+
+    args = parser.parse_args()
+    if args.listing_only:
+        build_listing(args.url, args.db_name, args.source_collection, args.listing_collection, args.batch_size)
+    else:
+        migrate(args.url, args.db_name, args.source_collection, args.target_collection, args.batch_size, args.drop_source, args.summary_collection)
+
+
+# python3 migrate_chat_history.py "mongodb://localhost:27017" --db_name "ARH_chatbot" --source_collection "chat_history" --target_collection "chat_sessions"
+# python3 migrate_chat_history.py "mongodb://localhost:27017" --db_name "ARH_chatbot" --source_collection "chat_history" --listing_only --listing_collection "chat_history_sessions"
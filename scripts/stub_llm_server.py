@@ -0,0 +1,129 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def completion_chunk(model, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+def embedding(text, size):
+    """Unit vector derived from the text, the same text always gets the same vector"""
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    vector = [rng.gauss(0, 1) for _ in range(size)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+def make_handler(args, stats):
+    class StubHandler(BaseHTTPRequestHandler):
+        """OpenAI-compatible /v1/chat/completions, /v1/embeddings and /v1/models answering a fixed text"""
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *log_args):
+            pass
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        def do_GET(self):
+            if self.path.rstrip("/") in ("/v1/models", "/health"):
+                self._json(200, {"object": "list", "data": [{"id": args.model, "object": "model"}]})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with stats["lock"]:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                if body.get("id_slot") is not None:
+                    stats["slots"][body["id_slot"]] = stats["slots"].get(body["id_slot"], 0) + 1
+            try:
+                time.sleep(args.latency_ms / 1000)
+                if random.random() < args.fail_rate:
+                    self._json(500, {"error": {"message": "stub failure"}})
+                    return
+                if self.path.rstrip("/").endswith("/embeddings"):
+                    texts = body.get("input", [])
+                    texts = [texts] if isinstance(texts, str) else texts
+                    with stats["lock"]:
+                        stats["embedded"] += len(texts)
+                    self._json(200, {
+                        "object": "list", "model": args.model,
+                        "data": [{"object": "embedding", "index": index, "embedding": embedding(text, args.embedding_size)} for index, text in enumerate(texts)],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                    })
+                    return
+                words = args.answer.split(" ")
+                if not body.get("stream"):
+                    message = {"role": "assistant", "content": args.answer}
+                    self._json(200, {
+                        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": args.model,
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for index, word in enumerate(words):
+                    content = word if index == 0 else " " + word
+                    self._chunk(f"data: {json.dumps(completion_chunk(args.model, {'content': content}))}\n\n".encode())
+                    time.sleep(args.token_latency_ms / 1000)
+                self._chunk(f"data: {json.dumps(completion_chunk(args.model, {}, 'stop'))}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+            finally:
+                with stats["lock"]:
+                    stats["in_flight"] -= 1
+
+    return StubHandler
+
+def report(stats, interval):
+    while True:
+        time.sleep(interval)
+        with stats["lock"]:
+            print(f"📊 requests={stats['requests']} in_flight={stats['in_flight']} max_in_flight={stats['max_in_flight']} slots={stats['slots']} embedded={stats['embedded']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible inference server, to try the LLM routing and the remote embeddings without models.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+    parser.add_argument("--port", type=int, default=8009, help="Port to bind")
+    parser.add_argument("--model", type=str, default="stub", help="Model name reported by the server")
+    parser.add_argument("--answer", type=str, default="This is a stub answer.", help="Text of every completion")
+    parser.add_argument("--latency_ms", type=float, default=100, help="Delay before the first token")
+    parser.add_argument("--token_latency_ms", type=float, default=10, help="Delay between two streamed tokens")
+    parser.add_argument("--embedding_size", type=int, default=384, help="Size of the embedding vectors")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="Share of the requests answered with a 500")
+    parser.add_argument("--report_interval", type=float, default=10, help="Seconds between two request reports")
+
+    args = parser.parse_args()
+    stats = {"lock": threading.Lock(), "requests": 0, "in_flight": 0, "max_in_flight": 0, "slots": {}, "embedded": 0}
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, stats))
+    threading.Thread(target=report, args=(stats, args.report_interval), daemon=True).start()
+    print(f"✨ Stub inference server '{args.model}' on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+# python3 stub_llm_server.py --port 8010 --model mistral-7b --latency_ms 50
+# python3 stub_llm_server.py --port 8011 --model llama-3-8b --latency_ms 200 --fail_rate 0.1
+# python3 stub_llm_server.py --port 8012 --model all-MiniLM-L6-v2 --latency_ms 20 --embedding_size 384
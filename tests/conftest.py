@@ -0,0 +1,21 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from api.components.metrics.metrics_component import MetricsComponent
+from api.settings.settings import unsafe_typed_settings
+
+
+@pytest.fixture
+def settings():
+    """Settings of settings.yaml, each test changes its own copy"""
+    return unsafe_typed_settings.model_copy(deep=True)
+
+
+@pytest.fixture
+def metrics():
+    return MetricsComponent()
+
+
+@pytest.fixture
+def embeddings():
+    return DeterministicFakeEmbedding(size=16)
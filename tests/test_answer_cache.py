@@ -0,0 +1,86 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.documents import Document
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from api.components.answercache.answercache_component import AnswerCacheComponent
+from api.components.qdrant.collection import bump_revision, create_collection
+
+CONTEXT = [Document(page_content="sagas", metadata={"page": 3})]
+
+
+@pytest.fixture
+def client(settings):
+    client = QdrantClient(location=":memory:")
+    create_collection(client, settings.qdrant.vector_collectionname, 16)
+    return client
+
+
+@pytest.fixture
+def cache(settings, metrics, embeddings, client):
+    settings.rag.answer_cache.enabled = True
+    settings.rag.answer_cache.max_size = 2
+    settings.rag.answer_cache.collection_check_interval_seconds = 0
+    cache = AnswerCacheComponent(settings, SimpleNamespace(client=client), SimpleNamespace(embed_model=embeddings), metrics)
+    # the chain looks up before it stores, the first lookup reads the collection fingerprint
+    assert cache.lookup("warm up") is None
+    return cache
+
+
+def test_answers_the_same_question(cache):
+    cache.store("What is a saga?", "A sequence of local transactions.", CONTEXT)
+
+    assert cache.lookup("What is a saga?") == {"answer": "A sequence of local transactions.", "context": CONTEXT}
+    assert cache.lookup("What is CQRS?") is None
+
+
+def test_evicts_the_least_recently_used(cache):
+    for question in ["first", "second"]:
+        cache.store(question, f"{question} answer", CONTEXT)
+    cache.lookup("first")
+    cache.store("third", "third answer", CONTEXT)
+
+    assert cache.lookup("second") is None
+    assert cache.lookup("first")["answer"] == "first answer"
+
+
+def test_collection_change_invalidates(cache, client, settings):
+    cache.store("What is a saga?", "A sequence of local transactions.", CONTEXT)
+    assert cache.lookup("What is a saga?") is not None
+
+    client.upsert(settings.qdrant.vector_collectionname, points=[models.PointStruct(id=1, vector=[1.0] * 16)])
+
+    assert cache.lookup("What is a saga?") is None
+
+
+def test_new_revision_invalidates(cache, client, settings):
+    cache.store("What is a saga?", "A sequence of local transactions.", CONTEXT)
+
+    # an ingestion replacing chunks without changing their number
+    bump_revision(client, settings.qdrant.vector_collectionname)
+
+    assert cache.lookup("What is a saga?") is None
+
+
+def test_single_request_checks_the_collection(cache, monkeypatch):
+    checking, release = threading.Event(), threading.Event()
+    checks = []
+
+    def fingerprint(collection_name):
+        checks.append(collection_name)
+        checking.set()
+        release.wait(timeout=5)
+        return None
+
+    monkeypatch.setattr(cache, "_collection_fingerprint", fingerprint)
+    first = threading.Thread(target=cache.lookup, args=("first",))
+    first.start()
+    checking.wait()
+
+    assert cache.lookup("second") is None
+    release.set()
+    first.join()
+    assert len(checks) == 1
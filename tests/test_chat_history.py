@@ -0,0 +1,308 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from api.components.mongochathistory import MongoDBChatMessageHistory as history_module
+from api.components.mongochathistory import MongoDBSessionChatMessageHistory as session_module
+from api.components.mongochathistory import mongochathistory
+from api.components.mongochathistory.MongoDBChatMessageHistory import MongoDBChatMessageHistory, SUMMARY_PREFIX, window_size
+from api.components.mongochathistory.MongoDBSessionChatMessageHistory import MongoDBSessionChatMessageHistory
+from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
+from api.server.ragchat.ragchat_service import RagChatService
+from scripts.migrate_chat_history import migrate
+
+
+class Clock:
+    """Stands in for datetime in the history modules, every message of a turn shares one timestamp"""
+
+    now = datetime(2024, 1, 1)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(history_module, "datetime", Clock)
+    monkeypatch.setattr(session_module, "datetime", Clock)
+    return Clock
+
+
+@pytest.fixture(params=["message", "session"])
+def component(request, settings, monkeypatch):
+    """History component of each storage schema on a mongomock server, writing in the foreground"""
+    monkeypatch.setattr(mongochathistory, "MongoClient", mongomock.MongoClient)
+    settings.mongodb.history_storage = request.param
+    settings.mongodb.background_writes = False
+    component = MongoChatHistoryComponent(settings)
+    yield component
+    component.close()
+
+
+def history(client, **kwargs):
+    return MongoDBChatMessageHistory("mongodb://unused", "s", "u", client=client, **kwargs)
+
+
+def session_history(client, **kwargs):
+    return MongoDBSessionChatMessageHistory("mongodb://unused", "s", "u", client=client, collection_name="sessions", **kwargs)
+
+
+def add_turns(history, first, last, clock=None):
+    for turn in range(first, last + 1):
+        if clock is not None:
+            clock.now = datetime(2024, 1, 1, 0, 0, turn)
+        history.add_messages([HumanMessage(content=f"h{turn}"), AIMessage(content=f"a{turn}")])
+
+
+def contents(messages):
+    return [message.content for message in messages]
+
+
+@pytest.mark.parametrize("total, max_messages, step, expected", [
+    (5, None, None, 5),
+    (5, 10, None, 5),
+    (12, 10, None, 10),
+    (10, 10, 4, 10),
+    (11, 10, 4, 7),
+    (14, 10, 4, 10),
+    (15, 10, 4, 7),
+])
+def test_window_size(total, max_messages, step, expected):
+    assert window_size(total, max_messages, step) == expected
+
+
+def test_messages_are_the_newest_window(client):
+    session = history(client, max_messages=3)
+    add_turns(session, 1, 3)
+
+    assert contents(session.messages) == ["a2", "h3", "a3"]
+    assert contents(session.all_messages()) == ["h1", "a1", "h2", "a2", "h3", "a3"]
+
+
+def test_stepped_window_keeps_its_oldest_message(client):
+    session = history(client, max_messages=4, window_step=2)
+    add_turns(session, 1, 2)
+    assert contents(session.messages) == ["h1", "a1", "h2", "a2"]
+
+    session.add_messages([HumanMessage(content="h3")])
+    assert contents(session.messages) == ["h2", "a2", "h3"]
+    session.add_messages([AIMessage(content="a3")])
+    assert contents(session.messages) == ["h2", "a2", "h3", "a3"]
+
+
+def test_summary_is_prepended_to_the_window(client):
+    session = history(client, max_messages=2, summary_collection_name="summaries")
+    add_turns(session, 1, 2)
+    session.update_summary("they said hello", None)
+
+    messages = session.messages
+    assert messages[0] == SystemMessage(content=SUMMARY_PREFIX + "they said hello")
+    assert contents(messages[1:]) == ["h2", "a2"]
+
+
+def test_clear_drops_the_summary(client):
+    session = history(client, max_messages=2, summary_collection_name="summaries")
+    add_turns(session, 1, 2)
+    session.update_summary("they said hello", None)
+
+    session.clear()
+
+    assert session.messages == []
+    assert session.get_summary() is None
+
+
+def test_messages_to_summarize_are_outside_the_window(client, clock):
+    session = history(client, max_messages=2, summary_collection_name="summaries")
+    add_turns(session, 1, 1, clock)
+    assert session.messages_to_summarize() == ([], None)
+
+    add_turns(session, 2, 3, clock)
+    pending, marker = session.messages_to_summarize()
+    assert contents(pending) == ["h1", "a1", "h2", "a2"]
+
+    session.update_summary("summary", marker)
+    assert session.messages_to_summarize() == ([], None)
+
+
+def test_messages_sharing_a_timestamp_are_summarized_once(client, clock):
+    session = history(client, max_messages=3, summary_collection_name="summaries")
+    add_turns(session, 1, 3, clock)
+    pending, marker = session.messages_to_summarize()
+    assert contents(pending) == ["h1", "a1", "h2"]
+    session.update_summary("summary", marker)
+
+    add_turns(session, 4, 4, clock)
+    pending, marker = session.messages_to_summarize()
+
+    # a2 is stored in the same second as the already summarized h2
+    assert contents(pending) == ["a2", "h3"]
+
+
+def test_session_document_caps_the_stored_messages(client):
+    session = session_history(client, max_stored_messages=3)
+    add_turns(session, 1, 2)
+
+    document = client["chat_history"]["sessions"].find_one()
+    assert document["message_count"] == 4
+    assert [message["data"]["content"] for message in document["messages"]] == ["a1", "h2", "a2"]
+    assert contents(session.all_messages()) == ["a1", "h2", "a2"]
+
+
+def test_session_document_windows_the_messages(client):
+    session = session_history(client, max_messages=4, window_step=2)
+    add_turns(session, 1, 2)
+    session.add_messages([HumanMessage(content="h3")])
+
+    assert contents(session.messages) == ["h2", "a2", "h3"]
+
+
+def test_session_summary_counts_the_summarized_messages(client):
+    session = session_history(client, max_messages=2, summary_collection_name="unused")
+    add_turns(session, 1, 3)
+
+    pending, marker = session.messages_to_summarize()
+    assert (contents(pending), marker) == (["h1", "a1", "h2", "a2"], 4)
+    session.update_summary("summary", marker)
+
+    assert client["chat_history"]["sessions"].find_one()["summarized_count"] == 4
+    assert session.messages_to_summarize() == ([], None)
+    assert contents(session.messages) == [SUMMARY_PREFIX + "summary", "h3", "a3"]
+
+    add_turns(session, 4, 4)
+    assert session.messages_to_summarize() == (session.all_messages()[4:6], 6)
+
+
+def test_session_summary_skips_the_dropped_messages(client):
+    session = session_history(client, max_messages=2, max_stored_messages=4, summary_collection_name="unused")
+    add_turns(session, 1, 3)
+
+    pending, marker = session.messages_to_summarize()
+
+    # h1 and a1 were dropped from the array before they were summarized
+    assert (contents(pending), marker) == (["h2", "a2"], 4)
+
+
+def test_migration_moves_the_messages_and_the_summary(client, clock):
+    source = history(client, max_messages=3, summary_collection_name="summaries")
+    add_turns(source, 1, 3, clock)
+    source.update_summary("summary", source.messages_to_summarize()[1])
+    add_turns(MongoDBChatMessageHistory("mongodb://unused", "other", "u", client=client), 1, 1, clock)
+
+    migrate("mongodb://unused", "chat_history", "message_store", "sessions", summary_collection="summaries", client=client)
+
+    target = session_history(client, max_messages=3, summary_collection_name="unused")
+    assert client["chat_history"]["sessions"].count_documents({}) == 2
+    assert contents(target.all_messages()) == contents(source.all_messages())
+    assert contents(target.messages) == contents(source.messages)
+    # h2 and a2 share the timestamp of the marker, only h2 is summarized
+    assert client["chat_history"]["sessions"].find_one({"SessionId": "s"})["summarized_count"] == 3
+    add_turns(target, 4, 4)
+    assert contents(target.messages_to_summarize()[0]) == ["a2", "h3"]
+
+
+def test_sessions_are_listed_page_by_page(component, clock):
+    for number in range(5):
+        add_turns(component.get_session_history(f"s{number}", "u"), number + 1, number + 1, clock)
+    add_turns(component.get_session_history("other", "v"), 9, 9, clock)
+    # s1 is the most recent session once it gets another turn
+    add_turns(component.get_session_history("s1", "u"), 10, 10, clock)
+
+    pages = [component.list_sessions("u", 2)]
+    while pages[-1]["next_cursor"]:
+        pages.append(component.list_sessions("u", 2, pages[-1]["next_cursor"]))
+
+    assert [[session["session_id"] for session in page["sessions"]] for page in pages] == [["s1", "s4"], ["s3", "s2"], ["s0"]]
+    assert pages[0]["sessions"][0] == {"session_id": "s1", "title": "h2", "message_count": 4, "last_activity": datetime(2024, 1, 1, 0, 0, 10)}
+
+
+def test_sessions_sharing_a_last_activity_are_not_skipped(component, clock):
+    for number in range(3):
+        add_turns(component.get_session_history(f"s{number}", "u"), 1, 1, clock)
+
+    first = component.list_sessions("u", 2)
+    second = component.list_sessions("u", 2, first["next_cursor"])
+
+    assert [session["session_id"] for session in first["sessions"] + second["sessions"]] == ["s2", "s1", "s0"]
+    assert second["next_cursor"] is None
+
+
+def test_cleared_session_leaves_the_listing(component):
+    session = component.get_session_history("s", "u")
+    add_turns(session, 1, 1)
+
+    session.clear()
+
+    assert component.list_sessions("u", 10)["sessions"] == []
+
+
+def test_aggregated_history_has_the_same_shape_for_both_schemas(component, settings):
+    add_turns(component.get_session_history("s", "u"), 1, 2)
+
+    history = RagChatService.get_aggregated_history_per_user(SimpleNamespace(settings=settings, mongodb=component), "u")
+
+    assert [(item["_id"], item["user_id"]) for item in history] == [("s", "u")]
+    assert [json.loads(message)["data"]["content"] for message in history[0]["History"]] == ["h1", "a1", "h2", "a2"]
+
+
+@pytest.fixture
+def background(settings, monkeypatch):
+    """History component of the message schema on a mongomock server, writing on its writer thread"""
+    monkeypatch.setattr(mongochathistory, "MongoClient", mongomock.MongoClient)
+    settings.mongodb.background_writes = True
+    component = MongoChatHistoryComponent(settings)
+    yield component
+    component.close()
+
+
+def blocked_writer(component):
+    """Hold the writer thread until the returned event is set"""
+    release = threading.Event()
+    component.write(("blocker", "u"), release.wait)
+    return release
+
+
+def test_reads_wait_for_the_pending_write(background):
+    session = background.get_session_history("s", "u")
+    release = blocked_writer(background)
+    add_turns(session, 1, 1)
+
+    assert session.history.messages == []
+    threading.Timer(0.05, release.set).start()
+    assert contents(session.messages) == ["h1", "a1"]
+
+
+def test_async_reads_wait_for_the_pending_write(background):
+    session = background.get_session_history("s", "u")
+    # no Motor server here, the async read runs the sync one in an executor
+    session.history.async_collection = None
+    release = blocked_writer(background)
+
+    async def run():
+        await session.aadd_messages([HumanMessage(content="h1")])
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        return await session.aget_messages()
+
+    assert contents(asyncio.run(run())) == ["h1"]
+
+
+def test_close_writes_the_pending_turns(background, settings):
+    session = background.get_session_history("s", "u")
+    release = blocked_writer(background)
+    add_turns(session, 1, 1)
+    threading.Timer(0.05, release.set).start()
+
+    background.close()
+
+    assert background.client[settings.mongodb.db_name][settings.mongodb.history_collectionname].count_documents({"SessionId": "s"}) == 2
@@ -0,0 +1,66 @@
+import pytest
+from langchain_core.documents import Document
+
+from api.components.contextpacking.contextpacking_component import ContextPackingComponent, text_overlap
+
+PAGE = ("The strangler fig pattern migrates a monolith incrementally. New features go to new services, "
+        "a facade routes the calls, and the old code is retired once nothing calls it anymore.")
+
+
+@pytest.fixture
+def packer(settings, metrics):
+    settings.rag.context_packing.enabled = True
+    settings.rag.context_packing.tokenizer = None
+    settings.rag.context_packing.token_budget = 1000
+    return ContextPackingComponent(settings, metrics)
+
+
+def chunk(start, end, page=1, start_index=True, source="/docs/patterns.pdf"):
+    metadata = {"source": source, "page": page}
+    if start_index:
+        metadata["start_index"] = start
+    return Document(page_content=PAGE[start:end], metadata=metadata)
+
+
+def test_text_overlap():
+    assert text_overlap(PAGE[:80], PAGE[50:]) == 30
+    assert text_overlap(PAGE[:80], PAGE[70:]) == 0
+
+
+@pytest.mark.parametrize("start_index", [True, False])
+def test_overlapping_chunks_of_a_page_are_merged(packer, start_index):
+    packed = packer.pack([chunk(60, len(PAGE), start_index=start_index), chunk(0, 90, start_index=start_index)])
+
+    assert [doc.page_content for doc in packed] == [PAGE]
+    assert packed[0].metadata["merged_chunks"] == 2
+
+
+def test_chunks_of_other_pages_are_kept_apart(packer):
+    packed = packer.pack([chunk(0, 90, page=1), chunk(60, len(PAGE), page=2)])
+
+    assert [doc.metadata["page"] for doc in packed] == [1, 2]
+    assert [doc.metadata["citation"] for doc in packed] == [1, 2]
+
+
+def test_near_duplicates_are_dropped(packer):
+    packed = packer.pack([chunk(0, len(PAGE), page=1), chunk(0, len(PAGE), page=7, source="/docs/copy.pdf")])
+
+    assert [doc.metadata["source"] for doc in packed] == ["/docs/patterns.pdf"]
+
+
+def test_passages_over_the_budget_are_left_out(packer, settings):
+    settings.rag.context_packing.token_budget = 60
+    packed = packer.pack([chunk(0, len(PAGE), page=1), Document(page_content="Sagas coordinate local transactions. " * 5, metadata={"page": 2})])
+
+    assert [doc.metadata["page"] for doc in packed] == [1]
+
+    settings.rag.context_packing.token_budget = 20
+    packed = packer.pack([chunk(0, len(PAGE), page=1)])
+    assert PAGE.startswith(packed[0].page_content)
+    assert packer.count_tokens(packer.format(packed)) <= 20
+
+
+def test_format_cites_the_passages(packer):
+    packed = packer.pack([chunk(0, 90, page=4)])
+
+    assert packer.format(packed) == "[1] patterns.pdf p.4\n" + PAGE[:90]
@@ -0,0 +1,82 @@
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from api.components.embedding import embedmodel_component, engines
+from api.components.embedding.embedmodel_component import EmbedModelComponent
+from api.components.embedding.engines import OnnxEmbeddings, build_embeddings
+from api.components.embedding.query_cache import CachedQueryEmbeddings
+from api.components.embedding.remote import RemoteEmbeddings
+
+
+class Recorder:
+    """Stands in for an embedding model class, keeps its arguments"""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def models(monkeypatch):
+    monkeypatch.setattr(engines, "OnnxEmbeddings", Recorder)
+    monkeypatch.setitem(sys.modules, "langchain.embeddings.huggingface", SimpleNamespace(HuggingFaceEmbeddings=Recorder))
+
+
+@pytest.mark.parametrize("engine, quantize", [("onnx", False), ("onnx_int8", True)])
+def test_onnx_engines(models, engine, quantize):
+    model = build_embeddings("e5", engine=engine, batch_size=8, num_threads=2, onnx_cache_dir="cache")
+
+    assert model.args == ("e5", "cache")
+    assert model.kwargs == {"batch_size": 8, "num_threads": 2, "quantize": quantize}
+
+
+def test_sentence_transformers_engine(models):
+    model = build_embeddings("e5", engine="sentence_transformers", batch_size=8, device="cpu")
+
+    assert model.kwargs == {"model_name": "e5", "model_kwargs": {"device": "cpu"}, "encode_kwargs": {"batch_size": 8}}
+
+
+def test_remote_engine_loads_no_model(models):
+    model = build_embeddings("e5", engine="remote", inference_server_url="http://embeddings/v1", coalesce_window_ms=1)
+
+    assert isinstance(model, RemoteEmbeddings)
+    assert model.model_name == "e5"
+    model.close()
+
+
+@pytest.mark.parametrize("engine", ["remote", "tensorflow"])
+def test_invalid_engine_settings(models, engine):
+    with pytest.raises(ValueError):
+        build_embeddings("e5", engine=engine)
+
+
+def test_onnx_batches_by_length_and_keeps_the_order():
+    model = OnnxEmbeddings.__new__(OnnxEmbeddings)
+    model.batch_size = 2
+    batches = []
+
+    def encode(texts):
+        batches.append(texts)
+        return np.array([[len(text), 1.0] for text in texts])
+
+    model._encode = encode
+
+    vectors = model.embed_documents(["medium", "a", "the longest", "ab"])
+
+    assert batches == [["a", "ab"], ["medium", "the longest"]]
+    assert [vector[0] for vector in vectors] == [6, 1, 11, 2]
+
+
+@pytest.mark.parametrize("cache_size, cached", [(0, False), (16, True)])
+def test_component_wraps_the_model_in_the_query_cache(settings, metrics, monkeypatch, cache_size, cached):
+    monkeypatch.setattr(embedmodel_component, "build_embeddings", Recorder)
+    settings.embeddings.query_cache_size = cache_size
+    settings.embeddings.query_cache_path = None
+
+    model = EmbedModelComponent(settings, metrics).embed_model
+
+    assert isinstance(model, CachedQueryEmbeddings) is cached
+    assert (model.embeddings if cached else model).kwargs["engine"] == settings.embeddings.engine
@@ -0,0 +1,180 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.documents import Document
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from api.components.qdrant.collection import create_collection, read_revision
+from scripts import embeddocs
+from scripts.embeddocs import delete_files, find_duplicates, hash_chunk, iter_pdf_chunks, manifest_from_collection, plan_incremental, upsert_chunks
+
+FILE_HASHES = {"a.pdf": "hash-a", "b.pdf": "hash-b"}
+
+
+@pytest.fixture
+def ingested():
+    """Collection holding two chunks of a.pdf and one of b.pdf"""
+    client = QdrantClient(location=":memory:")
+    create_collection(client, "chunks", 3)
+    docs = [
+        Document(page_content="first", metadata={"source_file": "a.pdf", "page": 0}),
+        Document(page_content="second", metadata={"source_file": "a.pdf", "page": 1}),
+        Document(page_content="third", metadata={"source_file": "b.pdf", "page": 0}),
+    ]
+    upsert_chunks(client, "chunks", docs, [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]], file_hashes=FILE_HASHES)
+    return client, docs
+
+
+def sources(client):
+    points, _ = client.scroll("chunks", limit=100, with_payload=["source_file"])
+    return sorted(point.payload["source_file"] for point in points)
+
+
+def test_find_duplicates_in_the_collection_and_the_batch():
+    client = QdrantClient(location=":memory:")
+    create_collection(client, "chunks", 3)
+    client.upsert("chunks", points=[models.PointStruct(id=1, vector=[1.0, 0.0, 0.0])])
+    vectors = [
+        [0.99, 0.05, 0.0],  # already in the collection
+        [0.0, 1.0, 0.0],
+        [0.0, 0.98, 0.1],  # same as the previous one
+        [0.0, 0.0, 1.0],
+    ]
+
+    assert find_duplicates(client, "chunks", vectors, threshold=0.9, batch_size=2) == [True, False, True, False]
+    assert find_duplicates(client, "chunks", [], threshold=0.9) == []
+
+
+def test_manifest_is_rebuilt_from_the_payloads(ingested):
+    client, docs = ingested
+
+    manifest = manifest_from_collection(client, "chunks")
+
+    assert {name: entry["hash"] for name, entry in manifest.items()} == FILE_HASHES
+    assert sorted(manifest["a.pdf"]["chunks"]) == sorted(hash_chunk(doc) for doc in docs[:2])
+
+
+def test_upserting_the_same_chunks_again_is_idempotent(ingested):
+    client, docs = ingested
+
+    upsert_chunks(client, "chunks", docs, [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]], file_hashes=FILE_HASHES)
+
+    assert sources(client) == ["a.pdf", "a.pdf", "b.pdf"]
+
+
+@pytest.mark.parametrize("manifest", [
+    lambda docs: {"a.pdf": {"hash": "hash-a", "chunks": [hash_chunk(doc) for doc in docs[:2]]}},
+    lambda docs: {},  # unknown to the manifest, deleted by its source_file payload
+])
+def test_delete_files(ingested, manifest):
+    client, docs = ingested
+
+    delete_files(client, "chunks", manifest(docs), ["a.pdf"])
+
+    assert sources(client) == ["b.pdf"]
+
+
+def test_plan_incremental_skips_the_unchanged_files(ingested):
+    client, _ = ingested
+
+    changed, manifest = plan_incremental(client, "chunks", {"a.pdf": "hash-a", "b.pdf": "hash-b2", "c.pdf": "hash-c"})
+
+    assert changed == ["b.pdf", "c.pdf"]
+    # the chunks of the changed file are gone before it is ingested again
+    assert sources(client) == ["a.pdf", "a.pdf"]
+    assert list(manifest) == ["a.pdf"]
+    assert read_revision(client, "chunks") is not None
+
+
+def test_plan_incremental_deletes_the_removed_files(ingested):
+    client, _ = ingested
+
+    changed, manifest = plan_incremental(client, "chunks", {"b.pdf": "hash-b"})
+
+    assert changed == []
+    assert sources(client) == ["b.pdf"]
+    assert list(manifest) == ["b.pdf"]
+
+
+def test_plan_incremental_reads_a_local_manifest(ingested, tmp_path):
+    client, docs = ingested
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps({"a.pdf": {"hash": "hash-a", "chunks": [hash_chunk(doc) for doc in docs[:2]]}}))
+
+    changed, _ = plan_incremental(client, "chunks", FILE_HASHES, str(manifest_path))
+
+    assert changed == ["b.pdf"]
+    assert read_revision(client, "chunks") is None
+
+
+def test_plan_incremental_without_a_collection():
+    client = QdrantClient(location=":memory:")
+
+    changed, manifest = plan_incremental(client, "chunks", FILE_HASHES)
+
+    assert (changed, manifest) == (["a.pdf", "b.pdf"], {})
+
+
+def pdf_bytes(text):
+    """Smallest PDF with one page showing the text"""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+@pytest.fixture
+def pdf_folder(tmp_path):
+    for name in ["a", "b", "c"]:
+        (tmp_path / f"{name}.pdf").write_bytes(pdf_bytes(f"Chunk of {name}"))
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_iter_pdf_chunks_yields_every_file(pdf_folder, workers):
+    results = {file_name: (chunks, error) for file_name, chunks, error in
+               iter_pdf_chunks(str(pdf_folder), ["a.pdf", "b.pdf", "broken.pdf", "c.pdf"], workers=workers)}
+
+    assert sorted(results) == ["a.pdf", "b.pdf", "broken.pdf", "c.pdf"]
+    for name in ["a", "b", "c"]:
+        chunks, error = results[f"{name}.pdf"]
+        assert error is None
+        assert [(chunk.page_content, chunk.metadata["source_file"]) for chunk in chunks] == [(f"Chunk of {name}", f"{name}.pdf")]
+    assert results["broken.pdf"][0] == []
+    assert results["broken.pdf"][1] is not None
+
+
+def test_iter_pdf_chunks_bounds_the_files_in_flight(pdf_folder, monkeypatch):
+    submitted = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(args[1])
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(embeddocs, "ProcessPoolExecutor", RecordingExecutor)
+    file_names = [f"{name}.pdf" for name in "abc"] * 4
+    consumed = 0
+    for _ in iter_pdf_chunks(str(pdf_folder), file_names, workers=2, queue_size=3):
+        consumed += 1
+        # files parsed or waiting to be consumed, counting the one just yielded
+        assert len(submitted) - consumed < 3
+
+    assert consumed == len(submitted) == len(file_names)
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from api.settings.settings import ARAHLLMBackendSettings
+from api.server.ragchat.generation_scheduler import GenerationScheduler, SchedulerFullError, SchedulerTimeoutError
+
+
+@pytest.fixture
+def scheduler(settings, metrics):
+    settings.rag.scheduler.enabled = True
+    settings.rag.scheduler.max_concurrent = 1
+    return GenerationScheduler(settings, metrics)
+
+
+def llm(responses=("the answer",)):
+    return FakeListChatModel(responses=list(responses))
+
+
+def request_config(request, user_id="u"):
+    return {"configurable": {"user_id": user_id, "generation_request": request}}
+
+
+def test_max_concurrent_defaults_to_the_parallel_slots(settings, metrics):
+    settings.rag.scheduler.max_concurrent = None
+    settings.llm.parallel_slots = 3
+    assert GenerationScheduler(settings, metrics).max_concurrent == 3
+
+    settings.llm.backends = [ARAHLLMBackendSettings(name=f"gpu{slots}", inference_server_url=f"http://gpu{slots}/v1", parallel_slots=slots)
+                             for slots in (2, 4)]
+    assert GenerationScheduler(settings, metrics).max_concurrent == 6
+
+
+def test_fair_ordering_round_robins_the_users(scheduler):
+    positions = {}
+    scheduler.submit("a")
+    for name, user_id in [("a2", "a"), ("a3", "a"), ("b1", "b")]:
+        scheduler.submit(user_id, lambda position, waiting, name=name: positions.__setitem__(name, position))
+
+    assert positions == {"a2": 1, "b1": 2, "a3": 3}
+
+
+def test_full_queue_rejects(scheduler, settings):
+    settings.rag.scheduler.max_queue_size = 2
+    for _ in range(3):
+        scheduler.submit("u")
+
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit("u")
+    with pytest.raises(SchedulerFullError):
+        scheduler.check_capacity()
+
+
+def test_gate_holds_a_slot_only_while_the_llm_runs(scheduler):
+    running = []
+    gated = scheduler.gate(RunnableLambda(lambda x: running.append(scheduler.running) or x) | llm())
+    chain = RunnableLambda(lambda x: running.append(scheduler.running) or x) | gated
+
+    assert chain.invoke("question").content == "the answer"
+    assert running == [0, 1]
+    assert scheduler.running == 0
+
+
+def test_gate_times_out_in_the_queue(scheduler, settings):
+    settings.rag.scheduler.queue_timeout_seconds = 0.05
+    scheduler.submit("other")
+
+    with pytest.raises(SchedulerTimeoutError):
+        scheduler.gate(llm()).invoke("question")
+    assert scheduler.waiting == 0
+
+
+def test_stream_reports_the_queue_position(scheduler):
+    gated = scheduler.gate(llm())
+    holder = scheduler.submit("other")
+    chunks = scheduler.stream(lambda request: gated.stream("question", request_config(request)))
+
+    assert next(chunks) == {"queue_position": 1, "queue_length": 1}
+    scheduler.release(holder)
+    assert "".join(chunk.content for chunk in chunks) == "the answer"
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+def test_closed_stream_leaves_the_queue(scheduler):
+    gated = scheduler.gate(llm())
+    scheduler.submit("other")
+    chunks = scheduler.stream(lambda request: gated.stream("question", request_config(request)))
+
+    next(chunks)
+    chunks.close()
+
+    assert scheduler.waiting == 0
+
+
+def test_astream_reports_the_queue_position(scheduler):
+    gated = scheduler.gate(llm())
+
+    async def run():
+        holder = scheduler.submit("other")
+        chunks = scheduler.astream(lambda request: gated.astream("question", request_config(request)))
+        first = await chunks.__anext__()
+        scheduler.release(holder)
+        return first, "".join([chunk.content async for chunk in chunks])
+
+    assert asyncio.run(run()) == ({"queue_position": 1, "queue_length": 1}, "the answer")
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+def test_stream_raises_the_error_of_start(scheduler):
+    def start(request):
+        raise RuntimeError("chain not built")
+
+    with pytest.raises(RuntimeError, match="chain not built"):
+        list(scheduler.stream(start))
+
+    async def run():
+        return [chunk async for chunk in scheduler.astream(start)]
+
+    with pytest.raises(RuntimeError, match="chain not built"):
+        asyncio.run(run())
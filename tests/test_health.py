@@ -0,0 +1,115 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from injector import Injector
+
+from api.arahlauncher import create_app
+from api.components.embedding.embedmodel_component import EmbedModelComponent
+from api.components.llm.llmodel_component import LLModelComponent
+from api.components.metrics.metrics_component import MetricsComponent
+from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
+from api.components.qdrant.qdrant_component import QdrantComponent
+from api.components.rerank.rerank_component import RerankComponent
+from api.server.health.health_service import HealthService
+from api.server.ragchat.ragchat_service import RagChatService
+from api.settings.settings import Settings
+
+
+class Mongo:
+    """MongoDB client answering the ping once ``up``"""
+
+    def __init__(self, up=True):
+        self.up = up
+        self.admin = self
+
+    def command(self, name):
+        if not self.up:
+            raise ConnectionError("mongodb is down")
+        return {"ok": 1}
+
+
+@pytest.fixture
+def components():
+    """State of the stubbed components, the LLM warm-up waits for ``llm_gate``"""
+    llm_gate = threading.Event()
+    llm_gate.set()
+    return SimpleNamespace(mongo=Mongo(), llm_gate=llm_gate, warmed=[])
+
+
+@pytest.fixture
+def injector(settings, metrics, components):
+    injector = Injector()
+    injector.binder.bind(Settings, to=settings)
+    injector.binder.bind(MetricsComponent, to=metrics)
+    injector.binder.bind(RagChatService, to=SimpleNamespace(_with_message_history=lambda: components.warmed.append("chain")))
+    injector.binder.bind(EmbedModelComponent, to=SimpleNamespace(embed_model=SimpleNamespace(embed_documents=lambda texts: [[1.0]])))
+    injector.binder.bind(QdrantComponent, to=SimpleNamespace(client=SimpleNamespace(get_collection=lambda name: components.warmed.append("qdrant"))))
+    injector.binder.bind(MongoChatHistoryComponent, to=SimpleNamespace(client=components.mongo))
+    injector.binder.bind(RerankComponent, to=SimpleNamespace(enabled=True, score=lambda query, docs: components.warmed.append("rerank")))
+    injector.binder.bind(LLModelComponent, to=SimpleNamespace(
+        warm_up=lambda: components.llm_gate.wait(5),
+        router=SimpleNamespace(state=lambda: [{"name": "default", "circuit": "closed"}]),
+    ))
+    return injector
+
+
+def test_warm_up_runs_every_step(injector, components, metrics):
+    health = injector.get(HealthService)
+
+    assert health.warm_up() is True
+
+    assert health.ready
+    assert list(health.checks) == ["components", "embedding", "qdrant", "mongodb", "rerank", "llm", "chain"]
+    assert all(check["ok"] for check in health.checks.values())
+    assert components.warmed == ["qdrant", "rerank", "chain"]
+    assert "startup.warmup.embedding" in metrics.snapshot()["timings"]
+
+
+def test_failed_step_leaves_the_api_not_ready(injector, components):
+    components.mongo.up = False
+    health = injector.get(HealthService)
+
+    assert health.warm_up() is False
+
+    assert health.checks["mongodb"] == {"ok": False, "error": "ConnectionError: mongodb is down"}
+    # the steps after the failed one still ran
+    assert health.checks["chain"]["ok"]
+
+
+def test_ready_turns_200_once_warmed_up(injector, components):
+    components.llm_gate.clear()
+    client = TestClient(create_app(injector))
+    health = injector.get(HealthService)
+
+    warming = client.get("/health/ready")
+    assert warming.status_code == 503
+    assert (warming.json()["ready"], warming.json()["warming"]) == (False, True)
+
+    components.llm_gate.set()
+    health._thread.join(5)
+
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["llm_backends"] == [{"name": "default", "circuit": "closed"}]
+
+
+def test_ready_retries_the_failed_steps(injector, components):
+    components.mongo.up = False
+    client = TestClient(create_app(injector))
+    health = injector.get(HealthService)
+
+    client.get("/health/ready")
+    health._thread.join(5)
+    failed = client.get("/health/ready")
+    assert failed.status_code == 503
+    assert failed.json()["checks"]["mongodb"]["ok"] is False
+
+    health._thread.join(5)
+    components.mongo.up = True
+    # the next probe starts the warm-up again
+    assert client.get("/health/ready").status_code == 503
+    health._thread.join(5)
+
+    assert client.get("/health/ready").status_code == 200
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from injector import Injector
+
+from api.arahlauncher import create_app
+from api.components.llm.llmodel_component import LLModelComponent
+from api.components.mongochathistory.mongochathistory import MongoChatHistoryComponent
+from api.settings.settings import Settings
+
+
+def test_shutdown_drains_the_history_writes(settings):
+    settings.server.warmup = False
+    closed = []
+
+    async def aclose():
+        closed.append("llm")
+
+    injector = Injector()
+    injector.binder.bind(Settings, to=settings)
+    injector.binder.bind(MongoChatHistoryComponent, to=SimpleNamespace(close=lambda: closed.append("history")))
+    injector.binder.bind(LLModelComponent, to=SimpleNamespace(aclose=aclose))
+
+    with TestClient(create_app(injector)):
+        assert closed == []
+
+    assert closed == ["history", "llm"]
+
+
+def test_shutdown_leaves_the_unused_components_alone(settings, monkeypatch):
+    def build(*args, **kwargs):
+        raise AssertionError("built at shutdown")
+
+    settings.server.warmup = False
+    monkeypatch.setattr(MongoChatHistoryComponent, "__init__", build)
+    monkeypatch.setattr(LLModelComponent, "__init__", build)
+    injector = Injector()
+    injector.binder.bind(Settings, to=settings)
+
+    with TestClient(create_app(injector)):
+        pass
+
+
+def test_llm_close_closes_the_connection_pools(settings, metrics):
+    settings.llm.health_check_interval_seconds = None
+    llm = LLModelComponent(settings, metrics)
+    backend = llm.router.backends[0].llm
+
+    asyncio.run(llm.aclose())
+
+    assert backend.http_client.is_closed
+    assert backend.http_async_client.is_closed
@@ -0,0 +1,97 @@
+import httpx
+import openai
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableLambda
+
+from api.components.llm.router import LLMBackend, LLMRouter
+
+
+def backend(name, responses=("answer",), **kwargs):
+    return LLMBackend(name, FakeListChatModel(responses=list(responses)), f"http://{name}/v1", **kwargs)
+
+
+def test_sessions_stick_to_a_backend_per_role(metrics):
+    router = LLMRouter([backend("a"), backend("b")], metrics)
+    answer = router.pick("answer", "s1")
+    rephrase = router.pick("rephrase", "s1")
+    assert (answer.name, rephrase.name) == ("a", "b")
+    router._done(answer, 0.1, failed=False)
+    router._done(rephrase, 0.1, failed=False)
+
+    assert router.pick("answer", "s1").name == "a"
+    assert router.pick("rephrase", "s1").name == "b"
+
+
+def failing_backend(name, **kwargs):
+    def fail(input):
+        raise ConnectionError(f"{name} is down")
+    return LLMBackend(name, RunnableLambda(fail), f"http://{name}/v1", **kwargs)
+
+
+def test_request_fails_over_before_its_first_chunk(metrics):
+    router = LLMRouter([failing_backend("a"), backend("b")], metrics)
+
+    chunks = list(router.stream("answer", "question", {}))
+
+    assert "".join(chunk.content for chunk in chunks) == "answer"
+    assert [(b.name, b.failures, b.outstanding) for b in router.backends] == [("a", 1, 0), ("b", 0, 0)]
+    assert metrics.snapshot()["counters"]["llm.failovers"] == 1
+
+
+def test_no_failover_after_the_first_chunk(metrics):
+    def break_off(input):
+        yield AIMessageChunk(content="half an ")
+        raise ConnectionError("connection reset")
+
+    router = LLMRouter([LLMBackend("a", RunnableLambda(break_off), "http://a/v1"), backend("b")], metrics)
+
+    with pytest.raises(ConnectionError):
+        list(router.stream("answer", "question", {}))
+    assert router.backends[1].outstanding == 0
+
+
+def test_circuit_opens_after_consecutive_failures(metrics):
+    router = LLMRouter([backend("a"), backend("b")], metrics, failure_threshold=2, reset_seconds=60)
+    a, b = router.backends
+    for _ in range(2):
+        router._done(router.pick("answer"), None, failed=True)
+
+    assert a.opened_at is not None
+    assert {router.pick("answer").name for _ in range(3)} == {"b"}
+
+    router.reset_seconds = 0
+    trial = router.pick("answer", exclude=frozenset({"b"}))
+    router._done(trial, 0.1, failed=False)
+    assert (a.failures, a.opened_at) == (0, None)
+
+
+def test_client_errors_do_not_fail_over(metrics):
+    def reject(input):
+        request = httpx.Request("POST", "http://a/v1/chat/completions")
+        raise openai.BadRequestError("context length exceeded", response=httpx.Response(400, request=request), body=None)
+
+    router = LLMRouter([LLMBackend("a", RunnableLambda(reject), "http://a/v1"), backend("b")], metrics, failure_threshold=1)
+
+    with pytest.raises(openai.BadRequestError):
+        list(router.stream("answer", "question", {}))
+    a, b = router.backends
+    assert (a.failures, a.opened_at, a.outstanding, b.outstanding) == (0, None, 0, 0)
+    assert "llm.failovers" not in metrics.snapshot()["counters"]
+
+
+def test_half_open_circuit_lets_a_single_trial_through(metrics):
+    router = LLMRouter([backend("a"), backend("b")], metrics, failure_threshold=1, reset_seconds=0)
+    a, b = router.backends
+    router._done(router.pick("answer", exclude=frozenset({"b"})), None, failed=True)
+
+    trial, is_trial = router._pick("answer", None, frozenset({"b"}))
+    assert (trial.name, is_trial, a.state()["circuit"]) == ("a", True, "half_open")
+    assert {router.pick("answer").name for _ in range(3)} == {"b"}
+
+    router._done(a, None, failed=True, trial=True)
+    assert (a.trial_in_flight, a.state()["circuit"]) == (False, "open")
+    trial, is_trial = router._pick("answer", None, frozenset({"b"}))
+    router._done(trial, 0.1, failed=False, trial=is_trial)
+    assert a.state()["circuit"] == "closed"
@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+
+import pytest
+
+from api.components.embedding import query_cache
+from api.components.embedding.query_cache import CachedQueryEmbeddings
+
+
+class CountingEmbeddings:
+    """Query embeddings derived from the text, recording the texts it embedded"""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return [float(len(text)), 1.0]
+
+
+class Clock:
+    now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(query_cache, "time", clock)
+    return clock
+
+
+def cached(embeddings, metrics, **kwargs):
+    return CachedQueryEmbeddings(embeddings, "model", **{"max_size": 2, "ttl_seconds": 0, "metrics": metrics, **kwargs})
+
+
+def counters(metrics):
+    return {name.rsplit(".", 1)[-1]: count for name, count in metrics.snapshot()["counters"].items() if "query_cache" in name}
+
+
+def test_normalized_queries_hit_the_cache(metrics):
+    embeddings = CountingEmbeddings()
+    cache = cached(embeddings, metrics)
+
+    assert cache.embed_query("What is a saga?") == cache.embed_query("  What is   a saga? ")
+    assert embeddings.embedded == ["What is a saga?"]
+    assert counters(metrics) == {"miss": 1, "hit": 1}
+
+
+def test_evicts_the_least_recently_used(metrics):
+    embeddings = CountingEmbeddings()
+    cache = cached(embeddings, metrics)
+    for text in ["first", "second", "first", "third", "first", "second"]:
+        cache.embed_query(text)
+
+    assert embeddings.embedded == ["first", "second", "third", "second"]
+    assert counters(metrics)["evicted"] == 2
+
+
+def test_expired_entries_are_embedded_again(metrics, clock):
+    embeddings = CountingEmbeddings()
+    cache = cached(embeddings, metrics, ttl_seconds=60)
+    cache.embed_query("saga")
+
+    clock.now += 30
+    cache.embed_query("saga")
+    clock.now += 61
+    cache.embed_query("saga")
+
+    assert embeddings.embedded == ["saga", "saga"]
+
+
+def test_entries_survive_in_sqlite(metrics, tmp_path):
+    path = str(tmp_path / "queries.sqlite")
+    first = cached(CountingEmbeddings(), metrics, persist_path=path)
+    for text in ["first", "second", "third"]:
+        first.embed_query(text)
+    first.flush()
+
+    embeddings = CountingEmbeddings()
+    second = cached(embeddings, metrics, persist_path=path)
+
+    assert second.embed_query("first") == [5.0, 1.0]
+    assert embeddings.embedded == []
+    assert counters(metrics)["disk_hit"] == 1
+
+
+def test_sqlite_writes_are_batched(metrics, tmp_path):
+    path = str(tmp_path / "queries.sqlite")
+    cache = cached(CountingEmbeddings(), metrics, max_size=10, persist_path=path)
+    flushes = []
+    flush = cache.flush
+
+    def counting_flush():
+        flushes.append(len(cache._pending))
+        flush()
+
+    cache.flush = counting_flush
+    # hold the writer thread so the entries queue up behind one flush
+    release = threading.Event()
+    cache._writer.submit(release.wait)
+    for text in ["first", "second", "third"]:
+        cache.embed_query(text)
+    release.set()
+    cache._writer.shutdown(wait=True)
+
+    assert flushes == [3]
+    rows = sqlite3.connect(path).execute("SELECT key FROM query_embeddings").fetchall()
+    assert sorted(key.split("\x00")[1] for key, in rows) == ["first", "second", "third"]
+
+
+def test_clear_empties_both_tiers(metrics, tmp_path):
+    embeddings = CountingEmbeddings()
+    cache = cached(embeddings, metrics, persist_path=str(tmp_path / "queries.sqlite"))
+    cache.embed_query("saga")
+    cache.flush()
+
+    cache.clear()
+    cache.embed_query("saga")
+
+    assert embeddings.embedded == ["saga", "saga"]
@@ -0,0 +1,58 @@
+import pytest
+
+from api.server.ragchat.ragchat_service import build_rag_prompt
+
+CONTEXT_PROMPT = "Context:\n{context}\n\nQuestion: {question}"
+
+
+def test_stable_prefix_puts_the_context_in_the_last_message():
+    prompt = build_rag_prompt("Answer from the context.", CONTEXT_PROMPT, "stable_prefix")
+
+    messages = prompt.format_messages(chat_history=[], context="the chunks", question="why?")
+
+    assert [message.type for message in messages] == ["system", "human"]
+    assert messages[0].content == "Answer from the context."
+    assert messages[-1].content == "Context:\nthe chunks\n\nQuestion: why?"
+
+
+def test_stable_prefix_keeps_the_prefix_across_turns():
+    prompt = build_rag_prompt("Answer from the context.", CONTEXT_PROMPT, "stable_prefix")
+
+    first = prompt.format_messages(chat_history=[], context="chunks 1", question="q1")
+    second = prompt.format_messages(chat_history=[("human", "q1"), ("ai", "a1")], context="chunks 2", question="q2")
+
+    assert second[0] == first[0]
+
+
+def test_context_in_system():
+    prompt = build_rag_prompt("Answer from: {context}", CONTEXT_PROMPT, "context_in_system")
+
+    messages = prompt.format_messages(chat_history=[], context="the chunks", question="why?")
+
+    assert messages[0].content == "Answer from: the chunks"
+    assert messages[-1].content == "why?"
+
+
+@pytest.mark.parametrize("system_prompt, last_message", [
+    ("Answer from: {context}", "why?"),
+    ("Answer from the context.", "Context:\nthe chunks\n\nQuestion: why?"),
+])
+def test_auto_layout_follows_the_system_prompt(system_prompt, last_message):
+    prompt = build_rag_prompt(system_prompt, CONTEXT_PROMPT, "auto")
+
+    messages = prompt.format_messages(chat_history=[], context="the chunks", question="why?")
+
+    assert messages[-1].content == last_message
+
+
+@pytest.mark.parametrize("system_prompt, layout", [
+    ("Answer from: {context}", "stable_prefix"),
+    ("Answer from the context.", "context_in_system"),
+])
+def test_system_prompt_must_match_the_layout(system_prompt, layout):
+    with pytest.raises(ValueError):
+        build_rag_prompt(system_prompt, CONTEXT_PROMPT, layout)
+
+
+def test_shipped_settings_build(settings):
+    build_rag_prompt(settings.ui.rag_system_prompt, settings.ui.rag_context_prompt, settings.rag.prompt_layout)
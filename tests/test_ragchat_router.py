@@ -0,0 +1,56 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from injector import Injector
+from langchain_core.documents import Document
+
+from api.arahlauncher import create_app
+from api.server.ragchat.generation_scheduler import SchedulerFullError
+from api.server.ragchat.ragchat_router import to_openai_sse_stream
+from api.server.ragchat.ragchat_service import RagChatService
+from api.settings.settings import Settings
+
+
+async def chain_output():
+    yield {"question": "What is a saga?"}
+    yield {"queue_position": 1, "queue_length": 2}
+    yield {"context": [Document(page_content="sagas", metadata={"page": 3, "source": "patterns.pdf"})]}
+    for piece in ["A ", "saga ", "is..."]:
+        yield {"answer": piece}
+
+
+def events(stream):
+    async def collect():
+        return [event async for event in stream]
+    return asyncio.run(collect())
+
+
+def test_openai_sse_stream():
+    stream = events(to_openai_sse_stream(chain_output(), "stub"))
+
+    assert stream[0].startswith("event: queue\n")
+    assert json.loads(stream[1].split("data: ")[1])["sources"] == [{"page": 3, "source": "patterns.pdf"}]
+    deltas = [json.loads(event[len("data: "):])["choices"][0] for event in stream[2:6]]
+    assert "".join(delta["delta"].get("content", "") for delta in deltas) == "A saga is..."
+    assert deltas[-1]["finish_reason"] == "stop"
+    done = json.loads(stream[6].split("data: ")[1])
+    assert done["completion_chunks"] == 3
+    assert "usage" not in done
+    assert stream[-1] == "data: [DONE]\n\n"
+
+
+def test_full_queue_rejects_a_stream_before_it_starts(settings):
+    settings.server.warmup = False
+
+    def astream(message, session_id, user_id):
+        raise SchedulerFullError("The generation queue is full (64 requests waiting)")
+
+    injector = Injector()
+    injector.binder.bind(Settings, to=settings)
+    injector.binder.bind(RagChatService, to=SimpleNamespace(astream=astream, settings=settings))
+
+    response = TestClient(create_app(injector)).post("/v1/arahchat", json={"message": "hi", "stream": True, "session_id": "s", "user_id": "u"})
+
+    assert response.status_code == 503
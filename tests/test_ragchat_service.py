@@ -0,0 +1,86 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from api.components.metrics.metrics_component import StageTimingHandler
+from api.server.ragchat.ragchat_service import RagChatService
+
+HISTORY = [HumanMessage(content="What is the strangler fig pattern?"), AIMessage(content="An incremental migration pattern.")]
+
+
+@pytest.mark.parametrize("mode, history, question, condense", [
+    ("always", [], "What is event sourcing?", True),
+    ("history", [], "And what about it?", False),
+    ("history", HISTORY, "What is event sourcing in a microservice architecture?", True),
+    ("heuristic", [], "And what about it?", False),
+    ("heuristic", HISTORY, "And what about it?", True),
+    ("heuristic", HISTORY, "Why?", True),
+    ("heuristic", HISTORY, "What is event sourcing in a microservice architecture?", False),
+])
+def test_should_condense(settings, metrics, mode, history, question, condense):
+    settings.rag.condense_question = mode
+    service = SimpleNamespace(settings=settings, metrics=metrics)
+
+    assert RagChatService._should_condense(service, {"question": question, "chat_history": history}) is condense
+    assert metrics.snapshot()["counters"]["rephrase.invoked" if condense else "rephrase.skipped"] == 1
+
+
+@pytest.fixture
+def speculating(metrics):
+    """Service with speculative retrieval over a retrieval that records its questions"""
+    service = RagChatService.__new__(RagChatService)
+    service.metrics = metrics
+    service._speculations = {}
+    service._speculation_executor = ThreadPoolExecutor(max_workers=1)
+    service.retrieved = []
+    service._retrieval = RunnableLambda(lambda inputs: service.retrieved.append(inputs['standalone_question']) or f"docs of {inputs['standalone_question']}")
+    yield service
+    service._speculation_executor.shutdown()
+
+
+def retrieve_config(request_id):
+    return {"configurable": {"request_id": request_id}}
+
+
+def test_speculation_is_used_for_the_same_question(speculating, metrics):
+    request_id = speculating._speculate("What is a saga?", StageTimingHandler(metrics, set()))
+
+    docs = speculating._retrieve({'question': "What is a saga?", 'standalone_question': "what is a saga"}, retrieve_config(request_id))
+
+    assert docs == "docs of What is a saga?"
+    assert speculating.retrieved == ["What is a saga?"]
+    assert metrics.snapshot()["counters"]["retrieval.speculative_hit"] == 1
+    assert speculating._speculations == {}
+
+
+def test_speculation_is_dropped_for_a_rephrased_question(speculating, metrics):
+    request_id = speculating._speculate("And why?", StageTimingHandler(metrics, set()))
+
+    docs = speculating._retrieve({'question': "And why?", 'standalone_question': "Why use a saga?"}, retrieve_config(request_id))
+
+    assert docs == "docs of Why use a saga?"
+    assert metrics.snapshot()["counters"]["retrieval.speculative_miss"] == 1
+    assert speculating._speculations == {}
+
+
+def test_async_speculation_runs_on_the_event_loop(speculating, metrics):
+    async def run():
+        request_id = speculating._speculate("What is a saga?", StageTimingHandler(metrics, set()), is_async=True)
+        assert asyncio.isfuture(speculating._speculations[request_id])
+        return await speculating._aretrieve({'question': "What is a saga?", 'standalone_question': "What is a saga?"}, retrieve_config(request_id))
+
+    assert asyncio.run(run()) == "docs of What is a saga?"
+    assert speculating.retrieved == ["What is a saga?"]
+
+
+def test_unused_speculation_is_discarded(speculating, metrics):
+    request_id = speculating._speculate("What is a saga?", StageTimingHandler(metrics, set()))
+
+    speculating._discard_speculation(request_id)
+
+    assert speculating._speculations == {}
+    assert speculating._retrieve({'question': "q", 'standalone_question': "q"}, retrieve_config(request_id)) == "docs of q"
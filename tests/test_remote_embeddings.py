@@ -0,0 +1,62 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from api.components.embedding.remote import RemoteEmbeddings
+from scripts.stub_llm_server import embedding, make_handler
+
+
+@pytest.fixture
+def stub_server(request):
+    """The stub inference server of scripts/stub_llm_server.py on a free port"""
+    latency_ms = getattr(request, "param", 20)
+    args = argparse.Namespace(model="stub", answer="stub", latency_ms=latency_ms, token_latency_ms=0, fail_rate=0.0, embedding_size=8)
+    stats = {"lock": threading.Lock(), "requests": 0, "in_flight": 0, "max_in_flight": 0, "slots": {}, "embedded": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1", stats
+    server.shutdown()
+    server.server_close()
+
+
+def test_documents_are_sent_in_batches(stub_server):
+    url, stats = stub_server
+    embeddings = RemoteEmbeddings(url, "stub", batch_size=2)
+    texts = [f"text {i}" for i in range(5)]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert vectors == [pytest.approx(embedding(text, 8)) for text in texts]
+    assert stats["requests"] == 3
+    embeddings.close()
+
+
+def test_concurrent_queries_are_coalesced(stub_server):
+    url, stats = stub_server
+    embeddings = RemoteEmbeddings(url, "stub", batch_size=16, coalesce_window_ms=200)
+    texts = [f"question {i}" for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        vectors = list(executor.map(embeddings.embed_query, texts))
+
+    assert vectors == [pytest.approx(embedding(text, 8)) for text in texts]
+    assert stats["embedded"] == len(texts)
+    assert stats["requests"] < len(texts)
+    embeddings.close()
+
+
+@pytest.mark.parametrize("stub_server", [200], indirect=True)
+def test_coalesced_batches_are_sent_concurrently(stub_server):
+    url, stats = stub_server
+    embeddings = RemoteEmbeddings(url, "stub", batch_size=2, max_connections=4, coalesce_window_ms=50)
+    texts = [f"question {i}" for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        vectors = list(executor.map(embeddings.embed_query, texts))
+
+    assert vectors == [pytest.approx(embedding(text, 8)) for text in texts]
+    assert stats["max_in_flight"] > 1
+    embeddings.close()
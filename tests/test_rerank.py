@@ -0,0 +1,66 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.documents import Document
+
+from api.components.rerank.rerank_component import RerankComponent
+
+
+class FakeCrossEncoder:
+    """Scores a pair by the number of question words found in the chunk"""
+
+    def __init__(self, model, max_length, device):
+        self.model = model
+        self.calls = []
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        self.calls.append((pairs, batch_size))
+        return [sum(word in chunk.split() for word in question.split()) for question, chunk in pairs]
+
+
+@pytest.fixture
+def reranker(settings, metrics, monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=FakeCrossEncoder))
+    settings.rag.rerank.enabled = True
+    settings.rag.rerank.top_n = 2
+    settings.rag.rerank.batch_size = 4
+    return RerankComponent(settings, metrics)
+
+
+DOCS = [
+    Document(page_content="saga", metadata={"page": 1}),
+    Document(page_content="orchestrated saga compensation", metadata={"page": 2}),
+    Document(page_content="event sourcing", metadata={"page": 3}),
+    Document(page_content="saga compensation", metadata={"page": 4}),
+]
+
+
+def test_keeps_the_top_n_best_first(reranker):
+    ranked = reranker.rerank("orchestrated saga compensation", DOCS)
+
+    assert [(doc.metadata["page"], doc.metadata["rerank_score"]) for doc in ranked] == [(2, 3.0), (4, 2.0)]
+    assert "rerank_score" not in DOCS[1].metadata
+    assert reranker.model.calls == [([("orchestrated saga compensation", doc.page_content) for doc in DOCS], 4)]
+
+
+def test_fewer_candidates_than_top_n(reranker):
+    ranked = reranker.rerank("saga", DOCS[2:3])
+
+    assert [doc.metadata["page"] for doc in ranked] == [3]
+    assert reranker.rerank("saga", []) == []
+
+
+def test_records_the_score_distribution(reranker, metrics):
+    reranker.rerank("orchestrated saga compensation", DOCS)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["rerank.candidates"] == 4
+    assert snapshot["values"]["rerank.top_score"]["max"] == 3.0
+    assert snapshot["values"]["rerank.cutoff_score"]["max"] == 2.0
+
+
+def test_disabled_reranker_loads_no_model(settings, metrics):
+    settings.rag.rerank.enabled = False
+
+    assert RerankComponent(settings, metrics).model is None
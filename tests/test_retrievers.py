@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import Qdrant
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from api.components.qdrant.collection import create_collection
+from api.components.qdrant.retrievers import HybridQdrantRetriever, MMRQdrantRetriever, maximal_marginal_relevance
+from api.components.qdrant.sparse import BM25SparseEncoder
+
+TEXTS = [f"chunk {i} about the strangler fig pattern and service {i}" for i in range(10)] + [
+    "event sourcing stores every change of the aggregate as an event",
+]
+
+
+def vectorstore(embeddings, sparse_vector_name=None):
+    """In-memory collection with the point layout written by embeddocs.py"""
+    client = QdrantClient(location=":memory:")
+    sparse_config = {sparse_vector_name: models.SparseVectorParams()} if sparse_vector_name else None
+    create_collection(client, "chunks", 16, sparse_vectors_config=sparse_config)
+    encoder = BM25SparseEncoder()
+    points = []
+    for index, text in enumerate(TEXTS):
+        vector = embeddings.embed_query(text)
+        if sparse_vector_name:
+            vector = {"": vector, sparse_vector_name: encoder.encode_document(text)}
+        points.append(models.PointStruct(id=index, vector=vector, payload={"page_content": text, "metadata": {"page": index}}))
+    client.upsert("chunks", points=points)
+    return Qdrant(client=client, collection_name="chunks", embeddings=embeddings)
+
+
+def test_mmr_prefers_diverse_vectors():
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.7, 0.7]], dtype=np.float32)
+    assert maximal_marginal_relevance(np.array([1.0, 0.0]), vectors, 2, 0.3) == [0, 2]
+    assert maximal_marginal_relevance(np.array([1.0, 0.0]), vectors[:0], 2, 0.5) == []
+
+
+@pytest.mark.parametrize("sparse_vector_name", [None, "bm25"])
+def test_mmr_retriever(embeddings, sparse_vector_name):
+    retriever = MMRQdrantRetriever(vectorstore=vectorstore(embeddings, sparse_vector_name), k=3, fetch_k=8)
+
+    docs = retriever.invoke(TEXTS[2])
+
+    assert len(docs) == 3
+    assert docs[0].page_content == TEXTS[2]
+    assert len({doc.metadata["_id"] for doc in docs}) == 3
+
+
+def test_mmr_dense_vector_of_hits(embeddings):
+    retriever = MMRQdrantRetriever(vectorstore=vectorstore(embeddings))
+    named = models.ScoredPoint(id=1, version=0, score=1.0, vector={"": [1.0, 0.0], "bm25": models.SparseVector(indices=[1], values=[1.0])})
+    unnamed = models.ScoredPoint(id=2, version=0, score=1.0, vector=[0.0, 1.0])
+
+    assert retriever._dense_vector(named) == [1.0, 0.0]
+    assert retriever._dense_vector(unnamed) == [0.0, 1.0]
+
+
+def test_hybrid_retriever_fuses_dense_and_sparse(embeddings):
+    retriever = HybridQdrantRetriever(vectorstore=vectorstore(embeddings, "bm25"), encoder=BM25SparseEncoder(), k=3)
+
+    docs = retriever.invoke("event sourcing aggregate")
+
+    assert len(docs) == 3
+    assert TEXTS[-1] in [doc.page_content for doc in docs]
+    assert all("rrf_score" in doc.metadata for doc in docs)
+    scores = [doc.metadata["rrf_score"] for doc in docs]
+    assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,39 @@
+from api.components.llm.slots import SlotAffinity
+
+
+def test_key_keeps_its_slot():
+    slots = SlotAffinity(2)
+    slot = slots.acquire(("s1", "answer"))
+    slots.release(slot)
+
+    assert slots.acquire(("s1", "answer")) == slot
+
+
+def test_roles_of_a_session_get_their_own_slot():
+    slots = SlotAffinity(2)
+    answer = slots.acquire(("s1", "answer"))
+    slots.release(answer)
+    rephrase = slots.acquire(("s1", "rephrase"))
+    slots.release(rephrase)
+
+    assert rephrase != answer
+    assert slots.slot_of(("s1", "answer")) == answer
+    assert slots.slot_of(("s1", "rephrase")) == rephrase
+
+
+def test_busy_slot_moves_to_an_idle_one():
+    slots = SlotAffinity(2)
+    first = slots.acquire(("s1", "answer"))
+    second = slots.acquire(("s1", "answer"))
+
+    assert second != first
+    assert slots.slot_of(("s1", "answer")) == second
+
+
+def test_sessions_are_bounded():
+    slots = SlotAffinity(1, max_sessions=2)
+    for session in ("s1", "s2", "s3"):
+        slots.release(slots.acquire((session, "answer")))
+
+    assert slots.slot_of(("s1", "answer")) is None
+    assert slots.slot_of(("s3", "answer")) == 0